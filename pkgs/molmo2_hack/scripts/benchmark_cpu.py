@@ -0,0 +1,91 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from run_molmo2_frames import build_inputs, generate, load_frames, load_model
+
+"""
+Compares the default load path (device_map/dtype auto) against the CPU profile.
+Each configuration runs in its own subprocess so peak RSS is not polluted by
+the previous model still sitting in the allocator.
+"""
+
+CONFIGS = {
+    "default": {"profile": "auto", "quantize": "none"},
+    "cpu": {"profile": "cpu", "quantize": "none"},
+    "cpu-int8": {"profile": "cpu", "quantize": "int8"},
+}
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_single(args):
+    cfg = CONFIGS[args.single]
+    images = load_frames(args.frames, args.max_frames)
+
+    t0 = time.perf_counter()
+    processor, model = load_model(cfg["profile"], args.threads, cfg["quantize"])
+    load_s = time.perf_counter() - t0
+
+    inputs = build_inputs(processor, model, images)
+    t0 = time.perf_counter()
+    _, n_tokens = generate(processor, model, inputs, args.max_new_tokens)
+    gen_s = time.perf_counter() - t0
+
+    print(json.dumps({
+        "config": args.single,
+        "load_s": round(load_s, 2),
+        "generate_s": round(gen_s, 2),
+        "new_tokens": n_tokens,
+        "tokens_per_s": round(n_tokens / gen_s, 3) if gen_s else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }))
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--frames", type=str, default="frames")
+    p.add_argument("--max_frames", type=int, default=12)
+    p.add_argument("--max_new_tokens", type=int, default=64)
+    p.add_argument("--threads", type=int, default=None)
+    p.add_argument("--configs", type=str, default="default,cpu,cpu-int8",
+                   help=f"comma separated subset of: {', '.join(CONFIGS)}")
+    p.add_argument("--out", type=str, default=None, help="optional JSON results file")
+    p.add_argument("--single", choices=list(CONFIGS), help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.single:
+        run_single(args)
+        return
+
+    results = []
+    for name in [c.strip() for c in args.configs.split(",") if c.strip()]:
+        if name not in CONFIGS:
+            p.error(f"unknown config: {name}")
+        cmd = [
+            sys.executable, __file__, "--single", name,
+            "--frames", args.frames,
+            "--max_frames", str(args.max_frames),
+            "--max_new_tokens", str(args.max_new_tokens),
+        ]
+        if args.threads:
+            cmd += ["--threads", str(args.threads)]
+        print(f"Running {name} ...", flush=True)
+        proc = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'config':<10} {'load_s':>8} {'gen_s':>8} {'tok/s':>8} {'peak_rss_mb':>12}")
+    for r in results:
+        print(f"{r['config']:<10} {r['load_s']:>8} {r['generate_s']:>8} "
+              f"{r['tokens_per_s']:>8} {r['peak_rss_mb']:>12}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -2,68 +2,140 @@
 
 ## scripts/download_sample_video.py
 
+import argparse
 import os
+import shutil
+import tarfile
+import urllib.request
 from pathlib import Path
-from huggingface_hub import hf_hub_download
+from huggingface_hub import hf_hub_download, hf_hub_url
+from huggingface_hub.utils import build_hf_headers
 from dotenv import load_dotenv
 
 """
 Downloads a sample traffic/accident-ish video from a public HF dataset tar,
-then extracts ONE mp4 from it.
+then extracts ONE mp4 (or --count N) from it.
 This keeps the demo self-contained when users don't have their own videos.
+
+--stream reads the tar straight off the HTTP response in a single sequential
+pass ("r|" mode) and stops as soon as enough mp4s were written, so the full
+train.tar is never downloaded. Nothing is ever held in memory whole: members
+are copied in fixed-size chunks and local copies are hardlinks when possible.
 """
 
 DATASET_ID = "smart-dashcam/motorcycle-accident-driving-datasets"
 TAR_NAME = "train.tar"
+CHUNK_SIZE = 1024 * 1024
+
+def is_mp4(member):
+    return member.isfile() and member.name.lower().endswith(".mp4")
+
+def is_preferred(member):
+    n = member.name.lower()
+    return "accident" in n or "crash" in n or "collision" in n
+
+def link_or_copy(src, dst):
+    """Hardlink when on the same filesystem, otherwise a kernel-side copy
+    (copy_file_range / sendfile, which also reflinks on btrfs/xfs)."""
+    src, dst = Path(src).resolve(), Path(dst)
+    if dst.exists() or dst.is_symlink():
+        if dst.resolve() == src:
+            return
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def write_member(tf, member, out_dir, written):
+    # Flatten to the basename so archive paths can never escape out_dir; same-named
+    # mp4s from different archive directories get a -2, -3, ... suffix instead of
+    # overwriting each other
+    name = Path(member.name)
+    taken = {path.name for _, path in written}
+    dst = out_dir / name.name
+    n = 1
+    while dst.name in taken:
+        n += 1
+        dst = out_dir / f"{name.stem}-{n}{name.suffix}"
+    src = tf.extractfile(member)
+    with src, open(dst, "wb") as f:
+        shutil.copyfileobj(src, f, CHUNK_SIZE)
+    return dst
+
+def extract_streaming(fileobj, out_dir, count):
+    """Single sequential pass; stops after `count` mp4s."""
+    written = []
+    with tarfile.open(fileobj=fileobj, mode="r|") as tf:
+        for member in tf:
+            if not is_mp4(member):
+                continue
+            print(f"Extracting sample video: {member.name}")
+            written.append((member, write_member(tf, member, out_dir, written)))
+            if len(written) >= count:
+                break
+    return written
+
+def extract_preferred(tar_path, out_dir, count):
+    """Indexes the local tar once, preferring accident-like names."""
+    with tarfile.open(tar_path, "r") as tf:
+        members = [m for m in tf if is_mp4(m)]
+        if not members:
+            return []
+        members.sort(key=lambda m: not is_preferred(m))  # stable: archive order otherwise
+        written = []
+        for member in members[:count]:
+            print(f"Extracting sample video: {member.name}")
+            written.append((member, write_member(tf, member, out_dir, written)))
+        return written
+
+def open_remote_tar(token):
+    url = hf_hub_url(repo_id=DATASET_ID, filename=TAR_NAME, repo_type="dataset")
+    req = urllib.request.Request(url, headers=build_hf_headers(token=token))
+    return urllib.request.urlopen(req)
 
 def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--out", type=str, default="videos")
+    p.add_argument("--count", type=int, default=1, help="number of mp4 samples to extract")
+    p.add_argument("--stream", action="store_true",
+                   help="stream the tar over HTTP and stop at the first matching mp4(s)")
+    args = p.parse_args()
+
     load_dotenv()
 
     token = os.getenv("HF_TOKEN") or None
 
-    out_dir = Path("videos")
+    out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    print(f"Downloading {TAR_NAME} from {DATASET_ID} ...")
-    tar_path = hf_hub_download(
-        repo_id=DATASET_ID,
-        filename=TAR_NAME,
-        repo_type="dataset",
-        token=token,
-    )
-
-    # Copy tar into local folder for convenience
-    local_tar = out_dir / TAR_NAME
-    if not local_tar.exists():
-        local_tar.write_bytes(Path(tar_path).read_bytes())
-    print(f"Saved: {local_tar}")
-
-    # Find an mp4 inside tar and extract the first match
-    import tarfile
-
-    with tarfile.open(local_tar, "r") as tf:
-        members = [m for m in tf.getmembers() if m.name.lower().endswith(".mp4")]
-        if not members:
-            raise RuntimeError("No .mp4 files found in the tar.")
-        # Prefer accident-like names if present
-        preferred = None
-        for m in members:
-            n = m.name.lower()
-            if "accident" in n or "crash" in n or "collision" in n:
-                preferred = m
-                break
-        target = preferred or members[0]
-        print(f"Extracting sample video: {target.name}")
-
-        tf.extract(target, path=out_dir)
+    if args.stream:
+        print(f"Streaming {TAR_NAME} from {DATASET_ID} ...")
+        with open_remote_tar(token) as resp:
+            written = extract_streaming(resp, out_dir, args.count)
+    else:
+        print(f"Downloading {TAR_NAME} from {DATASET_ID} ...")
+        tar_path = hf_hub_download(
+            repo_id=DATASET_ID,
+            filename=TAR_NAME,
+            repo_type="dataset",
+            token=token,
+        )
+
+        # Link tar into local folder for convenience (no second copy of the bytes)
+        local_tar = out_dir / TAR_NAME
+        link_or_copy(tar_path, local_tar)
+        print(f"Saved: {local_tar}")
+
+        written = extract_preferred(local_tar, out_dir, args.count)
+
+    if not written:
+        raise RuntimeError("No .mp4 files found in the tar.")
 
     # Normalize to a stable path: videos/sample.mp4
-    extracted_path = out_dir / target.name
-    # If it extracted into subfolders, resolve it
-    extracted_path = extracted_path.resolve()
-
+    target = next((path for m, path in written if is_preferred(m)), written[0][1])
     sample_path = out_dir / "sample.mp4"
-    sample_path.write_bytes(Path(extracted_path).read_bytes())
+    link_or_copy(target, sample_path)
     print(f"Ready: {sample_path}")
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BatchFeature
+
+"""
+Content-addressed cache of the processor's image-side outputs (pixel tensors etc).
+
+Entries live under <frames hash>/<config hash>: the frames hash covers the JPEG
+bytes in order, the config hash the image processor config and call kwargs.
+Any change to the clip or to the preprocessing invalidates the entry, while
+changing SAFETY_PROMPT does not. Tensors are stored as one .npy per field and
+loaded memory-mapped, so a hit skips JPEG decode, resize and normalization.
+"""
+
+META_NAME = "meta.json"
+
+def hash_frames(frame_paths, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    for fp in frame_paths:
+        with open(fp, "rb") as f:
+            while chunk := f.read(chunk_size):
+                h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _config_fingerprint(image_processor, kwargs):
+    try:
+        config = image_processor.to_dict()
+    except AttributeError:
+        config = {"class": type(image_processor).__name__}
+    call = {k: repr(v) for k, v in sorted(kwargs.items())}
+    blob = json.dumps({"config": config, "call": call}, sort_keys=True, default=repr)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _decode(images):
+    # same decode as open_frames(decode=True), for lazily opened frames that miss the cache
+    if isinstance(images, (list, tuple)):
+        return type(images)(_decode(image) for image in images)
+    if isinstance(images, Image.Image):
+        return images.convert("RGB")
+    return images
+
+class FrameCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.root = Path(cache_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, frames_key, variant=None):
+        clip_dir = self.root / frames_key[:2] / frames_key
+        return clip_dir if variant is None else clip_dir / variant
+
+    def load(self, frames_key, variant):
+        entry = self._entry_dir(frames_key, variant)
+        meta_path = entry / META_NAME
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        data = dict(meta["values"])
+        for name in meta["arrays"]:
+            # copy-on-write mmap: pages are read lazily and torch gets a writable view
+            arr = np.load(entry / f"{name}.npy", mmap_mode="c")
+            data[name] = torch.from_numpy(arr) if meta["tensor_type"] == "pt" else arr
+        os.utime(meta_path)  # LRU bookkeeping for eviction
+        return BatchFeature(data=data)
+
+    def store(self, frames_key, variant, features, tensor_type):
+        entry = self._entry_dir(frames_key, variant)
+        tmp = entry.with_name(entry.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        arrays, values = [], {}
+        for name, value in features.items():
+            if isinstance(value, torch.Tensor):
+                value = value.detach().cpu().numpy()
+            if isinstance(value, np.ndarray):
+                np.save(tmp / f"{name}.npy", value)
+                arrays.append(name)
+            else:
+                values[name] = value
+        meta = {"arrays": arrays, "values": values, "tensor_type": tensor_type}
+        try:
+            meta_json = json.dumps(meta)
+        except TypeError:
+            # nested tensors / objects we cannot round-trip: just don't cache this one
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        (tmp / META_NAME).write_text(meta_json, encoding="utf-8")
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for meta_path in self.root.glob(f"*/*/*/{META_NAME}"):
+            entry = meta_path.parent
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((meta_path.stat().st_mtime, size, entry))
+            total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            try:
+                entry.parent.rmdir()  # drop the clip dir once its last variant is gone
+            except OSError:
+                pass
+
+    def attach(self, processor, frame_paths):
+        """
+        Route processor.image_processor through the cache for these frames.
+        Returns True if some variant of the clip is cached, in which case the
+        caller can hand the processor undecoded (lazy) images. The variant the
+        processor asks for is only known at call time; if that one misses, the
+        shim decodes the lazy images itself before preprocessing them. The key
+        applies to the next call only, so attach again before every clip.
+        """
+        shim = processor.image_processor
+        if not isinstance(shim, CachedImageProcessor):
+            shim = CachedImageProcessor(shim, self)
+            processor.image_processor = shim
+        shim.frames_key = hash_frames(frame_paths)
+        clip_dir = self._entry_dir(shim.frames_key)
+        return any(clip_dir.glob(f"*/{META_NAME}"))
+
+class CachedImageProcessor:
+    """Wraps an image processor; anything other than __call__ is forwarded."""
+
+    def __init__(self, image_processor, cache):
+        self._inner = image_processor
+        self._cache = cache
+        self.frames_key = None
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def __call__(self, images, **kwargs):
+        # one attach() covers one call; later calls with other images must not
+        # be served the attached clip's tensors
+        frames_key, self.frames_key = self.frames_key, None
+        if frames_key is None:
+            return self._inner(images, **kwargs)
+
+        variant = _config_fingerprint(self._inner, kwargs)
+        cached = self._cache.load(frames_key, variant)
+        if cached is not None:
+            self._cache.hits += 1
+            return cached
+
+        self._cache.misses += 1
+        features = self._inner(_decode(images), **kwargs)
+        tensor_type = "pt" if any(isinstance(v, torch.Tensor) for v in features.values()) else "np"
+        self._cache.store(frames_key, variant, features, tensor_type)
+        return features
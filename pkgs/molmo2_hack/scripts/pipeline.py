@@ -0,0 +1,201 @@
+import argparse
+import copy
+import queue
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from PIL import Image
+
+from run_molmo2_frames import add_model_args, build_inputs, generate, load_model
+
+"""
+End-to-end incident video pipeline: clip -> ffmpeg decode -> frame selection ->
+processor preprocessing -> Molmo2 generate, in one process with the model loaded once.
+
+Each stage runs in its own thread and hands work on through a bounded queue, so
+clip N+1 is decoded and preprocessed while clip N is generating, and a slow
+stage blocks the ones upstream of it (backpressure) instead of piling up frames
+in memory. Frames never touch disk: ffmpeg writes raw RGB to a pipe.
+
+  python scripts/pipeline.py videos/sample.mp4
+  python scripts/pipeline.py --watch incoming/ --out_dir summaries/
+"""
+
+STOP = object()
+
+@dataclass
+class Job:
+    video: Path
+    images: list = None
+    inputs: dict = None
+    text: str = None
+    timings: dict = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+def probe_size(video):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height", "-of", "csv=p=0:s=x", str(video)],
+        check=True, capture_output=True, text=True,
+    ).stdout.strip()
+    w, h = out.splitlines()[0].split("x")
+    return int(w), int(h)
+
+def decode_frames(video, fps, scale, max_frames):
+    """ffmpeg -> rawvideo pipe. -frames:v stops decoding once max_frames are out,
+    which is the same selection extract_frames.py makes by truncating."""
+    src_w, src_h = probe_size(video)
+    w = scale
+    h = max(2, round(src_h * scale / src_w / 2) * 2)
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-i", str(video),
+        "-vf", f"fps={fps},scale={w}:{h}",
+        "-frames:v", str(max_frames),
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+    ]
+    frame_bytes = w * h * 3
+    images = []
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            images.append(Image.frombytes("RGB", (w, h), buf))
+    if proc.returncode not in (0, None):
+        raise RuntimeError(f"ffmpeg failed on {video} (exit {proc.returncode})")
+    if not images:
+        raise RuntimeError(f"No frames decoded from {video}")
+    return images
+
+class Stage(threading.Thread):
+    def __init__(self, name, fn, inbox, outbox):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.busy_s = 0.0
+        self.count = 0
+
+    def run(self):
+        while True:
+            job = self.inbox.get()
+            if job is STOP:
+                if self.outbox is not None:
+                    self.outbox.put(STOP)
+                return
+            wait = time.perf_counter() - job.enqueued_at
+            t0 = time.perf_counter()
+            try:
+                self.fn(job)
+            except Exception as e:
+                # one bad clip must not take down a watching pipeline
+                print(f"[{self.name}] {job.video.name}: {e}")
+                continue
+            elapsed = time.perf_counter() - t0
+            self.busy_s += elapsed
+            self.count += 1
+            job.timings[self.name] = (round(wait, 3), round(elapsed, 3))
+            if self.outbox is not None:
+                job.enqueued_at = time.perf_counter()
+                self.outbox.put(job)  # blocks when downstream is full
+
+def watch_dir(directory, poll_s, pattern="*.mp4"):
+    """Yields new clips once their size is stable across two polls
+    (dashcams copy files in over several seconds)."""
+    seen = set()
+    pending = {}
+    while True:
+        for path in sorted(Path(directory).glob(pattern)):
+            if path in seen:
+                continue
+            size = path.stat().st_size
+            if pending.get(path) == size:
+                seen.add(path)
+                del pending[path]
+                yield path
+            else:
+                pending[path] = size
+        time.sleep(poll_s)
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("videos", nargs="*", help="clips to process")
+    p.add_argument("--watch", type=str, default=None, help="directory to watch for new .mp4 clips")
+    p.add_argument("--poll", type=float, default=2.0)
+    p.add_argument("--out_dir", type=str, default=None, help="write <clip>.txt summaries here")
+    p.add_argument("--fps", type=float, default=2.0)
+    p.add_argument("--max_frames", type=int, default=12)
+    p.add_argument("--scale", type=int, default=640, help="resize width, keep aspect")
+    p.add_argument("--max_new_tokens", type=int, default=256)
+    p.add_argument("--queue_size", type=int, default=2, help="bound of each inter-stage queue")
+    add_model_args(p)
+    args = p.parse_args()
+
+    if not args.videos and not args.watch:
+        p.error("give clip paths and/or --watch DIR")
+    if args.quantize != "none" and args.profile != "cpu":
+        p.error("--quantize requires --profile cpu")
+
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    if out_dir:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    processor, model = load_model(args.profile, args.threads, args.quantize)
+    # preprocess and generate run concurrently and HF fast tokenizers are not
+    # thread-safe ("Already borrowed"), so preprocess gets its own copy
+    preprocessor = copy.deepcopy(processor)
+
+    def decode(job):
+        job.images = decode_frames(job.video, args.fps, args.scale, args.max_frames)
+
+    def preprocess(job):
+        job.inputs = build_inputs(preprocessor, model, job.images)
+        job.images = None
+
+    def run_generate(job):
+        job.text, _ = generate(processor, model, job.inputs, args.max_new_tokens)
+        job.inputs = None
+
+    def emit(job):
+        if out_dir:
+            (out_dir / f"{job.video.stem}.txt").write_text(job.text, encoding="utf-8")
+        stages = " ".join(f"{k}={v[1]}s(wait {v[0]}s)" for k, v in job.timings.items())
+        print(f"== {job.video.name}: {stages}")
+        print(job.text)
+
+    queues = [queue.Queue(maxsize=args.queue_size) for _ in range(4)]
+    stages = [
+        Stage("decode", decode, queues[0], queues[1]),
+        Stage("preprocess", preprocess, queues[1], queues[2]),
+        Stage("generate", run_generate, queues[2], queues[3]),
+        Stage("emit", emit, queues[3], None),
+    ]
+    for s in stages:
+        s.start()
+
+    t0 = time.perf_counter()
+    try:
+        for video in args.videos:
+            queues[0].put(Job(Path(video)))
+        if args.watch:
+            print(f"Watching {args.watch} ...")
+            for video in watch_dir(args.watch, args.poll):
+                queues[0].put(Job(video))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queues[0].put(STOP)
+        for s in stages:
+            s.join()
+
+    total = time.perf_counter() - t0
+    print(f"Processed {stages[-1].count} clip(s) in {total:.1f}s")
+    for s in stages[:-1]:
+        util = s.busy_s / total * 100 if total else 0.0
+        print(f"  {s.name:<10} busy {s.busy_s:7.1f}s ({util:4.1f}%)")
+
+if __name__ == "__main__":
+    main()
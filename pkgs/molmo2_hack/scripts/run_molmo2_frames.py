@@ -1,9 +1,12 @@
 import argparse
+import os
 from pathlib import Path
 from PIL import Image
 import torch
 from transformers import AutoProcessor, AutoModelForImageTextToText
 
+from frame_cache import FrameCache
+
 MODEL_ID = "allenai/Molmo2-8B"
 
 SAFETY_PROMPT = """You are a safety-aware video summarizer.
@@ -14,33 +17,77 @@ Describe only abstract events in sequence. If unsure, say "uncertain".
 Task: Summarize what happens in this traffic incident video in 5-8 bullet points.
 """
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument("--frames", type=str, default="frames")
-    p.add_argument("--max_frames", type=int, default=12)
-    p.add_argument("--max_new_tokens", type=int, default=256)
-    args = p.parse_args()
+def add_model_args(p):
+    """Execution-profile flags shared with benchmark_cpu.py."""
+    p.add_argument("--profile", choices=["auto", "cpu"], default="auto",
+                   help="auto: device_map/dtype auto (GPU if present); cpu: CPU-only tuned load")
+    p.add_argument("--threads", type=int, default=None,
+                   help="torch intra-op threads for the cpu profile (default: all cores)")
+    p.add_argument("--quantize", choices=["none", "int8"], default="none",
+                   help="cpu profile only: dynamic int8 quantization of nn.Linear layers")
 
-    frame_dir = Path(args.frames)
-    frames = sorted(frame_dir.glob("*.jpg"))[: args.max_frames]
-    if not frames:
-        raise RuntimeError(f"No frames found in: {frame_dir} (expected .jpg)")
+def configure_cpu_threads(threads):
+    # intra-op threads drive the matmuls; inter-op parallelism buys nothing for a single generate()
+    threads = threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    return threads
 
-    images = [Image.open(fp).convert("RGB") for fp in frames]
+def load_model(profile="auto", threads=None, quantize="none"):
+    if profile == "auto":
+        processor = AutoProcessor.from_pretrained(
+            MODEL_ID,
+            trust_remote_code=True,
+            dtype="auto",
+            device_map="auto",
+        )
+        model = AutoModelForImageTextToText.from_pretrained(
+            MODEL_ID,
+            trust_remote_code=True,
+            dtype="auto",
+            device_map="auto",
+        )
+        return processor, model
 
-    processor = AutoProcessor.from_pretrained(
-        MODEL_ID,
-        trust_remote_code=True,
-        dtype="auto",
-        device_map="auto",
-    )
+    threads = configure_cpu_threads(threads)
+    print(f"CPU profile: threads={threads}, quantize={quantize}")
+
+    processor = AutoProcessor.from_pretrained(MODEL_ID, trust_remote_code=True)
+    # Load straight onto CPU with streamed weight materialization instead of letting
+    # accelerate plan a device map; float32 because dynamic int8 and most CPU kernels
+    # expect it (bf16 matmuls are emulated on CPUs without AMX/AVX512-BF16).
     model = AutoModelForImageTextToText.from_pretrained(
         MODEL_ID,
         trust_remote_code=True,
-        dtype="auto",
-        device_map="auto",
+        dtype=torch.float32,
+        low_cpu_mem_usage=True,
     )
+    model.eval()
+
+    if quantize == "int8":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    return processor, model
+
+def list_frames(frame_dir, max_frames):
+    frames = sorted(Path(frame_dir).glob("*.jpg"))[:max_frames]
+    if not frames:
+        raise RuntimeError(f"No frames found in: {frame_dir} (expected .jpg)")
+    return frames
+
+def open_frames(frame_paths, decode=True):
+    # Image.open only parses the header; pixels are decoded on first access,
+    # so with decode=False a frame-cache hit never pays for JPEG decoding.
+    if not decode:
+        return [Image.open(fp) for fp in frame_paths]
+    return [Image.open(fp).convert("RGB") for fp in frame_paths]
+
+def load_frames(frame_dir, max_frames):
+    return open_frames(list_frames(frame_dir, max_frames))
 
+def build_inputs(processor, model, images):
     messages = [{
         "role": "user",
         "content": [
@@ -56,13 +103,47 @@ def main():
         return_tensors="pt",
         return_dict=True,
     )
-    inputs = {k: v.to(model.device) for k, v in inputs.items()}
+    return {k: v.to(model.device) for k, v in inputs.items()}
 
+def generate(processor, model, inputs, max_new_tokens):
+    """Returns (text, number of generated tokens)."""
     with torch.inference_mode():
-        out = model.generate(**inputs, max_new_tokens=args.max_new_tokens)
+        out = model.generate(**inputs, max_new_tokens=max_new_tokens)
 
     gen = out[0, inputs["input_ids"].size(1):]
     text = processor.tokenizer.decode(gen, skip_special_tokens=True)
+    return text, gen.numel()
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--frames", type=str, default="frames")
+    p.add_argument("--max_frames", type=int, default=12)
+    p.add_argument("--max_new_tokens", type=int, default=256)
+    p.add_argument("--cache_dir", type=str, default=None,
+                   help="enable the preprocessed-frame cache in this directory")
+    p.add_argument("--cache_max_mb", type=int, default=2048,
+                   help="evict least recently used cache entries above this size")
+    add_model_args(p)
+    args = p.parse_args()
+
+    if args.quantize != "none" and args.profile != "cpu":
+        p.error("--quantize requires --profile cpu")
+
+    frame_paths = list_frames(args.frames, args.max_frames)
+    processor, model = load_model(args.profile, args.threads, args.quantize)
+
+    cache = None
+    cached = False
+    if args.cache_dir:
+        cache = FrameCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+        cached = cache.attach(processor, frame_paths)
+
+    images = open_frames(frame_paths, decode=not cached)
+    inputs = build_inputs(processor, model, images)
+    if cache:
+        print(f"Frame cache: hits={cache.hits} misses={cache.misses}")
+
+    text, _ = generate(processor, model, inputs, args.max_new_tokens)
     print(text)
 
 if __name__ == "__main__":
@@ -8,7 +8,6 @@ Requirements: 10.1-10.5
 from flask import Flask
 from flask_cors import CORS
 import os
-import logging
 
 
 def create_app(config=None):
@@ -28,27 +27,130 @@ def create_app(config=None):
         QWEN_MCP_URL=os.getenv('QWEN_MCP_URL', 'http://localhost:8080'),
         QWEN_API_KEY=os.getenv('QWEN_API_KEY', ''),
         LOG_LEVEL=os.getenv('LOG_LEVEL', 'INFO'),
+        LOG_FORMAT=os.getenv('LOG_FORMAT', 'text'),
+        LOG_SAMPLE_RATE=float(os.getenv('LOG_SAMPLE_RATE', 1.0)),
+        LOG_QUEUE_SIZE=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+        CHAT_MAX_BODY_BYTES=int(os.getenv('CHAT_MAX_BODY_BYTES', 1024 * 1024)),
+        RECOGNIZE_MAX_IMAGE_BYTES=int(os.getenv('RECOGNIZE_MAX_IMAGE_BYTES', 5 * 1024 * 1024)),
+        RECOGNIZE_CACHE_TTL=float(os.getenv('RECOGNIZE_CACHE_TTL', 300)),
+        RECOGNIZE_CACHE_MAX_ENTRIES=int(os.getenv('RECOGNIZE_CACHE_MAX_ENTRIES', 1000)),
+        UPSTREAM_MAX_CONCURRENCY=int(os.getenv('UPSTREAM_MAX_CONCURRENCY', 16)),
+        UPSTREAM_CLASS_RESERVATIONS=os.getenv('UPSTREAM_CLASS_RESERVATIONS', 'interactive:4'),
+        UPSTREAM_CLASS_LIMITS=os.getenv('UPSTREAM_CLASS_LIMITS', 'bulk:4'),
+        UPSTREAM_CLASS_WEIGHTS=os.getenv('UPSTREAM_CLASS_WEIGHTS', 'interactive:8,standard:4,bulk:1'),
+        UPSTREAM_QUEUE_TIMEOUT=float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', 10)),
+        REQUEST_CLASS_API_KEYS=os.getenv('REQUEST_CLASS_API_KEYS', ''),
+        MODEL_ROUTING_ENABLED=os.getenv('MODEL_ROUTING_ENABLED', 'true').lower() == 'true',
+        MODEL_ROUTING_POLICY=os.getenv('MODEL_ROUTING_POLICY', ''),
+        INTENT_ROUTER_ENABLED=os.getenv('INTENT_ROUTER_ENABLED', 'false').lower() == 'true',
+        SEMANTIC_CACHE_ENABLED=os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true',
+        SEMANTIC_CACHE_THRESHOLD=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85)),
+        SEMANTIC_CACHE_TTL=float(os.getenv('SEMANTIC_CACHE_TTL', 600)),
+        SEMANTIC_CACHE_MAX_ENTRIES=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 2000)),
+        SEMANTIC_CACHE_SAMPLE_RATE=float(os.getenv('SEMANTIC_CACHE_SAMPLE_RATE', 0)),
+        SEMANTIC_CACHE_STALE_WHILE_REVALIDATE=float(os.getenv('SEMANTIC_CACHE_STALE_WHILE_REVALIDATE', 60)),
+        SEMANTIC_CACHE_STALE_IF_ERROR=float(os.getenv('SEMANTIC_CACHE_STALE_IF_ERROR', 1800)),
+        SEMANTIC_CACHE_REFRESH_CONCURRENCY=int(os.getenv('SEMANTIC_CACHE_REFRESH_CONCURRENCY', 2)),
+        IDEMPOTENCY_ENABLED=os.getenv('IDEMPOTENCY_ENABLED', 'true').lower() == 'true',
+        IDEMPOTENCY_STORE=os.getenv('IDEMPOTENCY_STORE', 'memory'),
+        IDEMPOTENCY_TTL=float(os.getenv('IDEMPOTENCY_TTL', 3600)),
+        IDEMPOTENCY_MAX_ENTRIES=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000)),
+        IDEMPOTENCY_MAX_BYTES=int(os.getenv('IDEMPOTENCY_MAX_BYTES', 16 * 1024 * 1024)),
+        IDEMPOTENCY_WAIT_TIMEOUT=float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 60)),
+        CONTEXT_HISTORY_COMPACT_AFTER=float(os.getenv('CONTEXT_HISTORY_COMPACT_AFTER', 300)),
+        CONTEXT_HISTORY_CODEC=os.getenv('CONTEXT_HISTORY_CODEC', 'zlib'),
+        CONTEXT_HISTORY_DICTIONARY=os.getenv('CONTEXT_HISTORY_DICTIONARY', ''),
+        CONTEXT_SNAPSHOT_PATH=os.getenv('CONTEXT_SNAPSHOT_PATH', ''),
+        CONTEXT_SNAPSHOT_INTERVAL=float(os.getenv('CONTEXT_SNAPSHOT_INTERVAL', 60)),
+        MCP_CAPTURE_PATH=os.getenv('MCP_CAPTURE_PATH', ''),
+        MCP_CAPTURE_SAMPLE_RATE=float(os.getenv('MCP_CAPTURE_SAMPLE_RATE', 1.0)),
+        METRICS_ENABLED=os.getenv('METRICS_ENABLED', 'true').lower() == 'true',
+        SERVER_TIMING_ENABLED=os.getenv('SERVER_TIMING_ENABLED', 'true').lower() == 'true',
+        TIMING_LOG_JSON=os.getenv('TIMING_LOG_JSON', 'false').lower() == 'true',
+        SLOW_REQUEST_THRESHOLD_MS=float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 0)),
+        PROFILE_SAMPLE_RATE=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        PROFILE_DIR=os.getenv('PROFILE_DIR', ''),
     )
 
     if config:
         app.config.update(config)
 
-    # Configure logging
-    logging.basicConfig(
-        level=getattr(logging, app.config['LOG_LEVEL']),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    # Configure logging（キュー経由で別スレッドから出力する）
+    from app.services import structured_logging
+    structured_logging.init_app(app)
 
     # Enable CORS
     CORS(app)
 
     # Register blueprints
+    # Health check endpoints (liveness / readiness)
+    from app.routes.health import health_bp
+    app.register_blueprint(health_bp, url_prefix='/papi')
+
     from app.routes.chat import chat_bp
     app.register_blueprint(chat_bp, url_prefix='/papi')
 
-    # Health check endpoint
-    @app.route('/papi/health')
-    def health():
-        return {'status': 'ok', 'service': 'chat-api'}
+    from app.routes.recognize import recognize_bp
+    app.register_blueprint(recognize_bp, url_prefix='/papi')
+
+    # 上流リクエストのクラス別スケジューリング
+    from app.services import upstream_scheduler
+    upstream_scheduler.init_app(app)
+
+    # アイドル中のセッションの会話履歴の圧縮
+    from app.services.context_manager import context_manager
+    from app.services.history_codec import HistoryCodec, load_dictionary
+    context_manager.configure_history(
+        app.config['CONTEXT_HISTORY_COMPACT_AFTER'],
+        HistoryCodec(app.config['CONTEXT_HISTORY_CODEC'], load_dictionary(app.config['CONTEXT_HISTORY_DICTIONARY']))
+    )
+
+    # 会話コンテキストのスナップショット（再起動後の復元）
+    from app.services import context_snapshot
+    context_snapshot.init_app(app)
+
+    # 上流とのやり取りの記録（オフラインの負荷試験での再生用）
+    from app.services import mcp_capture
+    mcp_capture.init_app(app)
+
+    # 認識キャッシュの設定
+    from app.services.plate_recognizer import plate_recognizer
+    plate_recognizer.ttl = app.config['RECOGNIZE_CACHE_TTL']
+    plate_recognizer.max_entries = app.config['RECOGNIZE_CACHE_MAX_ENTRIES']
+
+    # チャットのモデルルーティング
+    from app.services.model_router import model_router, load_policy
+    model_router.configure(
+        load_policy(app.config['MODEL_ROUTING_POLICY']),
+        enabled=app.config['MODEL_ROUTING_ENABLED']
+    )
+
+    # チャット応答の意味的キャッシュの設定
+    from app.services.semantic_cache import semantic_cache
+    semantic_cache.threshold = app.config['SEMANTIC_CACHE_THRESHOLD']
+    semantic_cache.ttl = app.config['SEMANTIC_CACHE_TTL']
+    semantic_cache.max_entries = app.config['SEMANTIC_CACHE_MAX_ENTRIES']
+    semantic_cache.sample_rate = app.config['SEMANTIC_CACHE_SAMPLE_RATE']
+    semantic_cache.stale_while_revalidate = app.config['SEMANTIC_CACHE_STALE_WHILE_REVALIDATE']
+    semantic_cache.stale_if_error = app.config['SEMANTIC_CACHE_STALE_IF_ERROR']
+
+    # Idempotency-Key の応答の保存先
+    from app.services import idempotency
+    idempotency.init_app(app)
+
+    # 古い応答のバックグラウンドでの取り直し
+    from app.services.revalidator import revalidator
+    revalidator.max_concurrency = app.config['SEMANTIC_CACHE_REFRESH_CONCURRENCY']
+
+    # Metrics
+    if app.config['METRICS_ENABLED']:
+        from app.routes import metrics
+        metrics.init_app(app)
+        app.register_blueprint(metrics.metrics_bp, url_prefix='/papi')
+
+    # Per-request phase timing (Server-Timing)
+    if app.config['SERVER_TIMING_ENABLED']:
+        from app.services import request_timing
+        request_timing.init_app(app)
 
     return app
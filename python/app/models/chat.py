@@ -3,15 +3,22 @@ Chat Models
 
 チャットAPIのリクエスト/レスポンスモデル
 Requirements: 10.2, 10.3
+
+1リクエストごとに生成されるため、インスタンス辞書を持たない slots 付きの dataclass にしている。
 """
 
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class LicensePlateContext:
-    """ナンバープレートコンテキスト"""
+    """
+    ナンバープレートコンテキスト
+
+    セッション間で共有される（app.services.plate_registry）ため変更不可。
+    値を変えるときは dataclasses.replace で新しいインスタンスを作る。
+    """
     region: Optional[str] = None
     classification_number: Optional[str] = None
     hiragana: Optional[str] = None
@@ -43,7 +50,91 @@ class LicensePlateContext:
         }
 
 
-@dataclass
+HISTORY_ROLES = ('user', 'assistant')
+MAX_MESSAGE_LENGTH = 10000
+MAX_HISTORY_MESSAGE_LENGTH = 10000
+MAX_HISTORY_TOTAL_LENGTH = 100000
+
+
+def _validate_history_entry(i: int, msg: Any):
+    """
+    会話履歴の1要素を検証する（高速パスに乗らなかった要素用）
+
+    Returns:
+        (role, content)
+
+    Raises:
+        ValueError: バリデーションエラー
+    """
+    if not isinstance(msg, dict):
+        raise ValueError(f'会話履歴の{i}番目はオブジェクトである必要があります')
+
+    role = msg.get('role', 'user')
+    if role not in HISTORY_ROLES:
+        raise ValueError(f'会話履歴の{i}番目のroleは user または assistant である必要があります')
+
+    content = msg.get('content', '')
+    if not isinstance(content, str):
+        raise ValueError(f'会話履歴の{i}番目のcontentは文字列である必要があります')
+
+    return role, content
+
+
+def _validate_history(history: Any) -> List[Dict]:
+    """
+    会話履歴を1回の走査で検証し、上流に渡せる {role, content} のリストを返す
+
+    JSONから作られた {role, content} だけの要素は型を1回ずつ見るだけの高速パスで通し、
+    それ以外の要素だけ詳細に検証して作り直す。
+
+    Args:
+        history: リクエストの conversation_history
+
+    Returns:
+        検証済みの会話履歴（正規化が不要なら引数のリストそのもの）
+
+    Raises:
+        ValueError: バリデーションエラー
+    """
+    if not isinstance(history, list):
+        raise ValueError('会話履歴は配列である必要があります')
+
+    total = 0
+    normalized = None
+    for i, msg in enumerate(history):
+        if type(msg) is dict and len(msg) == 2:
+            role = msg.get('role')
+            content = msg.get('content')
+            fast = type(role) is str and role in HISTORY_ROLES and type(content) is str
+        else:
+            fast = False
+
+        if not fast:
+            role, content = _validate_history_entry(i, msg)
+
+        length = len(content)
+        if length > MAX_HISTORY_MESSAGE_LENGTH:
+            raise ValueError(
+                f'会話履歴の{i}番目のcontentは{MAX_HISTORY_MESSAGE_LENGTH}文字以内である必要があります'
+            )
+        total += length
+        if total > MAX_HISTORY_TOTAL_LENGTH:
+            raise ValueError(f'会話履歴は合計{MAX_HISTORY_TOTAL_LENGTH}文字以内である必要があります')
+
+        if fast:
+            if normalized is not None:
+                normalized.append(msg)
+            continue
+
+        # 余分なキーや省略されたキーがある要素だけ作り直す
+        if normalized is None:
+            normalized = history[:i]
+        normalized.append({'role': role, 'content': content})
+
+    return history if normalized is None else normalized
+
+
+@dataclass(slots=True)
 class ChatContext:
     """
     チャットコンテキスト
@@ -55,10 +146,22 @@ class ChatContext:
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'ChatContext':
-        """辞書からインスタンスを作成"""
+        """
+        辞書からインスタンスを作成
+
+        会話履歴は1回の走査で検証する。{role, content} だけを持つ要素はそのまま
+        上流に渡せるため複製せず、それ以外の要素があった場合だけ新しいリストを作る。
+
+        Raises:
+            ValueError: バリデーションエラー
+        """
+        license_plate = data.get('license_plate')
+        if license_plate is not None and not isinstance(license_plate, dict):
+            raise ValueError('ナンバープレート情報はオブジェクトである必要があります')
+
         return cls(
-            license_plate=data.get('license_plate'),
-            conversation_history=data.get('conversation_history', []),
+            license_plate=license_plate,
+            conversation_history=_validate_history(data.get('conversation_history') or []),
         )
 
     def to_dict(self) -> Dict:
@@ -69,7 +172,7 @@ class ChatContext:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatRequest:
     """
     チャットリクエスト
@@ -100,11 +203,13 @@ class ChatRequest:
         if not isinstance(message, str):
             raise ValueError('メッセージは文字列である必要があります')
 
-        if len(message) > 10000:
-            raise ValueError('メッセージは10000文字以内である必要があります')
+        if len(message) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f'メッセージは{MAX_MESSAGE_LENGTH}文字以内である必要があります')
 
         context = None
         if 'context' in data and data['context']:
+            if not isinstance(data['context'], dict):
+                raise ValueError('コンテキストはオブジェクトである必要があります')
             context = ChatContext.from_dict(data['context'])
 
         return cls(
@@ -120,7 +225,7 @@ class ChatRequest:
         return result
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatResponse:
     """
     チャットレスポンス
@@ -129,16 +234,20 @@ class ChatResponse:
     """
     response: str
     context_used: bool = False
+    fast_path: bool = False  # LLMを使わずナンバープレートの項目から応答した
+    stale: bool = False  # 有効期限を過ぎたキャッシュの応答（取り直し中、または上流の失敗時）
 
     def to_dict(self) -> Dict:
         """辞書に変換"""
         return {
             'response': self.response,
             'context_used': self.context_used,
+            'fast_path': self.fast_path,
+            'stale': self.stale,
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatError:
     """チャットエラー"""
     code: str
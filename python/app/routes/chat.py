@@ -6,13 +6,40 @@ Requirements: 10.1, 10.2, 10.3, 10.4, 10.5
 """
 
 from flask import Blueprint, request, jsonify, current_app
-from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError
-from app.models.chat import ChatRequest, ChatResponse, ChatError
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.services.qwen_mcp_client import QwenMCPError, get_shared_client
+from app.services.intent_router import intent_router
+from app.services.model_router import model_router
+from app.services.plate_registry import canonical_key
+from app.services.semantic_cache import semantic_cache
+from app.models.chat import ChatRequest, ChatResponse
+from app.routes.responses import error_response, get_status_code
+from app.services.idempotency import (
+    IDEMPOTENCY_HEADER, IdempotencyError, fingerprint, idempotency, scoped_key, valid_key
+)
+from app.services.revalidator import revalidator
+from app.services.upstream_scheduler import API_KEY_HEADER
+from app.services import metrics, request_timing
+from functools import partial
+import codecs
+import json
 import logging
+import time
 
 chat_bp = Blueprint('chat', __name__)
 logger = logging.getLogger(__name__)
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class _RequestBodyError(Exception):
+    """リクエストボディのエラー"""
+
+    def __init__(self, code: str, message: str):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
 
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
@@ -40,20 +67,33 @@ def chat():
             }
         }
 
+    Idempotency-Key ヘッダーを付けると、同じキーの再送には同じ応答を返す
+    （実行中なら完了を待ち、完了していれば保存した応答を Idempotent-Replayed: true で返す）。
+
     Response:
         {
             "success": true,
             "data": {
                 "response": "AIの応答メッセージ",
-                "context_used": true
+                "context_used": true,
+                "fast_path": false,
+                "stale": false
             }
         }
     """
     try:
-        # リクエストのバリデーション
-        data = request.get_json()
-        if not data:
-            return _error_response(
+        # リクエストのバリデーション（サイズ上限はパース前に確認する）
+        try:
+            with request_timing.phase('parse'):
+                data = _read_json_body(current_app.config['CHAT_MAX_BODY_BYTES'])
+        except _RequestBodyError as e:
+            return error_response(
+                code=e.code,
+                message=e.message,
+                status_code=get_status_code(e.code)
+            )
+        if not data or not isinstance(data, dict):
+            return error_response(
                 code='INVALID_REQUEST',
                 message='リクエストボディが空です',
                 status_code=400
@@ -61,61 +101,279 @@ def chat():
 
         # ChatRequestの作成
         try:
-            chat_request = ChatRequest.from_dict(data)
+            with request_timing.phase('validate'):
+                chat_request = ChatRequest.from_dict(data)
         except ValueError as e:
-            return _error_response(
+            return error_response(
                 code='VALIDATION_ERROR',
                 message=str(e),
                 status_code=422
             )
 
-        # Qwen MCPクライアントの初期化
-        client = QwenMCPClient(
-            base_url=current_app.config['QWEN_MCP_URL'],
-            api_key=current_app.config['QWEN_API_KEY']
+        # 同じ Idempotency-Key の再送には同じ応答を返す（上流を重複して呼ばない）
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is not None and current_app.config['IDEMPOTENCY_ENABLED']:
+            if not valid_key(key):
+                return error_response(
+                    code='INVALID_REQUEST',
+                    message='Idempotency-Keyの形式が不正です',
+                    status_code=400
+                )
+            try:
+                return idempotency.execute(
+                    scoped_key(key, request.headers.get(API_KEY_HEADER)),
+                    fingerprint(data),
+                    partial(_answer, chat_request)
+                )
+            except IdempotencyError as e:
+                return error_response(
+                    code=e.code,
+                    message=e.message,
+                    status_code=get_status_code(e.code)
+                )
+
+        return _answer(chat_request)
+
+    except Exception as e:
+        logger.exception("Unexpected error in chat endpoint: %s", e)
+        return error_response(
+            code='INTERNAL_ERROR',
+            message='内部エラーが発生しました',
+            status_code=500
         )
 
-        # 会話履歴の構築
-        messages = _build_messages(chat_request)
 
-        # Qwen MCPサーバーへのリクエスト
-        response = client.chat(messages)
+def _answer(chat_request: ChatRequest):
+    """
+    検証済みのリクエストに応答する
+
+    Args:
+        chat_request: チャットリクエスト
+
+    Returns:
+        レスポンス（エラー時はエラーレスポンス）
+    """
+    try:
+        # ナンバープレートの項目だけで答えられる質問は上流を呼ばない
+        if current_app.config['INTENT_ROUTER_ENABLED'] and chat_request.context:
+            with request_timing.phase('route'):
+                routed = intent_router.route(chat_request.message, chat_request.context.license_plate)
+            if routed is not None:
+                logger.info("Chat request answered locally: intents=%s", routed.intents,
+                            extra={'sampled': True, 'fields': {'intents': routed.intents}})
+                return jsonify({
+                    'success': True,
+                    'data': ChatResponse(response=routed.response, context_used=True, fast_path=True).to_dict()
+                })
+
+        # 言い換えられた同じ質問は意味的キャッシュから返す
+        scope = None
+        hit = None
+        cache_status = 'MISS'
+        if current_app.config['SEMANTIC_CACHE_ENABLED']:
+            scope = _cache_scope(chat_request)
+        if scope is not None:
+            with request_timing.phase('cache'):
+                hit = semantic_cache.lookup(scope, chat_request.message)
+
+        if hit is not None and hit.fresh and not semantic_cache.should_sample():
+            content = hit.response
+            cache_status = 'HIT'
+        else:
+            # Qwen MCPクライアントの取得（接続プールを共有）
+            client = get_shared_client(
+                current_app.config['QWEN_MCP_URL'],
+                current_app.config['QWEN_API_KEY']
+            )
+
+            # 会話履歴の構築とモデルの選択
+            with request_timing.phase('build'):
+                messages = _build_messages(chat_request)
+                route = model_router.select(
+                    chat_request.message,
+                    chat_request.context.conversation_history if chat_request.context else None
+                )
+
+            if hit is not None and hit.state == 'revalidate':
+                # 古い応答をすぐに返し、上流への問い合わせは裏で行う
+                content = hit.response
+                cache_status = 'STALE'
+                metrics.CHAT_STALE_RESPONSES.labels('revalidate').inc()
+                revalidator.submit(
+                    (scope, hit.matched_text),
+                    partial(_revalidate, client, messages, route, scope, chat_request.message)
+                )
+            else:
+                # Qwen MCPサーバーへのリクエスト
+                # 代わりに返せる応答があれば、リトライせずにそちらを返す
+                retry = {'max_retries': 0} if hit is not None else {}
+                started = time.perf_counter()
+                try:
+                    with request_timing.phase('upstream'):
+                        response = client.chat(
+                            messages,
+                            model=route.model,
+                            max_tokens=route.max_tokens,
+                            temperature=route.temperature,
+                            **retry
+                        )
+                except QwenMCPError as e:
+                    if hit is None:
+                        raise
+                    logger.warning("Qwen MCP error, serving cached response (age %.0fs): %s - %s",
+                                   hit.age, e.code, e.message)
+                    content = hit.response
+                    cache_status = 'HIT' if hit.fresh else 'STALE'
+                    if not hit.fresh:
+                        metrics.CHAT_STALE_RESPONSES.labels('error').inc()
+                else:
+                    model_router.record(route, time.perf_counter() - started, response.finish_reason, response.usage)
+                    content = response.content
+
+                    if hit is not None and hit.fresh:
+                        # 照合用のサンプル: 上流の応答を返し、キャッシュの応答と比較する
+                        cache_status = 'HIT'
+                        semantic_cache.record_sample(hit, content)
+                    elif scope is not None and response.finish_reason == 'stop':
+                        semantic_cache.store(scope, chat_request.message, content)
 
         # レスポンスの構築
         chat_response = ChatResponse(
-            response=response.content,
-            context_used=chat_request.context is not None
+            response=content,
+            context_used=chat_request.context is not None,
+            stale=cache_status == 'STALE'
         )
 
-        logger.info(f"Chat request processed successfully: {len(chat_request.message)} chars")
+        logger.info("Chat request processed successfully: %d chars", len(chat_request.message),
+                    extra={'sampled': True, 'fields': {'chars': len(chat_request.message)}})
 
-        return jsonify({
-            'success': True,
-            'data': chat_response.to_dict()
-        })
+        with request_timing.phase('serialize'):
+            result = jsonify({
+                'success': True,
+                'data': chat_response.to_dict()
+            })
+        if scope is not None:
+            result.headers['X-Cache'] = cache_status
+        return result
 
     except QwenMCPError as e:
-        logger.error(f"Qwen MCP error: {e.code} - {e.message}")
-        return _error_response(
+        logger.error("Qwen MCP error: %s - %s", e.code, e.message)
+        return error_response(
             code=e.code,
             message=e.message,
-            status_code=_get_status_code(e.code)
+            status_code=get_status_code(e.code)
         )
     except Exception as e:
-        logger.exception(f"Unexpected error in chat endpoint: {str(e)}")
-        return _error_response(
+        logger.exception("Unexpected error in chat endpoint: %s", e)
+        return error_response(
             code='INTERNAL_ERROR',
             message='内部エラーが発生しました',
             status_code=500
         )
 
 
+def _revalidate(client, messages: list, route, scope: str, message: str) -> None:
+    """
+    キャッシュの古い応答を取り直す（revalidator のスレッドで実行する）
+
+    Raises:
+        QwenMCPError: 上流の呼び出しに失敗した場合（古い応答は stale-if-error の期間まで残る）
+    """
+    started = time.perf_counter()
+    response = client.chat(
+        messages,
+        model=route.model,
+        max_tokens=route.max_tokens,
+        temperature=route.temperature
+    )
+    model_router.record(route, time.perf_counter() - started, response.finish_reason, response.usage)
+    if response.finish_reason == 'stop':
+        semantic_cache.store(scope, message, response.content)
+
+
+def _read_json_body(max_bytes: int):
+    """
+    リクエストボディを上限付きで読み込んでJSONとしてパースする
+
+    Content-Length が上限を超える場合は読み込まずに、chunked の場合は上限に達した時点で打ち切る。
+    ボディはチャンクごとに文字列へデコードし、生のバイト列全体をメモリに持たない
+    （bytes.decode は非ASCIIの本文に対して一時的に本文の数倍のバッファを確保するため）。
+
+    Args:
+        max_bytes: ボディの最大バイト数
+
+    Returns:
+        パースしたJSON（ボディが空なら None）
+
+    Raises:
+        _RequestBodyError: サイズ超過、Content-Type やJSONが不正な場合
+    """
+    if not request.is_json:
+        raise _RequestBodyError(
+            'UNSUPPORTED_MEDIA_TYPE', 'Content-Type は application/json である必要があります'
+        )
+
+    request.max_content_length = max_bytes
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pieces = []
+    try:
+        stream = request.stream
+        while True:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            pieces.append(decoder.decode(chunk))
+        pieces.append(decoder.decode(b'', final=True))
+    except RequestEntityTooLarge:
+        raise _RequestBodyError(
+            'PAYLOAD_TOO_LARGE', f'リクエストボディは{max_bytes}バイト以内である必要があります'
+        )
+    except UnicodeDecodeError:
+        raise _RequestBodyError('INVALID_REQUEST', 'リクエストボディはUTF-8である必要があります')
+
+    text = ''.join(pieces)
+    del pieces
+    if not text:
+        return None
+
+    try:
+        return json.loads(text)
+    except ValueError:
+        raise _RequestBodyError('INVALID_REQUEST', 'JSONの形式が不正です')
+
+
+def _cache_scope(chat_request: ChatRequest):
+    """
+    意味的キャッシュのスコープを返す
+
+    応答が最後のメッセージだけで決まるリクエスト（会話履歴なし）のみを対象にし、
+    ナンバープレートごとにスコープを分ける。
+
+    Args:
+        chat_request: チャットリクエスト
+
+    Returns:
+        ナンバープレートの正規キー（プレートなしは空文字列）。キャッシュしない場合は None
+    """
+    context = chat_request.context
+    if context is None:
+        return ''
+    if context.conversation_history:
+        return None
+    if not context.license_plate:
+        return ''
+    # 特定できないナンバープレートは他の車両と区別できないためキャッシュしない
+    return canonical_key(context.license_plate)
+
+
 def _build_messages(chat_request: ChatRequest) -> list:
     """
     会話メッセージリストを構築する
 
     Requirements: 10.3 - ナンバープレート認識結果をコンテキストとして含める
 
+    会話履歴は ChatContext.from_dict で検証・正規化済みなので、要素を複製せずにそのまま渡す。
+
     Args:
         chat_request: チャットリクエスト
 
@@ -133,11 +391,7 @@ def _build_messages(chat_request: ChatRequest) -> list:
 
     # 会話履歴の追加
     if chat_request.context and chat_request.context.conversation_history:
-        for msg in chat_request.context.conversation_history:
-            messages.append({
-                'role': msg.get('role', 'user'),
-                'content': msg.get('content', '')
-            })
+        messages.extend(chat_request.context.conversation_history)
 
     # 現在のメッセージを追加
     messages.append({
@@ -179,48 +433,3 @@ def _build_system_prompt(context) -> str:
         return base_prompt + plate_info
 
     return base_prompt
-
-
-def _error_response(code: str, message: str, status_code: int):
-    """
-    エラーレスポンスを生成する
-
-    Requirements: 10.5 - 適切なエラーメッセージを返す
-
-    Args:
-        code: エラーコード
-        message: エラーメッセージ
-        status_code: HTTPステータスコード
-
-    Returns:
-        JSONレスポンス
-    """
-    return jsonify({
-        'success': False,
-        'error': {
-            'code': code,
-            'message': message
-        }
-    }), status_code
-
-
-def _get_status_code(error_code: str) -> int:
-    """
-    エラーコードからHTTPステータスコードを取得する
-
-    Args:
-        error_code: エラーコード
-
-    Returns:
-        HTTPステータスコード
-    """
-    status_map = {
-        'CONNECTION_FAILED': 503,
-        'TIMEOUT': 504,
-        'UNAUTHORIZED': 401,
-        'RATE_LIMITED': 429,
-        'INVALID_REQUEST': 400,
-        'VALIDATION_ERROR': 422,
-        'INTERNAL_ERROR': 500,
-    }
-    return status_map.get(error_code, 500)
@@ -0,0 +1,64 @@
+"""
+Health Routes
+
+liveness（/papi/health）と readiness（/papi/ready）
+
+- /papi/health: プロセスが応答できるか。依存を読み込まず常に即座に返す
+- /papi/ready: リクエストを受け付けられるか。設定を検証し、上流クライアントを事前作成する
+"""
+
+from flask import Blueprint, current_app, jsonify
+from app.services.context_manager import context_manager
+from app.services.qwen_mcp_client import get_shared_client
+import logging
+
+health_bp = Blueprint('health', __name__)
+logger = logging.getLogger(__name__)
+
+
+@health_bp.route('/health')
+def health():
+    """
+    liveness チェック
+    """
+    return {'status': 'ok', 'service': 'chat-api'}
+
+
+@health_bp.route('/ready')
+def ready():
+    """
+    readiness チェック
+
+    初回呼び出しで上流へのHTTPクライアントを作成し、会話コンテキストのスナップショットの
+    索引を読み込むため、ロードバランサーに組み込まれた時点で最初のリクエストが
+    読み込みコストを払わずに済む。
+
+    Response:
+        {
+            "status": "ready",
+            "checks": {"config": "ok", "upstream_client": "ok"}
+        }
+    """
+    checks = {}
+
+    base_url = current_app.config.get('QWEN_MCP_URL')
+    checks['config'] = 'ok' if base_url else 'QWEN_MCP_URL が設定されていません'
+
+    if base_url:
+        try:
+            get_shared_client(base_url, current_app.config['QWEN_API_KEY']).warm_up()
+            checks['upstream_client'] = 'ok'
+        except Exception as e:
+            logger.exception("Failed to initialize upstream client")
+            checks['upstream_client'] = f'初期化に失敗しました: {e}'
+
+    if current_app.config.get('CONTEXT_SNAPSHOT_PATH'):
+        # 読めないスナップショットは無視して空の状態で始めるので、失敗にはしない
+        context_manager.ensure_restored()
+        checks['context_snapshot'] = 'ok'
+
+    is_ready = all(value == 'ok' for value in checks.values())
+    return jsonify({
+        'status': 'ready' if is_ready else 'not_ready',
+        'checks': checks,
+    }), 200 if is_ready else 503
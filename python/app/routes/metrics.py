@@ -0,0 +1,48 @@
+"""
+Metrics Routes
+
+Prometheus形式のメトリクスエンドポイントとリクエスト計測
+"""
+
+from flask import Blueprint, Response, g, request
+from app.services import metrics
+import time
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    """
+    メトリクスをPrometheusのテキスト形式で返す
+    """
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
+
+
+def init_app(app) -> None:
+    """
+    全リクエストの件数と処理時間を記録するフックを登録する
+
+    Args:
+        app: Flaskアプリケーション
+    """
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+
+        # ラベルにはURLルールを使う（パスそのままだとカーディナリティが発散する）
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = str(response.status_code)
+        metrics.HTTP_REQUESTS.labels(route, request.method, status).inc()
+        metrics.HTTP_REQUEST_DURATION.labels(route, request.method, status).observe(
+            time.perf_counter() - started
+        )
+        return response
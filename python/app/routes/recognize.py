@@ -0,0 +1,183 @@
+"""
+Recognize API Routes
+
+ナンバープレート認識API - Qwen-VL（MCPサーバー経由）
+"""
+
+from flask import Blueprint, request, jsonify, current_app
+from app.services.qwen_mcp_client import QwenMCPError, get_shared_client
+from app.services.plate_recognizer import plate_recognizer
+from app.routes.responses import error_response, get_status_code
+from app.services import request_timing
+import base64
+import binascii
+import hashlib
+import logging
+
+recognize_bp = Blueprint('recognize', __name__)
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+ALLOWED_MIME_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+
+class _ImageInputError(Exception):
+    """画像入力のエラー"""
+
+    def __init__(self, code: str, message: str):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
+
+@recognize_bp.route('/recognize', methods=['POST'])
+def recognize():
+    """
+    画像からナンバープレートを認識する
+
+    Request Body (いずれか):
+        - image/jpeg, image/png, image/webp のバイナリ本文
+        - multipart/form-data の "image" フィールド
+        - {"imageBase64": "..."}（互換用）
+
+    Response:
+        {
+            "success": true,
+            "data": {
+                "detected": true,
+                "license_plate": {
+                    "region": "品川",
+                    "classification_number": "330",
+                    "hiragana": "あ",
+                    "serial_number": "1234",
+                    "full_text": "品川330あ1234",
+                    "confidence": 95.5
+                },
+                "source": "upstream"
+            }
+        }
+    """
+    try:
+        try:
+            with request_timing.phase('read'):
+                image, image_hash, mime_type = _read_image(
+                    current_app.config['RECOGNIZE_MAX_IMAGE_BYTES']
+                )
+        except _ImageInputError as e:
+            return error_response(
+                code=e.code,
+                message=e.message,
+                status_code=get_status_code(e.code)
+            )
+
+        client = get_shared_client(
+            current_app.config['QWEN_MCP_URL'],
+            current_app.config['QWEN_API_KEY']
+        )
+
+        with request_timing.phase('upstream'):
+            plate, source = plate_recognizer.recognize(image, image_hash, mime_type, client)
+
+        logger.info("Recognize request processed: %d bytes, source=%s", len(image), source,
+                    extra={'sampled': True, 'fields': {'bytes': len(image), 'source': source}})
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'detected': plate is not None,
+                'license_plate': plate.to_dict() if plate else None,
+                'source': source,
+            }
+        })
+
+    except QwenMCPError as e:
+        logger.error("Qwen MCP error: %s - %s", e.code, e.message)
+        return error_response(
+            code=e.code,
+            message=e.message,
+            status_code=get_status_code(e.code)
+        )
+    except Exception as e:
+        logger.exception("Unexpected error in recognize endpoint: %s", e)
+        return error_response(
+            code='INTERNAL_ERROR',
+            message='内部エラーが発生しました',
+            status_code=500
+        )
+
+
+def _read_image(max_bytes: int):
+    """
+    リクエストから画像を読み込む
+
+    本文はチャンク単位で読み、読みながらハッシュを計算する（全体の再走査や
+    base64文字列の中間コピーを作らない）。
+
+    Args:
+        max_bytes: 画像の最大バイト数
+
+    Returns:
+        (画像バイト列, SHA-256, MIMEタイプ)
+
+    Raises:
+        _ImageInputError: 入力が不正な場合
+    """
+    # base64/multipartの膨張分を見込んだ上で、明らかに大きい本文は読む前に拒否する
+    if request.content_length is not None and request.content_length > max_bytes * 4 // 3 + READ_CHUNK_SIZE:
+        raise _ImageInputError('PAYLOAD_TOO_LARGE', '画像サイズが大きすぎます')
+
+    mimetype = request.mimetype
+
+    if mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            raise _ImageInputError('INVALID_REQUEST', '画像が指定されていません')
+        return _read_stream(upload.stream, max_bytes, _check_mime_type(upload.mimetype))
+
+    if mimetype.startswith('image/'):
+        return _read_stream(request.stream, max_bytes, _check_mime_type(mimetype))
+
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        encoded = data.get('imageBase64')
+        if not encoded or not isinstance(encoded, str):
+            raise _ImageInputError('INVALID_REQUEST', '画像が指定されていません')
+        mime_type = 'image/jpeg'
+        if encoded.startswith('data:'):
+            header, _, encoded = encoded.partition(',')
+            mime_type = header[5:].split(';', 1)[0]
+        try:
+            image = base64.b64decode(encoded, validate=True)
+        except (binascii.Error, ValueError):
+            raise _ImageInputError('INVALID_REQUEST', '画像のBase64が不正です')
+        if len(image) > max_bytes:
+            raise _ImageInputError('PAYLOAD_TOO_LARGE', '画像サイズが大きすぎます')
+        return image, hashlib.sha256(image).hexdigest(), _check_mime_type(mime_type)
+
+    raise _ImageInputError('UNSUPPORTED_MEDIA_TYPE', '対応していないContent-Typeです')
+
+
+def _read_stream(stream, max_bytes: int, mime_type: str):
+    """ストリームを上限付きで読み込み、同時にハッシュを計算する"""
+    digest = hashlib.sha256()
+    buf = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise _ImageInputError('PAYLOAD_TOO_LARGE', '画像サイズが大きすぎます')
+        digest.update(chunk)
+
+    if not buf:
+        raise _ImageInputError('INVALID_REQUEST', '画像が空です')
+
+    return buf, digest.hexdigest(), mime_type
+
+
+def _check_mime_type(mime_type: str) -> str:
+    """対応している画像形式か確認する"""
+    if mime_type not in ALLOWED_MIME_TYPES:
+        raise _ImageInputError('UNSUPPORTED_MEDIA_TYPE', '対応していない画像形式です')
+    return mime_type
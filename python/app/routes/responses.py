@@ -0,0 +1,58 @@
+"""
+Response Helpers
+
+ルート共通のエラーレスポンス生成
+Requirements: 10.5
+"""
+
+from flask import jsonify
+
+
+def error_response(code: str, message: str, status_code: int):
+    """
+    エラーレスポンスを生成する
+
+    Requirements: 10.5 - 適切なエラーメッセージを返す
+
+    Args:
+        code: エラーコード
+        message: エラーメッセージ
+        status_code: HTTPステータスコード
+
+    Returns:
+        JSONレスポンス
+    """
+    return jsonify({
+        'success': False,
+        'error': {
+            'code': code,
+            'message': message
+        }
+    }), status_code
+
+
+def get_status_code(error_code: str) -> int:
+    """
+    エラーコードからHTTPステータスコードを取得する
+
+    Args:
+        error_code: エラーコード
+
+    Returns:
+        HTTPステータスコード
+    """
+    status_map = {
+        'CONNECTION_FAILED': 503,
+        'TIMEOUT': 504,
+        'UNAUTHORIZED': 401,
+        'RATE_LIMITED': 429,
+        'SERVER_BUSY': 503,
+        'INVALID_REQUEST': 400,
+        'PAYLOAD_TOO_LARGE': 413,
+        'UNSUPPORTED_MEDIA_TYPE': 415,
+        'VALIDATION_ERROR': 422,
+        'IDEMPOTENCY_KEY_MISMATCH': 422,
+        'IDEMPOTENCY_IN_PROGRESS': 409,
+        'INTERNAL_ERROR': 500,
+    }
+    return status_map.get(error_code, 500)
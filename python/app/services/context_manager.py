@@ -3,12 +3,40 @@ Context Manager
 
 会話コンテキストの管理
 Requirements: 10.3 - ナンバープレート認識結果をコンテキストに含める
+
+ナンバープレート → セッションIDの索引を持ち、同じ車両についての全セッションを
+セッション数によらず取得できる（find_by_plate）。ナンバープレートは plate_registry で
+正規化・共有したインスタンスを参照し、セッションごとには認識信頼度だけを持つ。
+
+restore_from でスナップショット（app.services.context_snapshot）を指定すると、
+起動後の最初のアクセスで索引だけを読み込み、各セッションは初めてアクセスされたときに
+デコードする。
+
+compact_after 秒以上アイドルのセッションは会話履歴を圧縮して保持し
+（app.services.history_codec）、次に messages にアクセスしたときに展開する。
+
+注意: 現時点でセッションを作成する呼び出し元は無い。/papi/chat はステートレスで
+（会話履歴はリクエストの context で受け取る）、context_manager に記録しない。
+そのため索引・スナップショット・履歴の圧縮は、セッションを記録する処理が
+追加されるまで空のストアに対して動く。find_by_plate を公開するエンドポイントも、
+セッションの記録とアクセス制御が揃うまで置かない。
 """
 
-from typing import Dict, List, Optional
-from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from dataclasses import InitVar, dataclass, field
+from functools import partial
 import time
 import hashlib
+import logging
+import threading
+
+from app.models.chat import LicensePlateContext
+from app.services import context_snapshot, metrics
+from app.services.context_snapshot import SessionRecord, SnapshotEntry, SnapshotError, SnapshotReader
+from app.services.history_codec import HistoryCodec, history_size
+from app.services.plate_registry import canonical_key, plate_registry
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -19,13 +47,57 @@ class ConversationContext:
     Requirements: 10.3 - 会話履歴の管理
     """
     session_id: str
-    license_plate: Optional[Dict] = None
-    messages: List[Dict] = field(default_factory=list)
+    # plate_registry の共有インスタンス（辞書を渡した場合は __post_init__ で変換する）
+    license_plate: Optional[LicensePlateContext] = None
+    plate_confidence: Optional[float] = None
+    # 会話履歴（コンストラクタの引数。以降は messages プロパティで圧縮中なら展開して返す）
+    messages: InitVar[Optional[List[Dict]]] = None
     created_at: float = field(default_factory=time.time)
     updated_at: float = field(default_factory=time.time)
+    # ContextManager の索引更新用（ナンバープレート変更時に呼ばれる）
+    _on_plate_change: Optional[Callable[['ConversationContext'], None]] = field(
+        default=None, repr=False, compare=False
+    )
+    # 展開済みの会話履歴（圧縮中は None）
+    _messages: Optional[List[Dict]] = field(default=None, init=False, repr=False)
+    # 圧縮した会話履歴 (コーデック, 圧縮データ, 圧縮前の推定サイズ)。messages へのアクセスで展開する
+    _packed: Optional[Tuple[HistoryCodec, bytes, int]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # 会話履歴の圧縮・展開・追記の排他（セッションごと。圧縮中も他のセッションは待たない）
+    _history_lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
 
     MAX_HISTORY_LENGTH = 20  # 最大会話履歴数
 
+    def __post_init__(self, messages: Optional[List[Dict]]):
+        # 引数を省略すると、クラス属性の messages（下のプロパティ）が既定値として渡される
+        self._messages = [] if messages is None or isinstance(messages, property) else messages
+        if self.license_plate is not None:
+            self._assign_plate(self.license_plate)
+
+    @property
+    def messages(self) -> List[Dict]:
+        """会話履歴（圧縮中なら展開する）"""
+        with self._history_lock:
+            return self._unpack_locked()
+
+    @messages.setter
+    def messages(self, messages: List[Dict]) -> None:
+        with self._history_lock:
+            packed, self._packed = self._packed, None
+            self._messages = messages
+        _release_packed_stats(packed)
+
+    def _assign_plate(self, plate_data: Union[Dict, LicensePlateContext]) -> None:
+        confidence = (
+            plate_data.get('confidence') if isinstance(plate_data, dict) else plate_data.confidence
+        )
+        if confidence is not None:
+            self.plate_confidence = confidence
+        self.license_plate = plate_registry.intern(plate_data)
+
     def add_message(self, role: str, content: str) -> None:
         """
         メッセージを追加する
@@ -34,34 +106,40 @@ class ConversationContext:
             role: メッセージの役割 (user/assistant/system)
             content: メッセージ内容
         """
-        self.messages.append({
-            'role': role,
-            'content': content,
-            'timestamp': time.time()
-        })
-        self.updated_at = time.time()
-
-        # 履歴が長すぎる場合は古いメッセージを削除
-        if len(self.messages) > self.MAX_HISTORY_LENGTH:
-            # システムメッセージは保持
-            system_messages = [m for m in self.messages if m['role'] == 'system']
-            other_messages = [m for m in self.messages if m['role'] != 'system']
-
-            # 最新のメッセージを保持
-            keep_count = self.MAX_HISTORY_LENGTH - len(system_messages)
-            self.messages = system_messages + other_messages[-keep_count:]
-
-    def set_license_plate(self, plate_data: Dict) -> None:
+        # 展開・追記・切り詰めの間にアイドル中の圧縮が入ると追記が失われるため、同じロック内で行う
+        with self._history_lock:
+            messages = self._unpack_locked()
+            messages.append({
+                'role': role,
+                'content': content,
+                'timestamp': time.time()
+            })
+            self.updated_at = time.time()
+
+            # 履歴が長すぎる場合は古いメッセージを削除
+            if len(messages) > self.MAX_HISTORY_LENGTH:
+                # システムメッセージは保持
+                system_messages = [m for m in messages if m['role'] == 'system']
+                other_messages = [m for m in messages if m['role'] != 'system']
+
+                # 最新のメッセージを保持
+                keep_count = self.MAX_HISTORY_LENGTH - len(system_messages)
+                self._messages = system_messages + other_messages[-keep_count:]
+
+    def set_license_plate(self, plate_data: Union[Dict, LicensePlateContext]) -> None:
         """
         ナンバープレート情報を設定する
 
         Requirements: 10.3 - ナンバープレート認識結果をコンテキストに含める
 
         Args:
-            plate_data: ナンバープレートデータ
+            plate_data: ナンバープレートデータ（正規化して共有インスタンスを参照する）
         """
-        self.license_plate = plate_data
+        self.plate_confidence = None
+        self._assign_plate(plate_data)
         self.updated_at = time.time()
+        if self._on_plate_change is not None:
+            self._on_plate_change(self)
 
     def get_messages_for_api(self) -> List[Dict]:
         """
@@ -77,20 +155,101 @@ class ConversationContext:
 
     def clear_history(self) -> None:
         """会話履歴をクリアする"""
-        self.messages = []
-        self.updated_at = time.time()
+        with self._history_lock:
+            packed, self._packed = self._packed, None
+            self._messages = []
+            self.updated_at = time.time()
+        _release_packed_stats(packed)
+
+    @property
+    def history_packed(self) -> bool:
+        """会話履歴が圧縮されているか"""
+        return self._packed is not None
+
+    def pack_history(self, codec: HistoryCodec, idle_before: Optional[float] = None) -> int:
+        """
+        会話履歴を圧縮する（アイドル中のセッション用）
+
+        Args:
+            codec: 圧縮に使うコーデック
+            idle_before: この時刻より後に更新されていたら圧縮しない（選んだ後に追記されたセッション）
+
+        Returns:
+            減ったメモリの推定バイト数（圧縮しなかった場合は0）
+        """
+        with self._history_lock:
+            messages = self._messages
+            if self._packed is not None or not messages:
+                return 0
+            if idle_before is not None and self.updated_at > idle_before:
+                return 0
+            payload = codec.pack(messages)
+            raw_size = history_size(messages)
+            saved = raw_size - len(payload)
+            if saved <= 0:
+                return 0
+            self._packed = (codec, payload, raw_size)
+            self._messages = None
+        metrics.CONTEXT_HISTORY_PACKED.inc()
+        metrics.CONTEXT_HISTORY_SAVED_BYTES.inc(saved)
+        return saved
+
+    def peek_messages(self) -> List[Dict]:
+        """会話履歴のコピー（圧縮中でも展開した状態に戻さない）"""
+        with self._history_lock:
+            packed = self._packed
+            messages = self._messages
+        if packed is not None:
+            return packed[0].unpack(packed[1])
+        return list(messages)
+
+    def release_history_stats(self) -> None:
+        """圧縮中の履歴をメトリクスの集計から外す（ContextManager から削除するとき）"""
+        with self._history_lock:
+            packed = self._packed
+            if packed is None:
+                return
+            # 圧縮前のサイズ 0 = 集計済みではない（展開しても二重に引かない）
+            self._packed = (packed[0], packed[1], 0)
+        _release_packed_stats(packed)
+
+    def _unpack_locked(self) -> List[Dict]:
+        """圧縮中なら展開して会話履歴を返す（_history_lock 取得済みで呼ぶ）"""
+        packed = self._packed
+        if packed is not None:
+            self._messages = packed[0].unpack(packed[1])
+            self._packed = None
+            _release_packed_stats(packed)
+        return self._messages
+
+    def plate_to_dict(self) -> Optional[Dict]:
+        """ナンバープレート情報を認識信頼度付きの辞書に変換"""
+        if self.license_plate is None:
+            return None
+        plate = self.license_plate.to_dict()
+        plate['confidence'] = self.plate_confidence
+        return plate
 
     def to_dict(self) -> Dict:
         """辞書に変換"""
         return {
             'session_id': self.session_id,
-            'license_plate': self.license_plate,
+            'license_plate': self.plate_to_dict(),
             'messages': self.messages,
             'created_at': self.created_at,
             'updated_at': self.updated_at,
         }
 
 
+def _release_packed_stats(packed: Optional[Tuple[HistoryCodec, bytes, int]]) -> None:
+    """展開・破棄した圧縮履歴をメトリクスの集計から外す（圧縮前のサイズ 0 は集計済みではない）"""
+    if packed is None or not packed[2]:
+        return
+    _codec, payload, raw_size = packed
+    metrics.CONTEXT_HISTORY_PACKED.dec()
+    metrics.CONTEXT_HISTORY_SAVED_BYTES.dec(raw_size - len(payload))
+
+
 class ContextManager:
     """
     コンテキストマネージャー
@@ -99,9 +258,41 @@ class ContextManager:
     """
 
     SESSION_TIMEOUT = 3600  # 1時間
+    COMPACT_BATCH = 32  # 1回の走査で圧縮するセッション数の上限（リクエストの待ち時間を抑える）
 
-    def __init__(self):
+    def __init__(self, compact_after: float = 0, history_codec: Optional[HistoryCodec] = None):
+        """
+        Args:
+            compact_after: この秒数以上アイドルのセッションの会話履歴を圧縮する（0以下で圧縮しない）
+            history_codec: 会話履歴の圧縮に使うコーデック（省略時は zlib、辞書なし）
+        """
         self._contexts: Dict[str, ConversationContext] = {}
+        # ナンバープレートの索引キー → セッションID
+        self._plate_index: Dict[str, Set[str]] = {}
+        # セッションID → 索引に登録したキー（登録時のキーで確実に外すため）
+        self._plate_keys: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        # スナップショットから復元し、まだデコードしていないセッション
+        self._pending: Dict[str, SnapshotEntry] = {}
+        self._snapshot: Optional[SnapshotReader] = None
+        self._snapshot_path = ''
+        self._restore_pending = False
+        # 前回の書き込み以降に削除したセッション（他のワーカーの分と合わせるときに復活させない）
+        self._deleted: Set[str] = set()
+        # 前回書き込んだレコード（updated_at が変わっていなければエンコードし直さない）
+        self._encoded: Dict[str, Tuple[float, bytes]] = {}
+        self.configure_history(compact_after, history_codec)
+
+    def configure_history(self, compact_after: float, history_codec: Optional[HistoryCodec] = None) -> None:
+        """
+        アイドル中のセッションの会話履歴の圧縮を設定する
+
+        Args:
+            compact_after: この秒数以上アイドルのセッションを圧縮する（0以下で圧縮しない）
+            history_codec: 圧縮に使うコーデック（省略時は zlib、辞書なし）
+        """
+        self.compact_after = compact_after
+        self.history_codec = history_codec or HistoryCodec()
 
     def get_or_create(self, session_id: str) -> ConversationContext:
         """
@@ -115,10 +306,26 @@ class ContextManager:
         """
         self._cleanup_expired()
 
-        if session_id not in self._contexts:
-            self._contexts[session_id] = ConversationContext(session_id=session_id)
+        with self._lock:
+            context = self._contexts.get(session_id) or self._restore(session_id)
+            if context is None:
+                context = self._add(ConversationContext(session_id=session_id))
+            return context
 
-        return self._contexts[session_id]
+    def add_all(self, contexts: Iterable[ConversationContext]) -> None:
+        """
+        作成済みのコンテキストを一括登録する（同じセッションIDは置き換える）
+
+        get_or_create と違い、期限切れのセッションを走査しない。
+
+        Args:
+            contexts: 登録するコンテキスト
+        """
+        self.ensure_restored()
+        with self._lock:
+            for context in contexts:
+                self._remove(context.session_id)
+                self._add(context)
 
     def get(self, session_id: str) -> Optional[ConversationContext]:
         """
@@ -131,7 +338,8 @@ class ContextManager:
             ConversationContext または None
         """
         self._cleanup_expired()
-        return self._contexts.get(session_id)
+        with self._lock:
+            return self._contexts.get(session_id) or self._restore(session_id)
 
     def delete(self, session_id: str) -> bool:
         """
@@ -143,22 +351,298 @@ class ContextManager:
         Returns:
             削除成功したかどうか
         """
-        if session_id in self._contexts:
-            del self._contexts[session_id]
-            return True
-        return False
+        self.ensure_restored()
+        with self._lock:
+            if session_id in self._contexts or session_id in self._pending:
+                self._remove(session_id)
+                self._deleted.add(session_id)
+                self._update_session_gauge()
+                return True
+            return False
+
+    def find_by_plate(self, plate: Union[str, Dict]) -> List[ConversationContext]:
+        """
+        ナンバープレートに対応する全セッションを取得する
+
+        索引を引くだけなので、全セッション数ではなく該当セッション数に比例する時間で返る。
+        期限切れのセッションはここで取り除く。
+
+        Args:
+            plate: ナンバープレートデータ、または「品川330あ1234」のような文字列
+
+        Returns:
+            ConversationContext のリスト（更新日時の新しい順）
+        """
+        key = canonical_key(plate)
+        if key is None:
+            return []
+
+        self.ensure_restored()
+        with self._lock:
+            session_ids = self._plate_index.get(key)
+            if not session_ids:
+                return []
+
+            current_time = time.time()
+            found = []
+            expired = []
+            restore = []
+            for session_id in session_ids:
+                context = self._contexts.get(session_id)
+                updated_at = context.updated_at if context else self._pending[session_id].updated_at
+                if current_time - updated_at > self.SESSION_TIMEOUT:
+                    expired.append(session_id)
+                elif context is None:
+                    restore.append(session_id)
+                else:
+                    found.append(context)
+
+            for session_id in expired:
+                self._remove(session_id)
+            # 索引を書き換えるので、走査を終えてからデコードする
+            for session_id in restore:
+                context = self._restore(session_id)
+                if context is not None:
+                    found.append(context)
+            if expired:
+                self._update_session_gauge()
+
+        found.sort(key=lambda context: context.updated_at, reverse=True)
+        return found
+
+    def _add(self, context: ConversationContext) -> ConversationContext:
+        """コンテキストを登録して索引に加える（ロック取得済みで呼ぶ）"""
+        self._contexts[context.session_id] = context
+        self._deleted.discard(context.session_id)
+        context._on_plate_change = self._reindex_plate
+        self._index_plate(context)
+        self._update_session_gauge()
+        return context
+
+    def _remove(self, session_id: str) -> None:
+        """コンテキスト（未デコードのものを含む）を削除して索引から外す（ロック取得済みで呼ぶ）"""
+        context = self._contexts.pop(session_id, None)
+        if context is not None:
+            context._on_plate_change = None
+            context.release_history_stats()
+        else:
+            self._pending.pop(session_id, None)
+        self._unindex_plate(session_id)
+
+    def _update_session_gauge(self) -> None:
+        metrics.CONTEXT_SESSIONS.set(len(self._contexts) + len(self._pending))
+
+    def _reindex_plate(self, context: ConversationContext) -> None:
+        """set_license_plate で変わったナンバープレートを索引に反映する"""
+        with self._lock:
+            if self._contexts.get(context.session_id) is not context:
+                return
+            self._unindex_plate(context.session_id)
+            self._index_plate(context)
+
+    def _index_plate(self, context: ConversationContext) -> None:
+        if context.license_plate is None:
+            return
+        self._index_key(context.session_id, context.license_plate.full_text)
+
+    def _index_key(self, session_id: str, key: str) -> None:
+        self._plate_index.setdefault(key, set()).add(session_id)
+        self._plate_keys[session_id] = key
+
+    def _unindex_plate(self, session_id: str) -> None:
+        key = self._plate_keys.pop(session_id, None)
+        if key is None:
+            return
+        session_ids = self._plate_index.get(key)
+        if session_ids is not None:
+            session_ids.discard(session_id)
+            if not session_ids:
+                del self._plate_index[key]
 
     def _cleanup_expired(self) -> None:
-        """期限切れのコンテキストを削除する"""
+        """期限切れのコンテキストを削除し、アイドル中のコンテキストの会話履歴を圧縮する"""
+        self.ensure_restored()
         current_time = time.time()
-        expired_sessions = [
-            session_id
-            for session_id, context in self._contexts.items()
-            if current_time - context.updated_at > self.SESSION_TIMEOUT
-        ]
+        compact_after = self.compact_after
+        with self._lock:
+            expired_sessions = []
+            idle = []
+            for session_id, context in self._contexts.items():
+                elapsed = current_time - context.updated_at
+                if elapsed > self.SESSION_TIMEOUT:
+                    expired_sessions.append(session_id)
+                elif 0 < compact_after < elapsed and len(idle) < self.COMPACT_BATCH and not context.history_packed:
+                    idle.append(context)
+            expired_sessions.extend(
+                session_id
+                for session_id, entry in self._pending.items()
+                if current_time - entry.updated_at > self.SESSION_TIMEOUT
+            )
+
+            for session_id in expired_sessions:
+                self._remove(session_id)
+
+            if expired_sessions:
+                self._update_session_gauge()
+
+            for context in idle:
+                context.pack_history(self.history_codec, idle_before=current_time - compact_after)
+
+    def restore_from(self, path: str) -> None:
+        """
+        スナップショットからの復元を予約する
+
+        ファイルはここでは読まない。最初にセッションにアクセスしたとき
+        （または ensure_restored）に索引だけを読み込む。
+
+        Args:
+            path: スナップショットのパス（空なら復元しない）
+        """
+        with self._lock:
+            for session_id in list(self._pending):
+                self._remove(session_id)
+            self._snapshot = None
+            self._snapshot_path = path
+            self._restore_pending = bool(path)
+            self._update_session_gauge()
+
+    def ensure_restored(self) -> int:
+        """
+        restore_from で指定したスナップショットの索引を読み込む（2回目以降は何もしない）
 
-        for session_id in expired_sessions:
-            del self._contexts[session_id]
+        ファイルが無い・壊れている場合は警告を出して空の状態で始める。
+
+        Returns:
+            まだデコードしていないセッション数
+        """
+        if not self._restore_pending:
+            return len(self._pending)
+        with self._lock:
+            if self._restore_pending:
+                self._restore_pending = False
+                self._load_snapshot_index()
+            return len(self._pending)
+
+    def _load_snapshot_index(self) -> None:
+        started = time.perf_counter()
+        try:
+            reader = SnapshotReader(self._snapshot_path)
+        except FileNotFoundError:
+            return
+        except (SnapshotError, OSError) as e:
+            logger.warning("Ignoring context snapshot %s: %s", self._snapshot_path, e)
+            return
+
+        current_time = time.time()
+        for session_id, entry in reader.entries.items():
+            if session_id in self._contexts or current_time - entry.updated_at > self.SESSION_TIMEOUT:
+                continue
+            self._pending[session_id] = entry
+            if entry.plate_key:
+                self._index_key(session_id, entry.plate_key)
+        self._snapshot = reader
+        self._update_session_gauge()
+
+        elapsed = time.perf_counter() - started
+        metrics.CONTEXT_SNAPSHOT_DURATION.labels('restore').observe(elapsed)
+        logger.info(
+            "Restored %d sessions from %s (index only, %.1fms)",
+            len(self._pending), self._snapshot_path, elapsed * 1000
+        )
+
+    def _restore(self, session_id: str) -> Optional[ConversationContext]:
+        """未デコードのセッションをデコードして登録する（ロック取得済みで呼ぶ）"""
+        entry = self._pending.pop(session_id, None)
+        if entry is None:
+            return None
+        self._unindex_plate(session_id)
+        try:
+            record = self._snapshot.load(entry)
+        except SnapshotError as e:
+            logger.warning("Discarding session %s from snapshot: %s", session_id, e)
+            self._update_session_gauge()
+            return None
+        return self._add(ConversationContext(
+            session_id=session_id,
+            license_plate=record.license_plate,
+            messages=record.messages,
+            created_at=record.created_at,
+            updated_at=record.updated_at,
+        ))
+
+    def write_snapshot(self, path: str) -> int:
+        """
+        全セッションをスナップショットに書き込む
+
+        同じファイルに他のワーカーが書いたセッションは残し、同じセッションは
+        updated_at の新しい方を使う。未デコードのセッションはレコードをそのまま書き写す。
+
+        Args:
+            path: 書き込み先
+
+        Returns:
+            書き込んだセッション数
+        """
+        # ロック内では参照のコピーだけを取り、エンコードはロックの外で行う
+        live = []
+        with self._lock:
+            for session_id, context in self._contexts.items():
+                cached = self._encoded.get(session_id)
+                if cached is not None and cached[0] == context.updated_at:
+                    record = cached[1]
+                else:
+                    record = SessionRecord(
+                        created_at=context.created_at,
+                        updated_at=context.updated_at,
+                        license_plate=context.plate_to_dict(),
+                        messages=context.peek_messages(),
+                    )
+                live.append((session_id, self._plate_keys.get(session_id), context.updated_at, record))
+            pending = list(self._pending.values())
+            reader = self._snapshot
+            deleted, self._deleted = self._deleted, set()
+
+        encoded: Dict[str, Tuple[float, bytes]] = {}
+
+        def encode(session_id, updated_at, record):
+            payload = record if isinstance(record, bytes) else context_snapshot.encode_record(record)
+            encoded[session_id] = (updated_at, payload)
+            return payload
+
+        current_time = time.time()
+        candidates: Dict[str, Tuple[Optional[str], float, Callable[[], bytes]]] = {}
+
+        def offer(session_id, plate_key, updated_at, payload):
+            if session_id in deleted or current_time - updated_at > self.SESSION_TIMEOUT:
+                return
+            existing = candidates.get(session_id)
+            if existing is None or updated_at >= existing[1]:
+                candidates[session_id] = (plate_key, updated_at, payload)
+
+        with context_snapshot.file_lock(path):
+            try:
+                on_disk = SnapshotReader(path)
+            except FileNotFoundError:
+                on_disk = None
+            except SnapshotError as e:
+                logger.warning("Overwriting unreadable context snapshot %s: %s", path, e)
+                on_disk = None
+
+            try:
+                if on_disk is not None:
+                    for entry in on_disk.entries.values():
+                        offer(entry.session_id, entry.plate_key, entry.updated_at, partial(on_disk.payload, entry))
+                for entry in pending:
+                    offer(entry.session_id, entry.plate_key, entry.updated_at, partial(reader.payload, entry))
+                for session_id, plate_key, updated_at, record in live:
+                    offer(session_id, plate_key, updated_at, partial(encode, session_id, updated_at, record))
+                count = context_snapshot.write_snapshot(path, _resolve_records(candidates))
+            finally:
+                if on_disk is not None:
+                    on_disk.close()
+
+        self._encoded = encoded
+        return count
 
     @staticmethod
     def generate_session_id(user_id: str = '', device_id: str = '') -> str:
@@ -176,5 +660,16 @@ class ContextManager:
         return hashlib.sha256(data.encode()).hexdigest()[:32]
 
 
+def _resolve_records(
+    candidates: Dict[str, Tuple[Optional[str], float, Callable[[], bytes]]]
+) -> Iterator[Tuple[str, Optional[str], float, bytes]]:
+    """書き込むレコードを1件ずつ取り出す（壊れたレコードは捨てる）"""
+    for session_id, (plate_key, updated_at, payload) in candidates.items():
+        try:
+            yield session_id, plate_key, updated_at, payload()
+        except SnapshotError as e:
+            logger.warning("Dropping session %s from snapshot: %s", session_id, e)
+
+
 # グローバルインスタンス
 context_manager = ContextManager()
@@ -0,0 +1,365 @@
+"""
+Context Snapshot
+
+ContextManager の会話コンテキストのスナップショット（デプロイ・ワーカー入れ替え後の復元用）
+
+ファイル形式（バージョン1、整数はリトルエンディアン）:
+
+    ヘッダー   magic "PCTX" | version u16 | flags u16
+    レコード   セッションごとに zlib 圧縮したJSON
+               [created_at, updated_at, ナンバープレート or null, [[role, content, timestamp], ...]]
+    索引       zlib 圧縮したJSON
+               [[session_id, ナンバープレートの索引キー, updated_at, offset, length, crc32], ...]
+    トレーラー  索引の offset u64 | length u32 | crc32 u32 | magic "PCTX"
+
+書き込みは一時ファイルに書いて os.replace で置き換える（途中で落ちても前回のファイルが残る）。
+読み込みはファイルを mmap して索引だけを展開し、各セッションのレコードは最初に
+アクセスされたときにCRCを検証してデコードする。起動時に全セッションをデコードしない。
+
+複数ワーカーは同じファイルを共有する。書き込み時はロックファイルで排他し、
+ファイル上の他のワーカーのセッションと自分のセッションを updated_at の新しい方で合わせて書く。
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import mmap
+import os
+import signal
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows（ワーカー間の排他なし）
+    fcntl = None
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PCTX'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHH')
+_TRAILER = struct.Struct('<QII4s')
+
+# 書き込み速度を優先する（JSONのキーや日本語の繰り返しは低いレベルでも十分縮む）
+COMPRESS_LEVEL = 1
+
+
+class SnapshotError(Exception):
+    """スナップショットが壊れている、または読めない形式"""
+
+
+@dataclass(slots=True, frozen=True)
+class SnapshotEntry:
+    """索引の1件（レコード本体はデコードしない）"""
+    session_id: str
+    plate_key: Optional[str]
+    updated_at: float
+    offset: int
+    length: int
+    crc: int
+
+
+@dataclass(slots=True)
+class SessionRecord:
+    """1セッション分のデータ（ConversationContext の復元に使う）"""
+    created_at: float
+    updated_at: float
+    license_plate: Optional[Dict]
+    messages: List[Dict]
+
+
+def encode_record(record: SessionRecord) -> bytes:
+    """セッションをレコードのバイト列にする"""
+    data = [
+        record.created_at,
+        record.updated_at,
+        record.license_plate,
+        [[m['role'], m['content'], m.get('timestamp')] for m in record.messages],
+    ]
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, COMPRESS_LEVEL)
+
+
+def decode_record(payload: bytes) -> SessionRecord:
+    """
+    レコードのバイト列をデコードする
+
+    Raises:
+        SnapshotError: デコードできない場合
+    """
+    try:
+        created_at, updated_at, plate, messages = json.loads(zlib.decompress(payload))
+        return SessionRecord(
+            created_at=created_at,
+            updated_at=updated_at,
+            license_plate=plate,
+            messages=[
+                {'role': role, 'content': content, 'timestamp': timestamp}
+                for role, content, timestamp in messages
+            ],
+        )
+    except (zlib.error, ValueError, TypeError) as e:
+        raise SnapshotError(f"invalid session record: {e}")
+
+
+class SnapshotReader:
+    """
+    スナップショットの読み込み
+
+    開いた時点では索引だけを展開する。ファイルが置き換えられても、
+    開いたときの内容（mmap）を読み続ける。
+    """
+
+    def __init__(self, path: str):
+        """
+        Raises:
+            FileNotFoundError: ファイルが無い場合
+            SnapshotError: 形式・バージョン・索引のチェックサムが合わない場合
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size + _TRAILER.size:
+                raise SnapshotError(f"snapshot is truncated: {size} bytes")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.entries = self._read_index(size)
+        except Exception:
+            self._map.close()
+            raise
+
+    def _read_index(self, size: int) -> Dict[str, SnapshotEntry]:
+        magic, version, _flags = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError('not a context snapshot')
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version: {version}")
+
+        index_offset, index_length, index_crc, magic = _TRAILER.unpack_from(self._map, size - _TRAILER.size)
+        if magic != MAGIC or index_offset + index_length != size - _TRAILER.size:
+            raise SnapshotError('snapshot is truncated')
+        index = self._map[index_offset:index_offset + index_length]
+        if zlib.crc32(index) != index_crc:
+            raise SnapshotError('snapshot index checksum mismatch')
+
+        try:
+            rows = json.loads(zlib.decompress(index))
+            return {row[0]: SnapshotEntry(*row) for row in rows}
+        except (zlib.error, ValueError, TypeError) as e:
+            raise SnapshotError(f"invalid snapshot index: {e}")
+
+    def payload(self, entry: SnapshotEntry) -> bytes:
+        """
+        レコードのバイト列を取り出す（CRCを検証する）
+
+        Raises:
+            SnapshotError: チェックサムが合わない場合
+        """
+        payload = self._map[entry.offset:entry.offset + entry.length]
+        if len(payload) != entry.length or zlib.crc32(payload) != entry.crc:
+            raise SnapshotError(f"checksum mismatch: {entry.session_id}")
+        return payload
+
+    def load(self, entry: SnapshotEntry) -> SessionRecord:
+        """
+        セッションをデコードする
+
+        Raises:
+            SnapshotError: レコードが壊れている場合
+        """
+        return decode_record(self.payload(entry))
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def write_snapshot(path: str, records: Iterable[Tuple[str, Optional[str], float, bytes]]) -> int:
+    """
+    スナップショットを書き込む（一時ファイルに書いてから置き換える）
+
+    Args:
+        path: 書き込み先
+        records: (session_id, ナンバープレートの索引キー, updated_at, レコードのバイト列)
+
+    Returns:
+        書き込んだセッション数
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0))
+            offset = _HEADER.size
+            index = []
+            for session_id, plate_key, updated_at, payload in records:
+                f.write(payload)
+                index.append([session_id, plate_key, updated_at, offset, len(payload), zlib.crc32(payload)])
+                offset += len(payload)
+
+            index_bytes = zlib.compress(
+                json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                COMPRESS_LEVEL,
+            )
+            f.write(index_bytes)
+            f.write(_TRAILER.pack(offset, len(index_bytes), zlib.crc32(index_bytes), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return len(index)
+
+
+@contextmanager
+def file_lock(path: str):
+    """ワーカー間でスナップショットの読み書きを排他する（path.lock を使う）"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SnapshotWriter:
+    """
+    定期的なスナップショットの書き込み
+
+    スレッドは fork 後に引き継がれないため、ワーカーごとに最初のリクエストで開始する
+    （ensure_started）。終了時（gunicorn の worker_exit / SIGTERM）には write を呼ぶ。
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.interval = 0.0
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def configure(self, path: str, interval: float) -> None:
+        """
+        Args:
+            path: スナップショットのパス（空なら無効）
+            interval: 定期書き込みの間隔秒（0以下なら終了時のみ）
+        """
+        with self._lock:
+            self.path = path
+            self.interval = interval
+            # 設定し直したら次のリクエストでスレッドを作り直す
+            self._stop.set()
+            self._stop = threading.Event()
+            self._pid = None
+
+    def ensure_started(self) -> None:
+        """このプロセスの定期書き込みスレッドを開始する（開始済みなら何もしない）"""
+        if self._pid == os.getpid() or not self.enabled or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(
+                target=self._run, args=(self._stop,), name='context-snapshot', daemon=True
+            )
+            thread.start()
+
+    def _run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            self.write()
+
+    def write(self) -> Optional[int]:
+        """
+        スナップショットを書き込む（失敗してもログに残すだけ）
+
+        Returns:
+            書き込んだセッション数（無効または失敗時は None）
+        """
+        if not self.enabled:
+            return None
+        from app.services.context_manager import context_manager
+
+        started = time.perf_counter()
+        try:
+            count = context_manager.write_snapshot(self.path)
+        except Exception:
+            metrics.CONTEXT_SNAPSHOT_WRITES.labels('error').inc()
+            logger.exception("Failed to write context snapshot: %s", self.path)
+            return None
+        elapsed = time.perf_counter() - started
+        metrics.CONTEXT_SNAPSHOT_WRITES.labels('ok').inc()
+        metrics.CONTEXT_SNAPSHOT_DURATION.labels('write').observe(elapsed)
+        logger.debug("Wrote %d sessions to %s in %.1fms", count, self.path, elapsed * 1000)
+        return count
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _install_sigterm_handler() -> None:
+    """
+    SIGTERM で書き込んでから終了する（開発サーバーなど、他に処理系が無い場合のみ）
+
+    gunicorn はマスター・ワーカーとも自前のハンドラーで上書きするので、
+    ワーカーでは server.worker_exit から書き込む。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) not in (signal.SIG_DFL, None):
+        return
+
+    def handle(signum, frame):
+        snapshot_writer.write()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handle)
+
+
+def init_app(app) -> None:
+    """
+    CONTEXT_SNAPSHOT_PATH が設定されていれば、前回のスナップショットからの
+    遅延復元と定期書き込みを設定する
+
+    Args:
+        app: Flaskアプリケーション
+    """
+    from app.services.context_manager import context_manager
+
+    path = app.config['CONTEXT_SNAPSHOT_PATH']
+    snapshot_writer.configure(path, app.config['CONTEXT_SNAPSHOT_INTERVAL'])
+    # ファイルはここでは読まない（最初のアクセスか /papi/ready で索引だけを読む）
+    context_manager.restore_from(path)
+    if not path:
+        return
+
+    _install_sigterm_handler()
+
+    @app.before_request
+    def _start_snapshot_writer():
+        snapshot_writer.ensure_started()
+
+
+# グローバルインスタンス
+snapshot_writer = SnapshotWriter()
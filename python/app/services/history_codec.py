@@ -0,0 +1,233 @@
+"""
+History Codec
+
+アイドル中のセッションの会話履歴の圧縮
+
+ゲートを通過した後のセッションは次の通過まで参照されないが、最大20件の履歴を
+dict と文字列のまま1時間保持している。ContextManager は一定時間アイドルのセッションの
+履歴をこのコーデックで圧縮し、次にアクセスされたときに展開する（ConversationContext.messages）。
+
+- zlib（標準ライブラリ）。zstandard パッケージがあれば zstd も使える
+- 共有辞書（任意）: 定型的な日本語の質問・応答を辞書に入れておくと、1セッション分の
+  短い履歴でも圧縮率が上がる。スナップショットから作成する:
+
+    python -m app.services.history_codec --snapshot /var/lib/papi/contexts.snap --out history.dict
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard は任意
+    zstandard = None
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+CODECS = ('zlib', 'zstd')
+
+# zlib の辞書は末尾の32KBしか使われない
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+DEFAULT_DICTIONARY_SIZE = ZLIB_DICTIONARY_SIZE
+ZLIB_MEM_LEVEL = 4
+
+
+def serialize(messages: List[Dict]) -> bytes:
+    """履歴を圧縮前のバイト列にする（role, content, timestamp の配列）"""
+    data = [[m['role'], m['content'], m.get('timestamp')] for m in messages]
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def deserialize(raw: bytes) -> List[Dict]:
+    return [
+        {'role': role, 'content': content, 'timestamp': timestamp}
+        for role, content, timestamp in json.loads(raw)
+    ]
+
+
+def history_size(messages: List[Dict]) -> int:
+    """履歴が使っているメモリの推定（リスト・dict・本文の文字列・タイムスタンプ）"""
+    size = sys.getsizeof(messages)
+    for message in messages:
+        size += sys.getsizeof(message) + sys.getsizeof(message['content'])
+        size += sys.getsizeof(message.get('timestamp'))
+    return size
+
+
+class HistoryCodec:
+    """
+    会話履歴の圧縮・展開
+
+    zstd を指定しても zstandard が無い場合は zlib を使う（backend で確認できる）。
+    """
+
+    def __init__(self, codec: str = 'zlib', dictionary: bytes = b'', level: Optional[int] = None):
+        """
+        Args:
+            codec: zlib または zstd
+            dictionary: 共有辞書（空なら使わない）
+            level: 圧縮レベル（省略時は zlib 6 / zstd 3）
+
+        Raises:
+            ValueError: 不明なコーデックの場合
+        """
+        if codec not in CODECS:
+            raise ValueError(f"unknown history codec: {codec!r}")
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed; compressing idle histories with zlib")
+            codec = 'zlib'
+        self.backend = codec
+        self.dictionary = dictionary
+        self.level = level
+        self._local = threading.local()
+
+        if codec == 'zstd':
+            self._zstd_dict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        else:
+            self._zlib_dict = dictionary[-ZLIB_DICTIONARY_SIZE:]
+
+    def pack(self, messages: List[Dict]) -> bytes:
+        """履歴を圧縮する"""
+        started = time.perf_counter()
+        raw = serialize(messages)
+        if self.backend == 'zstd':
+            payload = self._zstd_compressor().compress(raw)
+        else:
+            level = 6 if self.level is None else self.level
+            # ヘッダーとチェックサムの無い raw deflate（1件あたり数バイトでも短くする）。
+            # 入力は数KBなので、初期化の重いハッシュテーブルは小さくする（memLevel）
+            if self._zlib_dict:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, ZLIB_MEM_LEVEL,
+                                              zdict=self._zlib_dict)
+            else:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, ZLIB_MEM_LEVEL)
+            payload = compressor.compress(raw) + compressor.flush()
+        metrics.CONTEXT_HISTORY_CODEC_DURATION.labels('pack').observe(time.perf_counter() - started)
+        return payload
+
+    def unpack(self, payload: bytes) -> List[Dict]:
+        """圧縮した履歴を展開する"""
+        started = time.perf_counter()
+        if self.backend == 'zstd':
+            raw = self._zstd_decompressor().decompress(payload)
+        elif self._zlib_dict:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self._zlib_dict)
+            raw = decompressor.decompress(payload) + decompressor.flush()
+        else:
+            raw = zlib.decompress(payload, -zlib.MAX_WBITS)
+        messages = deserialize(raw)
+        metrics.CONTEXT_HISTORY_CODEC_DURATION.labels('unpack').observe(time.perf_counter() - started)
+        return messages
+
+    # zstandard の圧縮・展開オブジェクトはスレッド間で共有できないので、スレッドごとに作る
+    def _zstd_compressor(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            level = 3 if self.level is None else self.level
+            compressor = self._local.compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=self._zstd_dict, write_checksum=False, write_content_size=True
+            )
+        return compressor
+
+    def _zstd_decompressor(self):
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dict)
+        return decompressor
+
+
+def load_dictionary(path: str) -> bytes:
+    """CONTEXT_HISTORY_DICTIONARY の辞書を読み込む（空なら辞書なし）"""
+    if not path:
+        return b''
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def train_dictionary(histories: Iterable[List[Dict]], codec: str = 'zlib',
+                     size: int = DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """
+    会話履歴のサンプルから共有辞書を作る
+
+    zstd は zstandard の辞書学習を使う。zlib は頻出するメッセージ本文を
+    「出現回数 × 長さ」の大きい順に選び、効果の大きいものほど末尾（直近）に置く。
+
+    Args:
+        histories: 会話履歴のサンプル
+        codec: 辞書を使うコーデック
+        size: 辞書の最大バイト数
+
+    Returns:
+        辞書のバイト列
+    """
+    histories = [h for h in histories if h]
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is not installed')
+        return zstandard.train_dictionary(size, [serialize(h) for h in histories]).as_bytes()
+
+    counts = Counter(
+        json.dumps(m['content'], ensure_ascii=False)[1:-1]
+        for history in histories for m in history
+    )
+    chosen = []
+    total = 0
+    for content, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        encoded = content.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(chosen))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """スナップショットの会話履歴から共有辞書を作る"""
+    from app.services.context_snapshot import SnapshotError, SnapshotReader
+
+    parser = argparse.ArgumentParser(description='会話履歴の共有辞書を作成する')
+    parser.add_argument('--snapshot', required=True, action='append', help='コンテキストのスナップショット')
+    parser.add_argument('--out', required=True, help='辞書の出力先（CONTEXT_HISTORY_DICTIONARY に指定する）')
+    parser.add_argument('--codec', choices=CODECS, default='zlib')
+    parser.add_argument('--size', type=int, default=DEFAULT_DICTIONARY_SIZE)
+    args = parser.parse_args(argv)
+
+    histories = []
+    for path in args.snapshot:
+        reader = SnapshotReader(path)
+        try:
+            for entry in reader.entries.values():
+                try:
+                    histories.append(reader.load(entry).messages)
+                except SnapshotError:
+                    continue
+        finally:
+            reader.close()
+
+    dictionary = train_dictionary(histories, args.codec, args.size)
+    with open(args.out, 'wb') as f:
+        f.write(dictionary)
+
+    codec = HistoryCodec(args.codec, dictionary)
+    plain = HistoryCodec(args.codec)
+    raw = sum(len(serialize(h)) for h in histories)
+    with_dict = sum(len(codec.pack(h)) for h in histories)
+    without = sum(len(plain.pack(h)) for h in histories)
+    print(f"{len(histories)} histories, dictionary {len(dictionary)} bytes -> {args.out}")
+    print(f"serialized {raw} bytes, compressed {without} bytes without / {with_dict} bytes with dictionary")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
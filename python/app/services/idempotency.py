@@ -0,0 +1,344 @@
+"""
+Idempotency
+
+Idempotency-Key ヘッダーによる /papi/chat の重複実行の防止
+
+通信の不安定なキオスク・モバイルは POST を再送するため、同じ質問で上流への
+問い合わせが何度も行われる。同じキーのリクエストは:
+
+- 実行中なら、その結果を待って同じ応答を返す（singleflight）
+- 完了していれば、保存した応答を返す（Idempotent-Replayed: true）
+- 本文が異なれば 422 IDEMPOTENCY_KEY_MISMATCH を返す
+
+保存するのは 2xx と、リクエスト自体の誤りによる 4xx（STORED_ERROR_CODES）だけ。
+上流由来の失敗（5xx・429・APIキーの設定誤りによる 401 など）は運用側の対応で
+結果が変わるので保存せず、実行中に待っていた同じキーのリクエストも実行し直す。
+キーは X-API-Key ごとに分ける。
+
+保存先は IDEMPOTENCY_STORE で選ぶ（既定は memory: 件数とバイト数の上限付きのLRU）。
+他の保存先は IdempotencyStore を実装して register_store で登録する。
+memory はワーカーごとなので、別のワーカーに届いた再送は重複して実行されうる。
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+import hashlib
+import json
+import re
+import threading
+import time
+
+from flask import current_app
+
+from app.services import metrics
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# 保存して再送に返す 4xx のエラーコード（同じ本文なら何度送っても同じ結果になる）
+STORED_ERROR_CODES = frozenset({'VALIDATION_ERROR', 'INVALID_REQUEST', 'PAYLOAD_TOO_LARGE'})
+
+# 保存した応答と一緒に返すヘッダー
+STORED_HEADERS = ('Content-Type', 'X-Cache')
+
+_KEY_PATTERN = re.compile(r'^[\x21-\x7e]{1,255}$')
+
+
+class IdempotencyError(Exception):
+    """同じキーのリクエストと競合した"""
+
+    def __init__(self, code: str, message: str):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
+    @classmethod
+    def mismatch(cls):
+        return cls('IDEMPOTENCY_KEY_MISMATCH', '同じIdempotency-Keyで異なるリクエストが送信されました')
+
+    @classmethod
+    def in_progress(cls):
+        return cls('IDEMPOTENCY_IN_PROGRESS', '同じIdempotency-Keyのリクエストを処理中です。しばらく待ってから再試行してください')
+
+
+@dataclass(slots=True, frozen=True)
+class StoredResponse:
+    """保存した応答"""
+    fingerprint: str
+    status: int
+    body: bytes
+    headers: Tuple[Tuple[str, str], ...]
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers) + len(self.fingerprint)
+
+
+def valid_key(key: str) -> bool:
+    """Idempotency-Key の形式（表示可能なASCII 1〜255文字）"""
+    return bool(_KEY_PATTERN.match(key))
+
+
+def scoped_key(key: str, api_key: Optional[str]) -> str:
+    """クライアント（X-API-Key）ごとに分けたキー（APIキーそのものは保持しない）"""
+    if not api_key:
+        return f":{key}"
+    return f"{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}:{key}"
+
+
+def fingerprint(data) -> str:
+    """リクエスト本文（パース済みJSON）の指紋"""
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def storable(response: StoredResponse) -> bool:
+    """保存して再送に返す応答か（2xx とリクエスト自体の誤りによる 4xx だけ）"""
+    if 200 <= response.status < 300:
+        return True
+    if not 400 <= response.status < 500:
+        return False
+    try:
+        code = json.loads(response.body)['error']['code']
+    except (ValueError, TypeError, KeyError):
+        return False
+    return code in STORED_ERROR_CODES
+
+
+class IdempotencyStore(ABC):
+    """
+    完了した応答の保存先
+
+    get・put・clear を実装する（複数スレッドから呼ばれる）。
+    実装していないメソッドがあれば、作成時（create_store）に TypeError になる。
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[StoredResponse]:
+        """保存した応答（無い・期限切れなら None）"""
+
+    @abstractmethod
+    def put(self, key: str, response: StoredResponse, ttl: float) -> None:
+        """応答を ttl 秒保存する"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """保存した応答をすべて削除する"""
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """プロセス内の保存先（期限付き。件数・バイト数の上限を超えたら古いものから捨てる）"""
+
+    MAX_ENTRIES = 10000
+    MAX_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, StoredResponse]]' = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key)
+                self._update_gauges()
+                return None
+            return response
+
+    def put(self, key: str, response: StoredResponse, ttl: float) -> None:
+        if response.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # 期限は全エントリで同じなので、挿入順に並べておけば先頭から期限切れになる
+            self._entries[key] = (time.monotonic() + ttl, response)
+            self._bytes += response.size
+            now = time.monotonic()
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self._bytes > self.max_bytes
+                or next(iter(self._entries.values()))[0] <= now
+            ):
+                self._remove(next(iter(self._entries)))
+            self._update_gauges()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def _remove(self, key: str) -> None:
+        _, response = self._entries.pop(key)
+        self._bytes -= response.size
+
+    def _update_gauges(self) -> None:
+        metrics.IDEMPOTENCY_STORE_ENTRIES.set(len(self._entries))
+        metrics.IDEMPOTENCY_STORE_BYTES.set(self._bytes)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+STORES: Dict[str, Callable[..., IdempotencyStore]] = {
+    'memory': MemoryIdempotencyStore,
+}
+
+
+def register_store(name: str, factory: Callable[..., IdempotencyStore]) -> None:
+    """
+    IDEMPOTENCY_STORE で選べる保存先を登録する
+
+    Args:
+        name: 保存先の名前
+        factory: max_entries・max_bytes を受け取って IdempotencyStore を返す関数
+    """
+    STORES[name] = factory
+
+
+def create_store(name: str, max_entries: int, max_bytes: int) -> IdempotencyStore:
+    """
+    Raises:
+        ValueError: 登録されていない保存先の場合
+    """
+    factory = STORES.get(name)
+    if factory is None:
+        raise ValueError(f"IDEMPOTENCY_STORE must be one of {', '.join(STORES)}: {name!r}")
+    return factory(max_entries=max_entries, max_bytes=max_bytes)
+
+
+@dataclass
+class _InFlight:
+    """実行中のリクエスト"""
+    fingerprint: str
+    event: threading.Event = field(default_factory=threading.Event)
+    result: Optional[StoredResponse] = None
+    error: Optional[BaseException] = None
+
+
+class Idempotency:
+    """同じキーのリクエストの集約と応答の再送"""
+
+    DEFAULT_TTL = 3600
+    DEFAULT_WAIT_TIMEOUT = 60
+
+    def __init__(self, store: Optional[IdempotencyStore] = None, ttl: float = DEFAULT_TTL,
+                 wait_timeout: float = DEFAULT_WAIT_TIMEOUT):
+        """
+        Args:
+            store: 完了した応答の保存先
+            ttl: 応答を保存しておく秒数
+            wait_timeout: 実行中の同じキーのリクエストを待つ最大秒数
+        """
+        self.store = store or MemoryIdempotencyStore()
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _InFlight] = {}
+
+    def execute(self, key: str, request_fingerprint: str, handler: Callable[[], object]):
+        """
+        同じキーの応答が無ければ handler を実行し、あれば同じ応答を返す
+
+        Args:
+            key: スコープ付きの Idempotency-Key
+            request_fingerprint: リクエスト本文の指紋
+            handler: 応答を返す関数（ビュー関数の戻り値と同じ形式）
+
+        Returns:
+            Flask のレスポンス（保存・実行中の応答を返した場合は Idempotent-Replayed: true）
+
+        Raises:
+            IdempotencyError: 本文が異なる、または実行中のリクエストが待機時間内に終わらない場合
+        """
+        while True:
+            stored = self.store.get(key)
+            if stored is not None:
+                return self._replay(stored, request_fingerprint, 'replayed')
+
+            with self._lock:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    # 保存は実行中の登録を外す前に行うので、ここで見つからなければ未完了
+                    stored = self.store.get(key)
+                    if stored is None:
+                        flight = self._inflight[key] = _InFlight(request_fingerprint)
+            if stored is not None:
+                return self._replay(stored, request_fingerprint, 'replayed')
+            if leader:
+                break
+
+            if flight.fingerprint != request_fingerprint:
+                metrics.IDEMPOTENCY_REQUESTS.labels('mismatch').inc()
+                raise IdempotencyError.mismatch()
+            if not flight.event.wait(self.wait_timeout):
+                metrics.IDEMPOTENCY_REQUESTS.labels('timeout').inc()
+                raise IdempotencyError.in_progress()
+            if flight.error is not None:
+                raise flight.error
+            if storable(flight.result):
+                return self._replay(flight.result, request_fingerprint, 'coalesced')
+            # 保存しない失敗は共有せず、このリクエストで実行し直す
+
+        metrics.IDEMPOTENCY_REQUESTS.labels('executed').inc()
+        try:
+            response = current_app.make_response(handler())
+            flight.result = StoredResponse(
+                fingerprint=request_fingerprint,
+                status=response.status_code,
+                body=response.get_data(),
+                headers=tuple((name, response.headers[name]) for name in STORED_HEADERS if name in response.headers),
+            )
+            # 再送で結果が変わりうる失敗は保存しない
+            if storable(flight.result):
+                self.store.put(key, flight.result, self.ttl)
+            return response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def _replay(self, stored: StoredResponse, request_fingerprint: str, outcome: str):
+        if stored.fingerprint != request_fingerprint:
+            metrics.IDEMPOTENCY_REQUESTS.labels('mismatch').inc()
+            raise IdempotencyError.mismatch()
+        metrics.IDEMPOTENCY_REQUESTS.labels(outcome).inc()
+        response = current_app.response_class(stored.body, status=stored.status, headers=list(stored.headers))
+        response.headers[REPLAYED_HEADER] = 'true'
+        return response
+
+
+def init_app(app) -> None:
+    """
+    保存先と保存期間を設定する
+
+    Args:
+        app: Flaskアプリケーション
+
+    Raises:
+        ValueError: IDEMPOTENCY_STORE が登録されていない場合
+    """
+    idempotency.store = create_store(
+        app.config['IDEMPOTENCY_STORE'],
+        max_entries=app.config['IDEMPOTENCY_MAX_ENTRIES'],
+        max_bytes=app.config['IDEMPOTENCY_MAX_BYTES'],
+    )
+    idempotency.ttl = app.config['IDEMPOTENCY_TTL']
+    idempotency.wait_timeout = app.config['IDEMPOTENCY_WAIT_TIMEOUT']
+
+
+# グローバルインスタンス
+idempotency = Idempotency()
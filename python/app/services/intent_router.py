@@ -0,0 +1,268 @@
+"""
+Intent Router
+
+ナンバープレートの各項目から答えられる質問をLLMを使わずに応答する
+
+「登録地はどこ？」「レンタカー？」のような質問は、システムプロンプトに渡している
+license_plate の項目と対応表（地名 → 都道府県、分類番号 → 車種、ひらがな → 用途）だけで
+答えられる。事前にコンパイルした定型の文型にメッセージ全体が一致したときだけ答え、
+それ以外の語を含む質問は None を返して通常どおり Qwen に問い合わせる。
+
+    answer = intent_router.route(message, plate)
+    if answer is not None:
+        return answer.response   # 上流を呼ばない
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import re
+import unicodedata
+
+from app.models.chat import LicensePlateContext
+from app.services import metrics
+from app.services.plate_registry import normalize_text, plate_registry
+
+# 地名表示 → 都道府県
+_PREFECTURE_REGIONS = {
+    '北海道': ('札幌', '函館', '旭川', '室蘭', '苫小牧', '釧路', '知床', '帯広', '十勝', '北見'),
+    '青森県': ('青森', '八戸', '弘前'),
+    '岩手県': ('岩手', '盛岡', '平泉'),
+    '宮城県': ('宮城', '仙台'),
+    '秋田県': ('秋田',),
+    '山形県': ('山形', '庄内'),
+    '福島県': ('福島', '会津', '郡山', '白河', 'いわき'),
+    '茨城県': ('水戸', '土浦', 'つくば'),
+    '栃木県': ('宇都宮', 'とちぎ', '那須', '日光'),
+    '群馬県': ('群馬', '前橋', '高崎'),
+    '埼玉県': ('大宮', '川口', '所沢', '川越', '熊谷', '春日部', '越谷'),
+    '千葉県': ('千葉', '成田', '習志野', '市川', '船橋', '袖ヶ浦', '市原', '野田', '柏', '松戸'),
+    '東京都': ('品川', '世田谷', '練馬', '杉並', '板橋', '足立', '江東', '葛飾', '八王子', '多摩'),
+    '神奈川県': ('横浜', '川崎', '湘南', '相模'),
+    '新潟県': ('新潟', '長岡', '上越'),
+    '富山県': ('富山',),
+    '石川県': ('石川', '金沢'),
+    '福井県': ('福井',),
+    '山梨県': ('山梨',),
+    '長野県': ('長野', '松本', '諏訪'),
+    '岐阜県': ('岐阜', '飛騨'),
+    '静岡県': ('静岡', '浜松', '沼津', '伊豆'),
+    '愛知県': ('名古屋', '尾張小牧', '一宮', '春日井', '豊橋', '三河', '岡崎', '豊田'),
+    '三重県': ('三重', '鈴鹿', '四日市', '伊勢志摩'),
+    '滋賀県': ('滋賀',),
+    '京都府': ('京都',),
+    '大阪府': ('大阪', 'なにわ', '和泉', '堺'),
+    '兵庫県': ('神戸', '姫路'),
+    '奈良県': ('奈良', '飛鳥'),
+    '和歌山県': ('和歌山',),
+    '鳥取県': ('鳥取',),
+    '島根県': ('島根', '出雲'),
+    '岡山県': ('岡山', '倉敷'),
+    '広島県': ('広島', '福山'),
+    '山口県': ('山口', '下関'),
+    '徳島県': ('徳島',),
+    '香川県': ('香川', '高松'),
+    '愛媛県': ('愛媛',),
+    '高知県': ('高知',),
+    '福岡県': ('福岡', '北九州', '久留米', '筑豊'),
+    '佐賀県': ('佐賀',),
+    '長崎県': ('長崎', '佐世保'),
+    '熊本県': ('熊本',),
+    '大分県': ('大分',),
+    '宮崎県': ('宮崎',),
+    '鹿児島県': ('鹿児島', '奄美'),
+    '沖縄県': ('沖縄',),
+}
+
+# plate_registry と同じ正規化をしたキーで引く（「袖ヶ浦」なども一致させるため）
+REGION_TO_PREFECTURE: Dict[str, str] = {
+    normalize_text(region): prefecture
+    for prefecture, regions in _PREFECTURE_REGIONS.items()
+    for region in regions
+}
+# 富士山ナンバーは静岡県と山梨県の両方で交付される
+REGION_TO_PREFECTURE[normalize_text('富士山')] = '静岡県または山梨県'
+
+# 分類番号の先頭の数字 → 車種
+CLASSIFICATION_TO_VEHICLE_TYPE = {
+    '0': '大型特殊自動車（建設機械）',
+    '1': '普通貨物自動車',
+    '2': '乗合自動車（バスなど）',
+    '3': '普通乗用自動車',
+    '4': '小型貨物自動車または軽貨物自動車',
+    '5': '小型乗用自動車または軽乗用自動車',
+    '6': '小型貨物自動車または軽貨物自動車',
+    '7': '小型乗用自動車または軽乗用自動車',
+    '8': '特種用途自動車（キャンピングカー・救急車など）',
+    '9': '大型特殊自動車',
+}
+
+# ひらがな → 用途
+HIRAGANA_TO_USAGE = {
+    **{kana: 'commercial' for kana in 'あいうえかきくけこを'},
+    **{kana: 'private' for kana in 'さすせそたちつてとなにぬねのはひふほまみむめもやゆらりるろ'},
+    **{kana: 'rental' for kana in 'われ'},
+    'よ': 'forces',
+}
+
+USAGE_DESCRIPTIONS = {
+    'commercial': '事業用（タクシーやトラックなどの営業用）の自動車（軽自動車では自家用にも使われます）',
+    'private': '自家用の自動車（レンタカーや事業用ではありません）',
+    'rental': 'レンタカー（貸渡用）の自動車',
+    'forces': '在日米軍関係者の私有車両',
+}
+
+# 手続きや理由を尋ねる質問は項目だけでは答えられないため、LLMに任せる
+_OPEN_QUESTION = re.compile(r'方法|どうやって|どうすれば|手続|申請|料金|費用|値段|借り|なぜ|理由|変更|取得|予約|おすすめ')
+
+# 意図 → 話題の判定用の正規表現（NFKC 後のメッセージに適用。model_router の特徴に使う）
+_INTENT_PATTERNS: Tuple[Tuple[str, 're.Pattern'], ...] = (
+    ('region', re.compile(r'登録地|都道府県|何県|なに県|どこの(?:県|車|ナンバー)|どこナンバー|地域|管轄|運輸支局')),
+    ('vehicle_type', re.compile(r'車種|分類番号|種別|乗用車|貨物車|普通車|小型車|何の車|どんな車')),
+    ('usage', re.compile(r'レンタカー|わナンバー|事業用|営業(?:車|用)|自家用|用途|緑ナンバー|業務用')),
+)
+
+# ローカルで答える質問の文型（メッセージ全体に一致させる）。
+# 「この車の」などの主語と項目・疑問詞・文末表現のほかに語があれば LLM に任せる
+# （「レンタカーの返却場所はどこ？」「事業用の車は入場できますか？」は一致しない）
+_SUBJECT = r'(?:(?:(?:この|その)(?:車両|車|クルマ|くるま|自動車|ナンバープレート|ナンバー|プレート)|これ|それ)(?:の|は|って|、)?)?'
+_ENDING = r'(?:ですか|でしょうか|なんですか|なの|なん|か)?(?:(?:教えて|おしえて)(?:ください|下さい)?)?[?!。.\s]*'
+_FIELD_NOUNS = {
+    'region': r'登録地|登録(?:都道府県|県)|都道府県|地名|地域|管轄',
+    'vehicle_type': r'車種|分類番号|種別',
+    'usage': r'用途',
+}
+_FIELD = re.compile('|'.join(f'(?P<{name}>{nouns})' for name, nouns in _FIELD_NOUNS.items()))
+_ANY_FIELD = '(?:' + '|'.join(_FIELD_NOUNS.values()) + ')'
+_FIELD_QUESTION = re.compile(
+    _SUBJECT
+    + rf'(?P<fields>{_ANY_FIELD}(?:(?:と|、|・){_ANY_FIELD})*)'
+    + r'(?:は|って|を)?(?:どこ|何|なに|なん)?'
+    + _ENDING
+)
+_PREDICATE_QUESTIONS: Tuple[Tuple[str, 're.Pattern'], ...] = (
+    ('region', re.compile(
+        _SUBJECT + r'(?:(?:何|なに)県|どこの?(?:県|都道府県|ナンバー|車))(?:の(?:ナンバー|車))?' + _ENDING
+    )),
+    ('vehicle_type', re.compile(_SUBJECT + r'(?:何の車|なんの車|どんな車)' + _ENDING)),
+    ('usage', re.compile(_SUBJECT + r'(?:レンタカー|わナンバー|事業用|営業車|自家用(?:車)?)' + _ENDING)),
+)
+
+
+def detect_intents(message: str) -> Tuple[str, ...]:
+    """
+    メッセージの話題になっているナンバープレートの項目を判定する
+
+    語を含むだけで該当するので、ローカルでの応答には match_question を使う。
+
+    Returns:
+        該当する意図（'region' / 'vehicle_type' / 'usage'）。無ければ空
+    """
+    text = unicodedata.normalize('NFKC', message)
+    return tuple(name for name, pattern in _INTENT_PATTERNS if pattern.search(text))
+
+
+def match_question(message: str) -> Tuple[str, ...]:
+    """
+    メッセージが「この車」の項目だけを尋ねる質問なら、その意図を返す
+
+    Returns:
+        尋ねている意図（メッセージの順）。定型の質問でなければ空
+    """
+    text = unicodedata.normalize('NFKC', message).strip()
+    match = _FIELD_QUESTION.fullmatch(text)
+    if match is not None:
+        intents = []
+        for field in _FIELD.finditer(match.group('fields')):
+            if field.lastgroup not in intents:
+                intents.append(field.lastgroup)
+        return tuple(intents)
+    return tuple(name for name, pattern in _PREDICATE_QUESTIONS if pattern.fullmatch(text))
+
+
+@dataclass(slots=True, frozen=True)
+class RoutedAnswer:
+    """ローカルで作成した応答"""
+    response: str
+    intents: Tuple[str, ...]
+
+
+class IntentRouter:
+    """
+    ナンバープレートに関する定型質問のローカル応答
+
+    複数の意図に該当する質問（「登録地と車種は？」）は、それぞれの回答をまとめて返す。
+    1つでも答えられない意図があれば LLM に任せる。
+    """
+
+    MAX_QUESTION_LENGTH = 60
+
+    def route(self, message: str, plate) -> Optional[RoutedAnswer]:
+        """
+        質問にローカルで答える
+
+        Args:
+            message: ユーザーのメッセージ
+            plate: ナンバープレートデータ（辞書または LicensePlateContext）
+
+        Returns:
+            RoutedAnswer（答えられない場合は None）
+        """
+        answer = self._route(message, plate)
+        metrics.INTENT_ROUTER_REQUESTS.labels('+'.join(answer.intents) if answer else 'none').inc()
+        return answer
+
+    def _route(self, message: str, plate) -> Optional[RoutedAnswer]:
+        if not plate or len(message) > self.MAX_QUESTION_LENGTH:
+            return None
+
+        text = unicodedata.normalize('NFKC', message)
+        if _OPEN_QUESTION.search(text):
+            return None
+        intents = match_question(text)
+        if not intents:
+            return None
+
+        plate = plate_registry.intern(plate)
+        if plate is None:
+            return None
+
+        answers = []
+        for intent in intents:
+            answer = _ANSWERERS[intent](plate)
+            if answer is None:
+                return None
+            answers.append(answer)
+        return RoutedAnswer(response='\n'.join(answers), intents=intents)
+
+
+def _answer_region(plate: LicensePlateContext) -> Optional[str]:
+    prefecture = REGION_TO_PREFECTURE.get(plate.region or '')
+    if prefecture is None:
+        return None
+    return f"地名「{plate.region}」は{prefecture}のナンバーです。車両の使用の本拠の位置（登録地）が{prefecture}の管轄であることを表します。"
+
+
+def _answer_vehicle_type(plate: LicensePlateContext) -> Optional[str]:
+    number = plate.classification_number or ''
+    vehicle_type = CLASSIFICATION_TO_VEHICLE_TYPE.get(number[:1])
+    if vehicle_type is None:
+        return None
+    return f"分類番号「{number}」の先頭の「{number[0]}」は{vehicle_type}を表します。"
+
+
+def _answer_usage(plate: LicensePlateContext) -> Optional[str]:
+    usage = HIRAGANA_TO_USAGE.get(plate.hiragana or '')
+    if usage is None:
+        return None
+    return f"ひらがな「{plate.hiragana}」は{USAGE_DESCRIPTIONS[usage]}であることを表します。"
+
+
+_ANSWERERS = {
+    'region': _answer_region,
+    'vehicle_type': _answer_vehicle_type,
+    'usage': _answer_usage,
+}
+
+
+# グローバルインスタンス
+intent_router = IntentRouter()
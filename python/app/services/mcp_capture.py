@@ -0,0 +1,307 @@
+"""
+MCP Capture
+
+上流（Qwen MCP）とのやり取りの記録（オフラインの負荷試験で再生する）
+
+MCP_CAPTURE_PATH を設定すると、QwenMCPClient の各リクエスト（リトライを含む）について
+匿名化したリクエストとレスポンス、ステータスコード、最初の応答までの時間、
+本文のチャンクごとの到着時刻をファイルに追記する。再生は benchmarks.replay_mcp_server。
+
+    python -m benchmarks.replay_mcp_server --capture /var/lib/papi/mcp.capture --port 8090
+
+ファイル形式（追記のみ、整数はリトルエンディアン）:
+
+    レコード  magic "PMCR" | length u32 | crc32 u32 | zlib 圧縮したJSON
+
+1レコードは1回の write で追記する（O_APPEND）ので、複数ワーカーで同じファイルに書ける。
+途中で切れた末尾や壊れたレコードは読み込み時に読み飛ばす。
+
+匿名化: 本文の文字列は文字種ごとに同じバイト長の文字に置き換え（句読点・空白は残す）、
+画像の data URL は長さだけを残す。APIキー（Authorization ヘッダー）は記録しない。
+role・model・finish_reason などの構造を表す値と数値（usage など）はそのまま残す。
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import random
+import struct
+import threading
+import time
+import unicodedata
+import zlib
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PMCR'
+VERSION = 1
+
+_RECORD = struct.Struct('<4sII')
+
+COMPRESS_LEVEL = 1
+
+# 匿名化せずに残す値のキー
+KEEP_KEYS = frozenset({'role', 'model', 'object', 'finish_reason', 'type', 'detail'})
+
+# UTF-8 のバイト長ごとの置き換え文字
+_MASK = {1: 'x', 2: 'ß', 3: '〇', 4: '𠀋'}
+
+
+def mask_text(text: str) -> str:
+    """文字種ごとに同じバイト長の文字へ置き換える（句読点・空白・数字の桁数は残す）"""
+    out = []
+    for ch in text:
+        if ch.isascii():
+            if ch.isalpha():
+                out.append('x')
+            elif ch.isdigit():
+                out.append('0')
+            else:
+                out.append(ch)
+        elif unicodedata.category(ch)[0] in 'PZ':
+            out.append(ch)
+        else:
+            out.append(_MASK[len(ch.encode('utf-8'))])
+    return ''.join(out)
+
+
+def anonymize(value: Any, key: Optional[str] = None) -> Any:
+    """JSONの値を匿名化する（構造・数値・KEEP_KEYS の値は残す）"""
+    if isinstance(value, dict):
+        return {k: anonymize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(v, key) for v in value]
+    if isinstance(value, str):
+        if key in KEEP_KEYS:
+            return value
+        if value.startswith('data:') and ';base64,' in value:
+            prefix, data = value.split(',', 1)
+            return f"{prefix},<{len(data)} chars>"
+        return mask_text(value)
+    return value
+
+
+def anonymize_body(body: bytes, content_type: str) -> str:
+    """
+    レスポンスの本文を匿名化する
+
+    JSONはパースして値を、SSE（text/event-stream）は data 行ごとのJSONを匿名化する。
+    """
+    text = body.decode('utf-8', errors='replace')
+    if 'text/event-stream' in content_type:
+        lines = []
+        for line in text.split('\n'):
+            if line.startswith('data: ') and line != 'data: [DONE]':
+                try:
+                    line = 'data: ' + json.dumps(anonymize(json.loads(line[6:])), ensure_ascii=False)
+                except ValueError:
+                    line = mask_text(line)
+            lines.append(line)
+        return '\n'.join(lines)
+    try:
+        return json.dumps(anonymize(json.loads(text)), ensure_ascii=False)
+    except ValueError:
+        return mask_text(text)
+
+
+def encode_record(record: Dict) -> bytes:
+    """レコードをファイルに書くバイト列にする"""
+    payload = zlib.compress(
+        json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), COMPRESS_LEVEL
+    )
+    return _RECORD.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """
+    記録ファイルのレコードを順に読む（壊れたレコード・切れた末尾は読み飛ばす）
+
+    Args:
+        path: 記録ファイル
+
+    Yields:
+        レコード
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while True:
+        start = data.find(MAGIC, offset)
+        if start < 0 or start + _RECORD.size > len(data):
+            return
+        _magic, length, crc = _RECORD.unpack_from(data, start)
+        payload = data[start + _RECORD.size:start + _RECORD.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            # 次の magic から読み直す
+            offset = start + 1
+            continue
+        offset = start + _RECORD.size + length
+        try:
+            record = json.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError):
+            continue
+        if record.get('v') == VERSION:
+            yield record
+
+
+@dataclass
+class CapturedResponse:
+    """記録しながら読んだレスポンス（QwenMCPClient は status_code と json() だけを使う）"""
+    status_code: int
+    content: bytes
+    headers: Dict[str, str]
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class MCPCapture:
+    """
+    上流とのやり取りの記録
+
+    ファイルはプロセスごとに最初の書き込みで開く（fork 前に開いたものは使わない）。
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.sample_rate = 1.0
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def configure(self, path: str, sample_rate: float = 1.0) -> None:
+        """
+        Args:
+            path: 記録ファイル（空なら無効）
+            sample_rate: 記録するリクエストの割合（0〜1）
+        """
+        with self._lock:
+            self._close()
+            self.path = path
+            self.sample_rate = sample_rate
+
+    def should_capture(self) -> bool:
+        """このリクエストを記録するか"""
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def post(self, http, endpoint: str, payload: Dict, headers: Dict) -> CapturedResponse:
+        """
+        リクエストを送り、本文のチャンクの到着時刻を記録しながら読む
+
+        接続エラー・タイムアウトも記録してから送出する。
+
+        Args:
+            http: httpx.Client
+            endpoint: エンドポイントURL
+            payload: リクエストペイロード
+            headers: リクエストヘッダー
+
+        Returns:
+            CapturedResponse
+
+        Raises:
+            httpx.HTTPError: 送信・受信に失敗した場合
+        """
+        import httpx
+
+        started = time.perf_counter()
+        record = {
+            'v': VERSION,
+            'time': round(time.time(), 3),
+            'path': httpx.URL(endpoint).path,
+            'model': payload.get('model', ''),
+            'request': anonymize(payload),
+        }
+
+        def elapsed_ms() -> float:
+            return round((time.perf_counter() - started) * 1000, 2)
+
+        try:
+            with http.stream('POST', endpoint, json=payload, headers=headers) as response:
+                record['ttfb_ms'] = elapsed_ms()
+                chunks: List[bytes] = []
+                timing = []
+                for chunk in response.iter_bytes():
+                    chunks.append(chunk)
+                    timing.append([elapsed_ms(), len(chunk)])
+                status_code = response.status_code
+                response_headers = {'content-type': response.headers.get('content-type', '')}
+        except httpx.HTTPError as e:
+            record.update(status=0, error=_error_kind(e), total_ms=elapsed_ms())
+            self.write(record)
+            raise
+
+        content = b''.join(chunks)
+        record.update(
+            status=status_code,
+            total_ms=elapsed_ms(),
+            content_type=response_headers['content-type'],
+            chunks=timing,
+            response=anonymize_body(content, response_headers['content-type']),
+        )
+        self.write(record)
+        return CapturedResponse(status_code, content, response_headers)
+
+    def write(self, record: Dict) -> None:
+        """レコードを追記する（失敗してもログに残すだけ）"""
+        data = encode_record(record)
+        try:
+            fd = self._open()
+            os.write(fd, data)
+        except OSError:
+            metrics.MCP_CAPTURE_RECORDS.labels('error').inc()
+            logger.exception("Failed to write MCP capture: %s", self.path)
+            return
+        metrics.MCP_CAPTURE_RECORDS.labels('ok').inc()
+
+    def _open(self) -> int:
+        if self._fd is not None and self._pid == os.getpid():
+            return self._fd
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                self._pid = os.getpid()
+            return self._fd
+
+    def _close(self) -> None:
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._pid = None
+
+
+def _error_kind(error: Exception) -> str:
+    import httpx
+
+    if isinstance(error, httpx.TimeoutException):
+        return 'timeout'
+    if isinstance(error, httpx.ConnectError):
+        return 'connect'
+    return 'http'
+
+
+def init_app(app) -> None:
+    """
+    MCP_CAPTURE_PATH が設定されていれば上流とのやり取りを記録する
+
+    Args:
+        app: Flaskアプリケーション
+    """
+    mcp_capture.configure(app.config['MCP_CAPTURE_PATH'], app.config['MCP_CAPTURE_SAMPLE_RATE'])
+    if mcp_capture.enabled:
+        logger.warning("Capturing upstream MCP traffic to %s (sample rate %.2f)",
+                       mcp_capture.path, mcp_capture.sample_rate)
+
+
+# グローバルインスタンス
+mcp_capture = MCPCapture()
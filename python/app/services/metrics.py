@@ -0,0 +1,244 @@
+"""
+Metrics
+
+Prometheus形式のメトリクス定義
+
+gunicorn等のマルチプロセス構成では PROMETHEUS_MULTIPROC_DIR を設定すると、
+各ワーカーの値をファイル経由で集計して返す（prometheus_client の multiprocess モード）。
+値の更新はプロセスローカルなカウンタへの加算のみで、リクエスト間のロック競合はほぼない。
+"""
+
+from typing import Dict, Optional
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+# LLM呼び出しは数秒〜数十秒かかるため、上流用のバケットは長めに取る
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+HTTP_REQUESTS = Counter(
+    'papi_http_requests_total',
+    'HTTPリクエスト数',
+    ['route', 'method', 'status'],
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'papi_http_request_duration_seconds',
+    'HTTPリクエストの処理時間',
+    ['route', 'method', 'status'],
+)
+
+UPSTREAM_REQUEST_DURATION = Histogram(
+    'papi_upstream_request_duration_seconds',
+    'Qwen MCPサーバーへのリクエスト時間（試行ごと）',
+    ['model', 'outcome'],
+    buckets=UPSTREAM_BUCKETS,
+)
+
+UPSTREAM_RETRIES = Counter(
+    'papi_upstream_retries_total',
+    'Qwen MCPサーバーへのリトライ回数',
+    ['model'],
+)
+
+UPSTREAM_ERRORS = Counter(
+    'papi_upstream_errors_total',
+    'Qwen MCPサーバーのエラー数（QwenMCPError.code別）',
+    ['model', 'code'],
+)
+
+UPSTREAM_QUEUE_WAIT = Histogram(
+    'papi_upstream_queue_wait_seconds',
+    '上流の処理枠を確保するまでの待ち時間（リクエストクラス別）',
+    ['request_class'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+UPSTREAM_QUEUE_DEPTH = Gauge(
+    'papi_upstream_queue_depth',
+    '上流の処理枠を待っているリクエスト数',
+    ['request_class'],
+    multiprocess_mode='livesum',
+)
+
+UPSTREAM_IN_FLIGHT = Gauge(
+    'papi_upstream_in_flight',
+    '処理中の上流リクエスト数',
+    ['request_class'],
+    multiprocess_mode='livesum',
+)
+
+LLM_TOKENS = Counter(
+    'papi_llm_tokens_total',
+    'ChatCompletionResponse.usage のトークン数',
+    ['model', 'type'],
+)
+
+MODEL_ROUTE_REQUESTS = Counter(
+    'papi_model_route_requests_total',
+    'モデルルート別のチャット応答数（finish_reason=length は max_tokens による打ち切り）',
+    ['route', 'model', 'finish_reason'],
+)
+
+MODEL_ROUTE_DURATION = Histogram(
+    'papi_model_route_duration_seconds',
+    'モデルルート別の上流の応答時間（リトライを含む）',
+    ['route', 'model'],
+    buckets=UPSTREAM_BUCKETS,
+)
+
+MODEL_ROUTE_TOKENS = Counter(
+    'papi_model_route_tokens_total',
+    'モデルルート別のトークン数',
+    ['route', 'type'],
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'papi_log_records_dropped_total',
+    'ログのキューが一杯で捨てたレコード数',
+)
+
+CONTEXT_SESSIONS = Gauge(
+    'papi_context_sessions',
+    'ContextManager が保持しているセッション数',
+    multiprocess_mode='livesum',
+)
+
+CONTEXT_HISTORY_PACKED = Gauge(
+    'papi_context_history_packed_sessions',
+    '会話履歴を圧縮して保持しているアイドル中のセッション数',
+    multiprocess_mode='livesum',
+)
+
+CONTEXT_HISTORY_SAVED_BYTES = Gauge(
+    'papi_context_history_saved_bytes',
+    '会話履歴の圧縮で減ったメモリの推定（圧縮前 - 圧縮後）',
+    multiprocess_mode='livesum',
+)
+
+CONTEXT_HISTORY_CODEC_DURATION = Histogram(
+    'papi_context_history_codec_duration_seconds',
+    '会話履歴の圧縮・展開の時間',
+    ['operation'],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005),
+)
+
+CONTEXT_SNAPSHOT_WRITES = Counter(
+    'papi_context_snapshot_writes_total',
+    '会話コンテキストのスナップショットの書き込み数',
+    ['outcome'],
+)
+
+CONTEXT_SNAPSHOT_DURATION = Histogram(
+    'papi_context_snapshot_duration_seconds',
+    'スナップショットの書き込み・索引の読み込み時間',
+    ['operation'],
+)
+
+INTENT_ROUTER_REQUESTS = Counter(
+    'papi_intent_router_requests_total',
+    'ナンバープレートの項目からローカルで応答した質問数（intent=none は上流へ）',
+    ['intent'],
+)
+
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    'papi_semantic_cache_lookups_total',
+    'チャット応答の意味的キャッシュの検索数（stale は ttl を過ぎたエントリへのヒット）',
+    ['result'],
+)
+
+SEMANTIC_CACHE_LOOKUP_DURATION = Histogram(
+    'papi_semantic_cache_lookup_duration_seconds',
+    'チャット応答の意味的キャッシュの検索時間（埋め込みを含む）',
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025),
+)
+
+SEMANTIC_CACHE_SAMPLES = Counter(
+    'papi_semantic_cache_samples_total',
+    'キャッシュヒットを上流の応答と照合した結果（mismatch は誤ヒット）',
+    ['outcome'],
+)
+
+SEMANTIC_CACHE_ENTRIES = Gauge(
+    'papi_semantic_cache_entries',
+    'チャット応答の意味的キャッシュのエントリ数',
+    multiprocess_mode='livesum',
+)
+
+CHAT_STALE_RESPONSES = Counter(
+    'papi_chat_stale_responses_total',
+    'ttl を過ぎたキャッシュの応答を返した数（revalidate: 裏で取り直し中 / error: 上流の失敗時）',
+    ['reason'],
+)
+
+CHAT_REVALIDATIONS = Counter(
+    'papi_chat_revalidations_total',
+    'キャッシュの応答のバックグラウンドでの取り直し（skipped: 同時実行数の上限 / duplicate: 取り直し中）',
+    ['outcome'],
+)
+
+IDEMPOTENCY_REQUESTS = Counter(
+    'papi_idempotency_requests_total',
+    'Idempotency-Key 付きのリクエスト（executed: 実行 / replayed: 保存した応答 / coalesced: 実行中の応答を共有 / mismatch: 本文が異なる / timeout: 待機の打ち切り）',
+    ['outcome'],
+)
+
+IDEMPOTENCY_STORE_ENTRIES = Gauge(
+    'papi_idempotency_store_entries',
+    '保存している Idempotency-Key の応答数',
+    multiprocess_mode='livesum',
+)
+
+IDEMPOTENCY_STORE_BYTES = Gauge(
+    'papi_idempotency_store_bytes',
+    '保存している Idempotency-Key の応答のバイト数',
+    multiprocess_mode='livesum',
+)
+
+MCP_CAPTURE_RECORDS = Counter(
+    'papi_mcp_capture_records_total',
+    '上流とのやり取りを記録ファイルに追記した数',
+    ['outcome'],
+)
+
+TOKEN_TYPES = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+
+def record_usage(model: str, usage: Optional[Dict]) -> None:
+    """
+    トークン使用量を記録する
+
+    Args:
+        model: モデル名
+        usage: レスポンスの usage
+    """
+    if not usage:
+        return
+    for token_type in TOKEN_TYPES:
+        value = usage.get(token_type)
+        if isinstance(value, (int, float)) and value > 0:
+            LLM_TOKENS.labels(model, token_type).inc(value)
+
+
+def render_latest():
+    """
+    現在のメトリクスをテキスト形式で出力する
+
+    Returns:
+        (本文, Content-Type)
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,266 @@
+"""
+Model Router
+
+リクエストごとのモデル・max_tokens・temperature の選択
+
+ゲートでの一行の質問にも qwen-plus と max_tokens=2048 を使うと、応答までの時間と
+コストが無駄にかかる。メッセージ長・会話履歴の深さ・質問の意図からリクエストを分類し、
+ポリシー表の最初に一致したルールのモデルと上限を使う。
+
+    route = model_router.select(message, history)
+    response = client.chat(messages, model=route.model, max_tokens=route.max_tokens,
+                           temperature=route.temperature)
+    model_router.record(route, elapsed, response.finish_reason, response.usage)
+
+ルートごとのレイテンシ・トークン数・打ち切り（finish_reason=length）を記録するので、
+実際の値を見てポリシーを調整できる。ポリシーは MODEL_ROUTING_POLICY（JSON、または
+JSONファイルのパス）で差し替えられる（既定のポリシーはモデルを変えない）。
+
+    [
+        {"name": "brief", "max_message_length": 40, "max_history": 4,
+         "exclude_intents": ["detail"], "model": "qwen-turbo", "max_tokens": 256, "temperature": 0.3},
+        {"name": "default", "model": "qwen-plus", "max_tokens": 1024, "temperature": 0.7}
+    ]
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+import json
+import re
+import unicodedata
+
+from app.services import metrics
+from app.services.intent_router import detect_intents
+from app.services.qwen_mcp_client import QwenMCPClient
+
+# 長い説明を求める質問（短い上限だと途中で打ち切られる）
+_DETAIL_PATTERN = re.compile(r'詳しく|詳細|説明|理由|なぜ|方法|手順|比較|違い|一覧|まとめ')
+
+INTENTS = ('region', 'vehicle_type', 'usage', 'detail')
+
+# 既定のポリシーは従来のモデル（qwen-plus）のまま、短い質問の上限と temperature だけを変える。
+# 軽量モデル（qwen-turbo など）は上流の MCP サーバーで使えることを確認してから
+# MODEL_ROUTING_POLICY で指定する
+DEFAULT_POLICY: List[Dict] = [
+    {'name': 'detail', 'intents': ['detail'],
+     'model': QwenMCPClient.DEFAULT_CHAT_MODEL, 'max_tokens': QwenMCPClient.DEFAULT_MAX_TOKENS,
+     'temperature': QwenMCPClient.DEFAULT_TEMPERATURE},
+    {'name': 'brief', 'max_message_length': 40, 'max_history': 4,
+     'model': QwenMCPClient.DEFAULT_CHAT_MODEL, 'max_tokens': 256, 'temperature': 0.3},
+    {'name': 'default',
+     'model': QwenMCPClient.DEFAULT_CHAT_MODEL, 'max_tokens': QwenMCPClient.DEFAULT_MAX_TOKENS,
+     'temperature': QwenMCPClient.DEFAULT_TEMPERATURE},
+]
+
+
+@dataclass(slots=True, frozen=True)
+class ModelRoute:
+    """上流に渡すモデルと生成パラメータ"""
+    name: str
+    model: str
+    max_tokens: int
+    temperature: float
+
+
+# ルーティング無効時（従来の固定値）
+FIXED_ROUTE = ModelRoute(
+    name='fixed',
+    model=QwenMCPClient.DEFAULT_CHAT_MODEL,
+    max_tokens=QwenMCPClient.DEFAULT_MAX_TOKENS,
+    temperature=QwenMCPClient.DEFAULT_TEMPERATURE,
+)
+
+
+@dataclass(slots=True, frozen=True)
+class RequestFeatures:
+    """ルーティングに使うリクエストの特徴"""
+    message_length: int
+    history_depth: int
+    intents: frozenset
+
+
+@dataclass(slots=True, frozen=True)
+class RoutingRule:
+    """
+    ポリシー表の1行
+
+    条件を省略した項目は常に一致する。intents はいずれか1つに該当すれば一致、
+    exclude_intents はいずれか1つに該当すれば不一致。
+    """
+    route: ModelRoute
+    max_message_length: Optional[int] = None
+    max_history: Optional[int] = None
+    intents: Tuple[str, ...] = ()
+    exclude_intents: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RoutingRule':
+        """
+        辞書からルールを作成する
+
+        Raises:
+            ValueError: 必須項目が無い、または値が不正な場合
+        """
+        if not isinstance(data, dict):
+            raise ValueError('routing rule must be an object')
+        try:
+            route = ModelRoute(
+                name=str(data['name']),
+                model=str(data['model']),
+                max_tokens=int(data['max_tokens']),
+                temperature=float(data.get('temperature', FIXED_ROUTE.temperature)),
+            )
+        except KeyError as e:
+            raise ValueError(f"routing rule is missing {e.args[0]!r}")
+        if route.max_tokens <= 0:
+            raise ValueError(f"max_tokens must be positive: {route.name}")
+
+        intents = tuple(data.get('intents') or ())
+        exclude_intents = tuple(data.get('exclude_intents') or ())
+        unknown = set(intents + exclude_intents) - set(INTENTS)
+        if unknown:
+            raise ValueError(f"unknown intent: {', '.join(sorted(unknown))}")
+
+        return cls(
+            route=route,
+            max_message_length=_optional_int(data.get('max_message_length')),
+            max_history=_optional_int(data.get('max_history')),
+            intents=intents,
+            exclude_intents=exclude_intents,
+        )
+
+    @property
+    def is_catch_all(self) -> bool:
+        return (self.max_message_length is None and self.max_history is None
+                and not self.intents and not self.exclude_intents)
+
+    def matches(self, features: RequestFeatures) -> bool:
+        if self.max_message_length is not None and features.message_length > self.max_message_length:
+            return False
+        if self.max_history is not None and features.history_depth > self.max_history:
+            return False
+        if self.intents and features.intents.isdisjoint(self.intents):
+            return False
+        if self.exclude_intents and not features.intents.isdisjoint(self.exclude_intents):
+            return False
+        return True
+
+
+def _optional_int(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def extract_features(message: str, history: Optional[Sequence] = None) -> RequestFeatures:
+    """
+    リクエストの特徴を抽出する
+
+    Args:
+        message: ユーザーのメッセージ
+        history: 会話履歴
+
+    Returns:
+        RequestFeatures
+    """
+    intents = set(detect_intents(message))
+    if _DETAIL_PATTERN.search(unicodedata.normalize('NFKC', message)):
+        intents.add('detail')
+    return RequestFeatures(
+        message_length=len(message),
+        history_depth=len(history) if history else 0,
+        intents=frozenset(intents),
+    )
+
+
+def load_policy(value: str) -> Optional[List[Dict]]:
+    """
+    MODEL_ROUTING_POLICY の値を読み込む
+
+    Args:
+        value: JSON文字列、またはJSONファイルのパス（空なら既定のポリシー）
+
+    Returns:
+        ルールのリスト（空の場合は None）
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    if not value.startswith('['):
+        with open(value, encoding='utf-8') as f:
+            value = f.read()
+    policy = json.loads(value)
+    if not isinstance(policy, list):
+        raise ValueError('routing policy must be a list of rules')
+    return policy
+
+
+class ModelRouter:
+    """
+    ポリシー表によるモデルの選択
+
+    ルールは上から順に評価し、最初に一致したもののルートを使う。
+    最後のルールは条件なし（必ず一致）である必要がある。
+    """
+
+    def __init__(self, policy: Optional[List[Dict]] = None, enabled: bool = True):
+        self.configure(policy, enabled)
+
+    def configure(self, policy: Optional[List[Dict]] = None, enabled: bool = True) -> None:
+        """
+        ポリシーを設定する
+
+        Args:
+            policy: ルールのリスト（None なら DEFAULT_POLICY）
+            enabled: False なら常に FIXED_ROUTE を使う
+
+        Raises:
+            ValueError: ポリシーが不正な場合
+        """
+        rules = tuple(RoutingRule.from_dict(rule) for rule in (policy or DEFAULT_POLICY))
+        if not rules or not rules[-1].is_catch_all:
+            raise ValueError('the last routing rule must have no conditions')
+        names = [rule.route.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError('routing rule names must be unique')
+        self.rules = rules
+        self.enabled = enabled
+
+    def select(self, message: str, history: Optional[Sequence] = None) -> ModelRoute:
+        """
+        リクエストのルートを選ぶ
+
+        Args:
+            message: ユーザーのメッセージ
+            history: 会話履歴
+
+        Returns:
+            ModelRoute
+        """
+        if not self.enabled:
+            return FIXED_ROUTE
+        features = extract_features(message, history)
+        for rule in self.rules:
+            if rule.matches(features):
+                return rule.route
+        return self.rules[-1].route
+
+    def record(self, route: ModelRoute, duration: float, finish_reason: str, usage: Optional[Dict]) -> None:
+        """
+        ルートごとの結果を記録する
+
+        Args:
+            route: 使ったルート
+            duration: 上流の応答までの秒数（リトライを含む）
+            finish_reason: 応答の finish_reason（length は max_tokens による打ち切り）
+            usage: 応答の usage
+        """
+        metrics.MODEL_ROUTE_REQUESTS.labels(route.name, route.model, finish_reason or 'unknown').inc()
+        metrics.MODEL_ROUTE_DURATION.labels(route.name, route.model).observe(duration)
+        if usage:
+            for token_type in metrics.TOKEN_TYPES:
+                value = usage.get(token_type)
+                if isinstance(value, (int, float)) and value > 0:
+                    metrics.MODEL_ROUTE_TOKENS.labels(route.name, token_type).inc(value)
+
+
+# グローバルインスタンス
+model_router = ModelRouter()
@@ -0,0 +1,176 @@
+"""
+Plate Recognizer
+
+ナンバープレート認識（Qwen-VL）のリクエスト集約とキャッシュ
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional, Tuple
+import json
+import re
+import threading
+import time
+
+from app.models.chat import LicensePlateContext
+from app.services.plate_registry import plate_registry
+from app.services.qwen_mcp_client import QwenMCPClient
+
+
+RECOGNITION_PROMPT = """この画像に写っている日本のナンバープレートを認識してください。
+以下の形式でJSONを返してください：
+
+{
+  "detected": true/false,
+  "region": "地名（例：品川）",
+  "classification_number": "分類番号（例：330）",
+  "hiragana": "ひらがな（例：あ）",
+  "serial_number": "一連番号（例：1234）",
+  "confidence": 0-100の数値
+}
+
+ナンバープレートが検出できない場合は {"detected": false} を返してください。
+JSONのみを返し、他のテキストは含めないでください。"""
+
+_JSON_OBJECT_RE = re.compile(r'\{[\s\S]*\}')
+
+
+def parse_recognition(raw_text: str) -> Optional[LicensePlateContext]:
+    """
+    Qwen-VLの応答テキストをパースする
+
+    Args:
+        raw_text: モデルの応答テキスト
+
+    Returns:
+        LicensePlateContext（検出できなかった場合は None）
+    """
+    match = _JSON_OBJECT_RE.search(raw_text or '')
+    if not match:
+        return None
+
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+
+    if not isinstance(data, dict) or not data.get('detected'):
+        return None
+
+    required = ('region', 'classification_number', 'hiragana', 'serial_number')
+    if not all(data.get(key) for key in required):
+        return None
+
+    try:
+        confidence = max(0.0, min(100.0, float(data.get('confidence') or 0)))
+    except (TypeError, ValueError):
+        confidence = 0.0
+
+    # 表記揺れを正規化した共有インスタンスに、今回の認識信頼度だけを付ける
+    plate = plate_registry.intern(data)
+    if plate is None:
+        return None
+    return replace(plate, confidence=confidence)
+
+
+@dataclass
+class _InFlight:
+    """実行中の上流リクエスト"""
+    event: threading.Event = field(default_factory=threading.Event)
+    result: Optional[LicensePlateContext] = None
+    error: Optional[BaseException] = None
+
+
+class PlateRecognizer:
+    """
+    ナンバープレート認識サービス
+
+    ゲートカメラは同じフレームを連続して送ってくるため、画像のSHA-256を
+    キーに同時リクエストを1回の上流呼び出しに集約し、結果をTTL付きで保持する。
+    """
+
+    CACHE_TTL = 300  # 5分
+    MAX_CACHE_ENTRIES = 1000
+
+    def __init__(self, ttl: float = CACHE_TTL, max_entries: int = MAX_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[str, Tuple[float, Optional[LicensePlateContext]]]' = OrderedDict()
+        self._inflight: Dict[str, _InFlight] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def recognize(
+        self,
+        image: bytes,
+        image_hash: str,
+        mime_type: str,
+        client: QwenMCPClient
+    ) -> Tuple[Optional[LicensePlateContext], str]:
+        """
+        画像からナンバープレートを認識する
+
+        Args:
+            image: 画像のバイト列
+            image_hash: 画像のSHA-256（16進数）
+            mime_type: 画像のMIMEタイプ
+            client: Qwen MCPクライアント
+
+        Returns:
+            (認識結果または None, 取得元 'upstream' / 'cache' / 'coalesced')
+
+        Raises:
+            QwenMCPError: 上流の呼び出しに失敗した場合
+        """
+        with self._lock:
+            entry = self._cache.get(image_hash)
+            if entry is not None:
+                expires_at, plate = entry
+                if time.monotonic() < expires_at:
+                    self._cache.move_to_end(image_hash)
+                    self.stats['hits'] += 1
+                    return plate, 'cache'
+                del self._cache[image_hash]
+
+            flight = self._inflight.get(image_hash)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[image_hash] = flight
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, 'coalesced'
+
+        try:
+            response = client.recognize_license_plate(image, mime_type, RECOGNITION_PROMPT)
+            flight.result = parse_recognition(response.content)
+            with self._lock:
+                self._cache[image_hash] = (time.monotonic() + self.ttl, flight.result)
+                self._cache.move_to_end(image_hash)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return flight.result, 'upstream'
+        except BaseException as e:
+            # 失敗はキャッシュしない（待機中のリクエストには同じエラーを返す）
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(image_hash, None)
+            flight.event.set()
+
+    def clear(self) -> None:
+        """キャッシュと統計をクリアする"""
+        with self._lock:
+            self._cache.clear()
+            self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+
+# グローバルインスタンス
+plate_recognizer = PlateRecognizer()
@@ -0,0 +1,173 @@
+"""
+Plate Registry
+
+ナンバープレートの正規化と共有（インターン）
+
+同じ車両のナンバープレートは、表記揺れ（全角/半角の数字、カタカナ/ひらがな、
+一連番号の「・」「-」の有無など）を吸収した正規形の LicensePlateContext に変換し、
+正規キーごとに1つのインスタンスを共有する。
+
+    plate = plate_registry.intern({'full_text': '品川３３０ア12-34'})
+    plate.full_text   # '品川330あ1234'
+
+共有インスタンスは変更不可（frozen）なので、セッション間で安全に参照でき、
+同一車両かどうかは `is` で比較できる。認識信頼度のような観測ごとの値は含めない。
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+import re
+import sys
+import threading
+import unicodedata
+
+from app.models.chat import LicensePlateContext
+
+PLATE_FIELDS = ('region', 'classification_number', 'hiragana', 'serial_number')
+
+# 一連番号の「12-34」「・・12」などの区切りと空白（NFKC 後の文字）
+_SEPARATORS = re.compile(r'[\s\-‐‑–—―−ー・.]')
+
+# カタカナ（ァ〜ヶ）→ ひらがな
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize_text(value) -> str:
+    """NFKC で全角英数・半角カナを揃え、カタカナをひらがなにし、区切りを除く"""
+    text = unicodedata.normalize('NFKC', str(value)).translate(_KATAKANA_TO_HIRAGANA)
+    return _SEPARATORS.sub('', text)
+
+
+def normalize_plate(plate: Union[str, Dict, LicensePlateContext, None]) -> Optional[LicensePlateContext]:
+    """
+    ナンバープレートを正規形に変換する
+
+    各フィールドを正規化し、地名・分類番号・ひらがな・一連番号が揃っていれば
+    full_text をそこから組み立てる。揃っていなければ full_text を正規化して使う。
+
+    Args:
+        plate: ナンバープレートデータ、または「品川330あ1234」のような文字列
+
+    Returns:
+        正規形の LicensePlateContext（confidence なし）。特定できない場合は None
+    """
+    if not plate:
+        return None
+    if isinstance(plate, str):
+        fields = {'full_text': plate}
+    elif isinstance(plate, LicensePlateContext):
+        fields = plate.to_dict()
+    else:
+        fields = plate
+
+    normalized = {}
+    for name in PLATE_FIELDS:
+        value = fields.get(name)
+        if value:
+            normalized[name] = normalize_text(value) or None
+    if normalized.get('classification_number'):
+        normalized['classification_number'] = normalized['classification_number'].upper()
+
+    if all(normalized.get(name) for name in PLATE_FIELDS):
+        full_text = ''.join(normalized[name] for name in PLATE_FIELDS)
+    else:
+        full_text = fields.get('full_text')
+        full_text = normalize_text(full_text).upper() if full_text else None
+        if not full_text:
+            return None
+
+    return LicensePlateContext(full_text=full_text, **normalized)
+
+
+def canonical_key(plate: Union[str, Dict, LicensePlateContext, None]) -> Optional[str]:
+    """
+    ナンバープレートの正規キーを返す
+
+    Args:
+        plate: ナンバープレートデータ、または「品川330あ1234」のような文字列
+
+    Returns:
+        正規キー（正規化した full_text）。特定できない場合は None
+    """
+    # 登録済みの正規キーはそのまま返す（検索キーの大半は正規形で届く）
+    if isinstance(plate, str) and plate_registry.get(plate) is not None:
+        return plate
+    normalized = normalize_plate(plate)
+    return normalized.full_text if normalized else None
+
+
+class PlateRegistry:
+    """
+    正規化したナンバープレートの共有レジストリ
+
+    正規キーごとに1つの LicensePlateContext を保持する。文字列も sys.intern するため、
+    地名やひらがなは異なる車両の間でも共有される。
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        """
+        Args:
+            max_entries: 保持する最大件数（超えたら古い順に外す。既存の参照はそのまま有効）
+        """
+        self.max_entries = max_entries
+        self._plates: 'OrderedDict[str, LicensePlateContext]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def intern(self, plate: Union[str, Dict, LicensePlateContext, None]) -> Optional[LicensePlateContext]:
+        """
+        ナンバープレートを正規化して共有インスタンスを返す
+
+        Args:
+            plate: ナンバープレートデータ、または「品川330あ1234」のような文字列
+
+        Returns:
+            共有の LicensePlateContext（特定できない場合は None）
+        """
+        normalized = normalize_plate(plate)
+        if normalized is None:
+            return None
+
+        key = normalized.full_text
+        shared = self._plates.get(key)
+        if shared is not None and not _is_richer(normalized, shared):
+            return shared
+
+        with self._lock:
+            shared = self._plates.get(key)
+            # full_text だけで登録済みの車両は、フィールドが揃った時点で置き換える
+            if shared is None or _is_richer(normalized, shared):
+                # 上限では最も古く登録した車両だけを外す（他の車両の共有は保つ）
+                while shared is None and len(self._plates) >= self.max_entries:
+                    self._plates.popitem(last=False)
+                shared = LicensePlateContext(
+                    **{name: _intern(value) for name, value in normalized.to_dict().items()}
+                )
+                self._plates[sys.intern(key)] = shared
+            return shared
+
+    def get(self, key: str) -> Optional[LicensePlateContext]:
+        """正規キーで共有インスタンスを取得する"""
+        return self._plates.get(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plates.clear()
+
+    def __len__(self) -> int:
+        return len(self._plates)
+
+
+def _is_complete(plate: LicensePlateContext) -> bool:
+    return bool(plate.region and plate.classification_number and plate.hiragana and plate.serial_number)
+
+
+def _is_richer(plate: LicensePlateContext, shared: LicensePlateContext) -> bool:
+    return not _is_complete(shared) and _is_complete(plate)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# グローバルインスタンス
+plate_registry = PlateRegistry()
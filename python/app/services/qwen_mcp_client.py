@@ -3,14 +3,22 @@ Qwen MCP Client
 
 Qwen MCPサーバーとの通信を行うクライアント
 Requirements: 10.1, 10.5
+
+httpx（certifi を含む）の読み込みは起動時間の大半を占めるため、
+初回リクエスト時まで遅らせる。HTTPクライアントは接続プールごと使い回す。
 """
 
-import httpx
+import base64
 import logging
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import threading
 import time
 
+from app.services import metrics
+from app.services.mcp_capture import mcp_capture
+from app.services.upstream_scheduler import SchedulerTimeout, current_request_class, upstream_scheduler
+
 logger = logging.getLogger(__name__)
 
 
@@ -39,6 +47,10 @@ class QwenMCPError(Exception):
     def rate_limited(cls, details: Optional[Dict] = None):
         return cls('RATE_LIMITED', 'リクエスト制限を超えました。しばらく待ってから再試行してください', details)
 
+    @classmethod
+    def server_busy(cls, details: Optional[Dict] = None):
+        return cls('SERVER_BUSY', '混雑しています。しばらく待ってから再試行してください', details)
+
 
 @dataclass
 class ChatMessage:
@@ -66,6 +78,9 @@ class QwenMCPClient:
     MAX_RETRIES = 3
     RETRY_DELAY = 0.5  # seconds
     BACKOFF_MULTIPLIER = 2
+    DEFAULT_CHAT_MODEL = 'qwen-plus'
+    DEFAULT_MAX_TOKENS = 2048
+    DEFAULT_TEMPERATURE = 0.7
 
     def __init__(
         self,
@@ -87,8 +102,42 @@ class QwenMCPClient:
         self.api_key = api_key
         self.timeout = timeout
         self.max_retries = max_retries
+        self._http = None
+        self._http_lock = threading.Lock()
 
-    def chat(self, messages: List[Dict]) -> ChatCompletionResponse:
+    def _get_http(self):
+        """
+        HTTPクライアントを取得する（初回使用時に作成）
+
+        httpx.Client はスレッドセーフなので、スレッドワーカー間で共有して
+        TLSコンテキストとコネクションを使い回す。
+        """
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    import httpx
+                    self._http = httpx.Client(timeout=self.timeout)
+        return self._http
+
+    def warm_up(self) -> None:
+        """HTTPクライアントを事前に作成する（readiness チェック用）"""
+        self._get_http()
+
+    def close(self) -> None:
+        """HTTPクライアントを閉じる"""
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+    def chat(
+        self,
+        messages: List[Dict],
+        model: str = DEFAULT_CHAT_MODEL,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_retries: Optional[int] = None
+    ) -> ChatCompletionResponse:
         """
         チャット完了リクエストを送信する
 
@@ -96,6 +145,10 @@ class QwenMCPClient:
 
         Args:
             messages: メッセージリスト
+            model: モデル名
+            max_tokens: 生成する最大トークン数
+            temperature: 生成の温度
+            max_retries: このリクエストの最大リトライ回数（省略時はクライアントの設定）
 
         Returns:
             ChatCompletionResponse
@@ -106,10 +159,57 @@ class QwenMCPClient:
         endpoint = f"{self.base_url}/v1/chat/completions"
 
         payload = {
-            'model': 'qwen-plus',
+            'model': model,
             'messages': messages,
-            'temperature': 0.7,
-            'max_tokens': 2048,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+        }
+
+        headers = {
+            'Content-Type': 'application/json',
+        }
+
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+
+        return self._make_request_with_retry(endpoint, payload, headers, max_retries)
+
+    def recognize_license_plate(
+        self,
+        image: bytes,
+        mime_type: str,
+        prompt: str
+    ) -> ChatCompletionResponse:
+        """
+        画像付きのチャット完了リクエストを送信する（Qwen-VL）
+
+        Args:
+            image: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+            prompt: 認識指示プロンプト
+
+        Returns:
+            ChatCompletionResponse
+
+        Raises:
+            QwenMCPError: API呼び出しに失敗した場合
+        """
+        endpoint = f"{self.base_url}/v1/chat/completions"
+
+        # OpenAI互換APIはdata URLしか受け付けないため、エンコードはここで一度だけ行う
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image).decode('ascii')}"
+
+        payload = {
+            'model': 'qwen-vl-plus',
+            'messages': [{
+                'role': 'user',
+                'content': [
+                    {'type': 'image_url', 'image_url': {'url': data_url}},
+                    {'type': 'text', 'text': prompt},
+                ],
+            }],
+            'temperature': 0.1,
+            'max_tokens': 256,
         }
 
         headers = {
@@ -125,7 +225,8 @@ class QwenMCPClient:
         self,
         endpoint: str,
         payload: Dict,
-        headers: Dict
+        headers: Dict,
+        max_retries: Optional[int] = None
     ) -> ChatCompletionResponse:
         """
         リトライ機構付きでリクエストを送信する
@@ -136,6 +237,7 @@ class QwenMCPClient:
             endpoint: エンドポイントURL
             payload: リクエストペイロード
             headers: リクエストヘッダー
+            max_retries: 最大リトライ回数（省略時は self.max_retries）
 
         Returns:
             ChatCompletionResponse
@@ -145,24 +247,53 @@ class QwenMCPClient:
         """
         last_error = None
         delay = self.RETRY_DELAY
+        model = payload.get('model', '')
+        request_class = current_request_class()
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                metrics.UPSTREAM_RETRIES.labels(model).inc()
+                # バックオフ中は処理枠を他のリクエストに譲る
+                time.sleep(delay)
+                delay = min(delay * self.BACKOFF_MULTIPLIER, 5.0)
+
+            # 処理枠はリクエストクラスごとの優先度に従って割り当てる
+            try:
+                upstream_scheduler.acquire(request_class)
+            except SchedulerTimeout as e:
+                raise QwenMCPError.server_busy({'request_class': e.request_class, 'waited': e.waited})
 
-        for attempt in range(self.max_retries + 1):
             try:
-                return self._make_request(endpoint, payload, headers)
-            except QwenMCPError as e:
-                # 認証エラーやレート制限はリトライしない
-                if e.code in ['UNAUTHORIZED', 'RATE_LIMITED']:
-                    raise
+                started = time.perf_counter()
+                try:
+                    result = self._make_request(endpoint, payload, headers)
+                except QwenMCPError as e:
+                    metrics.UPSTREAM_REQUEST_DURATION.labels(model, 'error').observe(
+                        time.perf_counter() - started
+                    )
+                    metrics.UPSTREAM_ERRORS.labels(model, e.code).inc()
 
-                last_error = e
+                    # 認証エラーやレート制限はリトライしない
+                    if e.code in ['UNAUTHORIZED', 'RATE_LIMITED']:
+                        raise
 
-                logger.warning(
-                    f"Qwen MCP request failed (attempt {attempt + 1}/{self.max_retries + 1}): {e.message}"
-                )
+                    last_error = e
 
-                if attempt < self.max_retries:
-                    time.sleep(delay)
-                    delay = min(delay * self.BACKOFF_MULTIPLIER, 5.0)
+                    logger.warning(
+                        "Qwen MCP request failed (attempt %d/%d): %s",
+                        attempt + 1, max_retries + 1, e.message
+                    )
+                    continue
+            finally:
+                upstream_scheduler.release(request_class)
+
+            metrics.UPSTREAM_REQUEST_DURATION.labels(model, 'success').observe(
+                time.perf_counter() - started
+            )
+            metrics.record_usage(model, result.usage)
+            return result
 
         raise last_error or QwenMCPError.connection_failed('Unknown error occurred')
 
@@ -186,48 +317,53 @@ class QwenMCPClient:
         Raises:
             QwenMCPError: リクエストに失敗した場合
         """
-        try:
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.post(endpoint, json=payload, headers=headers)
+        import httpx
 
-                if response.status_code == 401:
-                    raise QwenMCPError.unauthorized({'endpoint': endpoint})
-
-                if response.status_code == 429:
-                    raise QwenMCPError.rate_limited({'endpoint': endpoint})
-
-                if response.status_code >= 500:
-                    raise QwenMCPError.connection_failed(
-                        f'サーバーエラー: {response.status_code}',
-                        {'endpoint': endpoint, 'status_code': response.status_code}
-                    )
+        try:
+            if mcp_capture.should_capture():
+                # 記録時のみストリームで読み、チャンクごとの到着時刻を残す
+                response = mcp_capture.post(self._get_http(), endpoint, payload, headers)
+            else:
+                response = self._get_http().post(endpoint, json=payload, headers=headers)
+
+            if response.status_code == 401:
+                raise QwenMCPError.unauthorized({'endpoint': endpoint})
+
+            if response.status_code == 429:
+                raise QwenMCPError.rate_limited({'endpoint': endpoint})
+
+            if response.status_code >= 500:
+                raise QwenMCPError.connection_failed(
+                    f'サーバーエラー: {response.status_code}',
+                    {'endpoint': endpoint, 'status_code': response.status_code}
+                )
 
-                if response.status_code >= 400:
-                    raise QwenMCPError(
-                        'API_ERROR',
-                        f'APIエラー: {response.status_code}',
-                        {'endpoint': endpoint, 'status_code': response.status_code}
-                    )
+            if response.status_code >= 400:
+                raise QwenMCPError(
+                    'API_ERROR',
+                    f'APIエラー: {response.status_code}',
+                    {'endpoint': endpoint, 'status_code': response.status_code}
+                )
 
-                data = response.json()
+            data = response.json()
 
-                # レスポンスのパース
-                choices = data.get('choices', [])
-                if not choices:
-                    raise QwenMCPError(
-                        'INVALID_RESPONSE',
-                        '応答が空です',
-                        {'response': data}
-                    )
+            # レスポンスのパース
+            choices = data.get('choices', [])
+            if not choices:
+                raise QwenMCPError(
+                    'INVALID_RESPONSE',
+                    '応答が空です',
+                    {'response': data}
+                )
 
-                choice = choices[0]
-                message = choice.get('message', {})
+            choice = choices[0]
+            message = choice.get('message', {})
 
-                return ChatCompletionResponse(
-                    content=message.get('content', ''),
-                    finish_reason=choice.get('finish_reason', 'stop'),
-                    usage=data.get('usage')
-                )
+            return ChatCompletionResponse(
+                content=message.get('content', ''),
+                finish_reason=choice.get('finish_reason', 'stop'),
+                usage=data.get('usage')
+            )
 
         except httpx.ConnectError as e:
             raise QwenMCPError.connection_failed(
@@ -244,3 +380,28 @@ class QwenMCPClient:
                 f'HTTPエラー: {str(e)}',
                 {'endpoint': endpoint}
             )
+
+
+_shared_clients: Dict[Tuple[str, str], QwenMCPClient] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(base_url: str, api_key: str = '') -> QwenMCPClient:
+    """
+    接続先ごとに共有するクライアントを取得する（初回使用時に作成）
+
+    Args:
+        base_url: MCPサーバーのベースURL
+        api_key: APIキー
+
+    Returns:
+        QwenMCPClient
+    """
+    key = (base_url, api_key)
+    client = _shared_clients.get(key)
+    if client is None:
+        with _shared_clients_lock:
+            client = _shared_clients.get(key)
+            if client is None:
+                client = _shared_clients[key] = QwenMCPClient(base_url=base_url, api_key=api_key)
+    return client
@@ -0,0 +1,238 @@
+"""
+Request Timing
+
+リクエスト内のフェーズ別処理時間の計測
+
+    with request_timing.phase('upstream'):
+        response = client.chat(messages)
+
+計測結果は Server-Timing レスポンスヘッダーとして返し、必要に応じて構造化JSONログに出力する。
+遅いリクエストについてはスタックダンプ、サンプリングしたリクエストについては cProfile を取得できる。
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Optional
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+
+from flask import g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimer:
+    """1リクエスト分のフェーズ計測"""
+
+    __slots__ = ('started', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # 同名フェーズが複数回あれば合算する
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - started)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timing ヘッダー値（ミリ秒）"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(parts)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    現在のリクエストのフェーズを計測する
+
+    リクエストコンテキスト外や計測無効時は何もしない。
+
+    Args:
+        name: フェーズ名（Server-Timing のメトリクス名になる）
+    """
+    timer: Optional[RequestTimer] = g.get('request_timer') if has_request_context() else None
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+
+class SlowRequestWatchdog:
+    """
+    閾値を超えて処理中のリクエストのスタックを記録する
+
+    監視スレッドはプロセスごとに1本だけで、速いリクエストにはスレッド生成などのコストがかからない。
+    スレッドは fork 後に引き継がれないため、プロセスごとに最初のリクエストで開始する
+    （ensure_started）。設定し直すと前のスレッドは止まる。
+    """
+
+    def __init__(self):
+        self.threshold = 0.0
+        self._active: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def configure(self, threshold: float) -> None:
+        """
+        Args:
+            threshold: スタックを記録するまでの秒数（0以下なら無効）
+        """
+        with self._lock:
+            self.threshold = threshold
+            self._stop.set()
+            self._stop = threading.Event()
+            self._pid = None
+
+    def stop(self) -> None:
+        """監視スレッドを止めて無効にする"""
+        self.configure(0.0)
+
+    def ensure_started(self) -> None:
+        """このプロセスの監視スレッドを開始する（開始済みなら何もしない）"""
+        if self._pid == os.getpid() or not self.enabled:
+            return
+        with self._lock:
+            if self._pid == os.getpid() or not self.enabled:
+                return
+            self._pid = os.getpid()
+            # fork 元のプロセスで処理中だったリクエストは引き継がない
+            self._active = {}
+            thread = threading.Thread(
+                target=self._run, args=(self._stop, self.threshold), name='slow-request-watchdog', daemon=True
+            )
+            thread.start()
+
+    def begin(self, path: str) -> None:
+        self.ensure_started()
+        self._active[threading.get_ident()] = [time.perf_counter(), path, False]
+
+    def end(self) -> None:
+        self._active.pop(threading.get_ident(), None)
+
+    def _run(self, stop: threading.Event, threshold: float) -> None:
+        interval = min(max(threshold / 2, 0.01), 1.0)
+        while not stop.wait(interval):
+            now = time.perf_counter()
+            frames = None
+            for thread_id, entry in list(self._active.items()):
+                started, path, dumped = entry
+                if dumped or now - started < threshold:
+                    continue
+                entry[2] = True
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = ''.join(traceback.format_stack(frame))
+                logger.warning(
+                    "Slow request %s exceeded %.0fms, stack:\n%s",
+                    path, threshold * 1000, stack
+                )
+
+
+def init_app(app) -> None:
+    """
+    フェーズ計測のフックを登録する
+
+    Args:
+        app: Flaskアプリケーション
+    """
+    threshold = app.config['SLOW_REQUEST_THRESHOLD_MS'] / 1000
+    sample_rate = app.config['PROFILE_SAMPLE_RATE']
+    profile_dir = app.config['PROFILE_DIR']
+    log_json = app.config['TIMING_LOG_JSON']
+    slow_request_watchdog.configure(threshold)
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_timer = RequestTimer()
+        if slow_request_watchdog.enabled:
+            slow_request_watchdog.begin(request.path)
+        if sample_rate > 0 and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12 以降は同時に1つしかプロファイラを有効にできない（このリクエストは取らない）
+                logger.debug("Skipped profiling %s: another profiler is active", request.path)
+                return
+            g.request_profiler = profiler
+
+    @app.after_request
+    def _emit_request_timing(response):
+        timer: Optional[RequestTimer] = g.pop('request_timer', None)
+        if timer is None:
+            return response
+
+        total = timer.total()
+        response.headers['Server-Timing'] = timer.server_timing(total)
+
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if total >= threshold:
+                _dump_profile(profiler, profile_dir, request.path, total)
+
+        if log_json:
+            # 項目は fields で渡し、書式化は出力用のスレッドで行う（structured_logging）
+            logger.info(
+                "request_timing %s %s %d %.2fms",
+                request.method, request.path, response.status_code, total * 1000,
+                extra={'sampled': True, 'fields': {
+                    'event': 'request_timing',
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'total_ms': round(total * 1000, 2),
+                    'phases_ms': {k: round(v * 1000, 2) for k, v in timer.phases.items()},
+                }}
+            )
+
+        return response
+
+    @app.teardown_request
+    def _end_request_timer(exc):
+        slow_request_watchdog.end()
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+
+def _dump_profile(profiler: cProfile.Profile, profile_dir: str, path: str, total: float) -> None:
+    """cProfile の結果をファイルまたはログに出力する"""
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{path.strip('/').replace('/', '_') or 'root'}.prof"
+        profiler.dump_stats(os.path.join(profile_dir, name))
+        return
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+    logger.warning("Profiled request %s (%.0fms):\n%s", path, total * 1000, out.getvalue())
+
+
+# グローバルインスタンス
+slow_request_watchdog = SlowRequestWatchdog()
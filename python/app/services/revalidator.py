@@ -0,0 +1,94 @@
+"""
+Revalidator
+
+キャッシュの古い応答のバックグラウンドでの取り直し（stale-while-revalidate）
+
+古い応答を返したリクエストは待たずに終わり、取り直しは別スレッドで行う。
+
+- 同じキー（スコープと質問）の取り直しは1件だけ実行する
+- 同時に実行する取り直しの数に上限を設け、超えた分は行わない（次のリクエストで再び試みる）
+- 上流へのリクエストは bulk クラスで送り、ゲートのリクエストの処理枠を奪わない
+
+    revalidator.submit((scope, hit.matched_text), refresh)
+"""
+
+from typing import Callable, Hashable, Optional, Set
+import logging
+import threading
+
+from app.services import metrics
+from app.services.upstream_scheduler import background_class
+
+logger = logging.getLogger(__name__)
+
+REFRESH_CLASS = 'bulk'
+
+
+class Revalidator:
+    """取り直しの実行（キーごとに1件、同時実行数に上限）"""
+
+    DEFAULT_MAX_CONCURRENCY = 2
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Args:
+            max_concurrency: 同時に実行する取り直しの上限（0以下なら取り直さない）
+        """
+        self.max_concurrency = max_concurrency
+        self._inflight: Set[Hashable] = set()
+        self._idle = threading.Condition()
+
+    def submit(self, key: Hashable, refresh: Callable[[], None]) -> bool:
+        """
+        取り直しを開始する
+
+        Args:
+            key: 重複を判定するキー
+            refresh: 上流に問い合わせてキャッシュを更新する関数
+
+        Returns:
+            開始した場合は True（取り直し中・上限に達している場合は False）
+        """
+        with self._idle:
+            if key in self._inflight:
+                metrics.CHAT_REVALIDATIONS.labels('duplicate').inc()
+                return False
+            if len(self._inflight) >= self.max_concurrency:
+                metrics.CHAT_REVALIDATIONS.labels('skipped').inc()
+                return False
+            self._inflight.add(key)
+
+        thread = threading.Thread(target=self._run, args=(key, refresh), name='revalidate', daemon=True)
+        thread.start()
+        return True
+
+    def _run(self, key: Hashable, refresh: Callable[[], None]) -> None:
+        try:
+            with background_class(REFRESH_CLASS):
+                refresh()
+            metrics.CHAT_REVALIDATIONS.labels('ok').inc()
+        except Exception as e:
+            metrics.CHAT_REVALIDATIONS.labels('error').inc()
+            logger.warning("Failed to revalidate cached chat response: %s", e)
+        finally:
+            with self._idle:
+                self._inflight.discard(key)
+                self._idle.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        実行中の取り直しが終わるまで待つ
+
+        Returns:
+            全て終わった場合は True
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._inflight, timeout)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+# グローバルインスタンス
+revalidator = Revalidator()
@@ -0,0 +1,403 @@
+"""
+Semantic Cache
+
+言い回しの違う同じ質問に対するチャット応答のキャッシュ
+
+「登録地はどこ？」「登録地ってどこですか」のような言い換えを完全一致のキャッシュでは
+拾えないため、最後のユーザーメッセージを文字 n-gram のハッシュ特徴量（feature hashing）で
+ベクトル化し、同じナンバープレートのスコープ内でコサイン類似度が閾値以上の過去の応答を返す。
+
+文字 n-gram では「品川ナンバーの…」と「練馬ナンバーの…」のように答えを左右する語が
+1〜2文字しか違わない質問も類似度が閾値を超えるため、質問に含まれる固有の値
+（地名・数字の並び・ナンバーのひらがな）はスコープに含め、完全に一致する場合だけヒットさせる。
+
+    hit = semantic_cache.lookup(scope, message)
+    if hit is None:
+        response = client.chat(messages)
+        semantic_cache.store(scope, message, response.content)
+
+有効期限（ttl）を過ぎたエントリは、RFC 5861 の stale-while-revalidate / stale-if-error と同様に
+一定時間だけ残す。ヒットの state で使い方を決める:
+
+- fresh: そのまま返す
+- revalidate（ttl 後 stale_while_revalidate 秒以内）: 古い応答を返し、裏で取り直す（revalidator）
+- stale（ttl 後 stale_if_error 秒以内）: 上流が失敗したときだけ返す
+
+NumPy がインストールされていればスコープごとのベクトルを行列で保持して一括で類似度を
+計算し、無ければ疎ベクトルの内積で計算する（結果は同じ）。NumPy は起動時間への影響が
+大きいため、最初の格納時まで読み込まない。
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+from app.services import metrics
+from app.services.intent_router import REGION_TO_PREFECTURE
+
+# 検索結果（メトリクスのラベル）→ stats のキー
+_STATS_KEYS = {'hit': 'hits', 'stale': 'stale', 'miss': 'misses'}
+
+# カタカナ（ァ〜ヶ）→ ひらがな
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# 意味を持たない空白・記号（NFKC 後の文字）
+_NOISE = re.compile(r'[\s!-/:-@\[-`{-~、。・「」『』（）？！ー〜…]')
+
+# 文末の丁寧語・終助詞（「登録地はどこ」と「登録地はどこですか」を同じ質問として扱う）
+_SENTENCE_END = re.compile(r'(でしょうか|ですか|ますか|ください|です|ます|か|ね|よ)$')
+
+
+class HashedNgramVectorizer:
+    """
+    文字 n-gram の feature hashing による埋め込み
+
+    日本語は単語境界が無いため文字 n-gram を使う。辞書を持たないので学習や
+    モデルの読み込みが不要で、CPUのみで1メッセージあたり数十マイクロ秒で計算できる。
+    """
+
+    def __init__(self, dim: int = 4096, ngram_range: Tuple[int, int] = (1, 3)):
+        """
+        Args:
+            dim: ハッシュ空間の次元数
+            ngram_range: 使う n-gram の長さの範囲（両端を含む）
+        """
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """NFKC・小文字化・カタカナのひらがな化を行い、空白・記号と文末表現を除く"""
+        text = unicodedata.normalize('NFKC', text).lower().translate(_KATAKANA_TO_HIRAGANA)
+        return _SENTENCE_END.sub('', _NOISE.sub('', text))
+
+    def transform(self, text: str) -> Dict[int, float]:
+        """
+        テキストを L2 正規化した疎ベクトルに変換する
+
+        Returns:
+            次元 → 重み（特徴が無ければ空）
+        """
+        text = self.normalize(text)
+        counts: Dict[int, float] = {}
+        low, high = self.ngram_range
+        dim = self.dim
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                # 長い n-gram ほど言い回しの一致を表すので重くする
+                index = zlib.crc32(text[i:i + n].encode('utf-8')) % dim
+                counts[index] = counts.get(index, 0.0) + n
+
+        norm = math.sqrt(sum(v * v for v in counts.values()))
+        if not norm:
+            return {}
+        return {index: value / norm for index, value in counts.items()}
+
+
+# 答えを左右する値: 数字の並び、数字に挟まれたひらがな（ナンバーの「あ」）、地名（長いものから）
+_ENTITY = re.compile(
+    r'\d+|(?<=\d)[ぁ-ゖ](?=\d)|'
+    + '|'.join(sorted({re.escape(HashedNgramVectorizer.normalize(region)) for region in REGION_TO_PREFECTURE},
+                      key=len, reverse=True))
+)
+
+
+def extract_entities(text: str) -> Tuple[str, ...]:
+    """質問に含まれる固有の値（正規化後のテキストから、重複を除いて並べ替えたもの）"""
+    return tuple(sorted(set(_ENTITY.findall(HashedNgramVectorizer.normalize(text)))))
+
+
+def _load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@dataclass(slots=True)
+class _Entry:
+    """キャッシュエントリ"""
+    scope: str  # インデックスのキー（スコープと質問の固有の値）
+    text: str
+    vector: Dict[int, float]
+    response: str
+    stored_at: float
+
+
+@dataclass(slots=True)
+class CacheHit:
+    """キャッシュヒット"""
+    response: str
+    similarity: float
+    matched_text: str
+    state: str = 'fresh'  # fresh / revalidate / stale
+    age: float = 0.0      # 格納からの経過秒数
+
+    @property
+    def fresh(self) -> bool:
+        return self.state == 'fresh'
+
+
+class _ScopeIndex:
+    """
+    スコープ（ナンバープレート）ごとのベクトルインデックス
+
+    NumPy があれば (件数, 次元) の float32 行列に行を追加・削除し、
+    クエリとの内積を1回の行列積で計算する。
+    """
+
+    def __init__(self, dim: int, np):
+        self.dim = dim
+        self.np = np
+        self.ids: List[int] = []
+        self.vectors: List[Dict[int, float]] = []
+        self.matrix = None if np is None else np.zeros((0, dim), dtype=np.float32)
+
+    def add(self, entry_id: int, vector: Dict[int, float]) -> None:
+        self.ids.append(entry_id)
+        self.vectors.append(vector)
+        if self.np is not None:
+            row = self.np.zeros((1, self.dim), dtype=self.np.float32)
+            row[0, list(vector)] = list(vector.values())
+            self.matrix = self.np.vstack((self.matrix, row))
+
+    def remove(self, entry_id: int) -> None:
+        position = self.ids.index(entry_id)
+        del self.ids[position]
+        del self.vectors[position]
+        if self.np is not None:
+            self.matrix = self.np.delete(self.matrix, position, axis=0)
+
+    def best(self, vector: Dict[int, float]) -> Tuple[Optional[int], float]:
+        """最も類似度の高いエントリを返す"""
+        if not self.ids:
+            return None, 0.0
+        if self.np is not None:
+            indices = list(vector)
+            scores = self.matrix[:, indices] @ self.np.fromiter(
+                vector.values(), dtype=self.np.float32, count=len(indices)
+            )
+            position = int(scores.argmax())
+            return self.ids[position], float(scores[position])
+
+        best_id, best_score = None, 0.0
+        for entry_id, candidate in zip(self.ids, self.vectors):
+            if len(candidate) < len(vector):
+                score = sum(value * vector.get(index, 0.0) for index, value in candidate.items())
+            else:
+                score = sum(value * candidate.get(index, 0.0) for index, value in vector.items())
+            if score > best_score:
+                best_id, best_score = entry_id, score
+        return best_id, best_score
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class SemanticCache:
+    """
+    チャット応答の意味的キャッシュ
+
+    エントリは有効期限（TTL）付きで、件数の上限を超えたら最も使われていないもの（LRU）から捨てる。
+    ナンバープレートごとにスコープを分けるため、別の車両についての応答は返さない。
+
+    sample_rate を設定すると、ヒットの一部について上流にも問い合わせて応答を比較し、
+    誤ヒット（応答が似ていない）の割合を計測できる。
+
+    stale_while_revalidate / stale_if_error を設定すると、ttl を過ぎたエントリを
+    その秒数だけ残し、state が revalidate / stale のヒットとして返す（既定は0で、ttl で削除する）。
+    """
+
+    DEFAULT_THRESHOLD = 0.85
+    CACHE_TTL = 600  # 10分
+    MAX_CACHE_ENTRIES = 2000
+    # 誤ヒット判定: キャッシュと上流の応答の類似度がこれ未満なら誤ヒットとみなす
+    MISMATCH_THRESHOLD = 0.5
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl: float = CACHE_TTL,
+        max_entries: int = MAX_CACHE_ENTRIES,
+        sample_rate: float = 0.0,
+        vectorizer: Optional[HashedNgramVectorizer] = None,
+        stale_while_revalidate: float = 0.0,
+        stale_if_error: float = 0.0,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.max_entries = max_entries
+        self.sample_rate = sample_rate
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+        self._scopes: Dict[str, _ScopeIndex] = {}
+        self._next_id = 0
+        self._np = None
+        self._np_loaded = False
+        self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'stores': 0, 'samples': 0, 'mismatches': 0}
+
+    @staticmethod
+    def _index_key(scope: str, text: str) -> str:
+        """ベクトルを探すインデックスのキー（スコープと質問の固有の値）"""
+        entities = extract_entities(text)
+        if not entities:
+            return scope
+        return scope + '\x1f' + '\x1f'.join(entities)
+
+    def lookup(self, scope: str, text: str) -> Optional[CacheHit]:
+        """
+        類似した質問の応答を探す
+
+        Args:
+            scope: スコープ（ナンバープレートの正規キー。無ければ空文字列）
+            text: 最後のユーザーメッセージ
+
+        Returns:
+            CacheHit（見つからなければ None。ttl を過ぎたエントリは state で区別する）
+        """
+        started = time.perf_counter()
+        vector = self.vectorizer.transform(text)
+        key = self._index_key(scope, text)
+        hit = None
+        with self._lock:
+            index = self._scopes.get(key)
+            if index is not None and vector:
+                entry_id, similarity = index.best(vector)
+                entry = self._entries.get(entry_id) if entry_id is not None else None
+                state = None
+                if entry is not None:
+                    age = time.monotonic() - entry.stored_at
+                    state = self._state(age)
+                    if state is None:
+                        self._remove(entry_id)
+                if state is not None and similarity >= self.threshold:
+                    self._entries.move_to_end(entry_id)
+                    hit = CacheHit(response=entry.response, similarity=similarity, matched_text=entry.text,
+                                   state=state, age=age)
+
+            result = 'miss' if hit is None else 'hit' if hit.fresh else 'stale'
+            self.stats[_STATS_KEYS[result]] += 1
+
+        metrics.SEMANTIC_CACHE_LOOKUPS.labels(result).inc()
+        metrics.SEMANTIC_CACHE_LOOKUP_DURATION.observe(time.perf_counter() - started)
+        return hit
+
+    def store(self, scope: str, text: str, response: str) -> None:
+        """
+        応答を格納する
+
+        Args:
+            scope: スコープ（ナンバープレートの正規キー。無ければ空文字列）
+            text: 最後のユーザーメッセージ
+            response: 応答
+        """
+        vector = self.vectorizer.transform(text)
+        if not vector or not response:
+            return
+        key = self._index_key(scope, text)
+
+        with self._lock:
+            if not self._np_loaded:
+                self._np = _load_numpy()
+                self._np_loaded = True
+
+            index = self._scopes.get(key)
+            if index is not None:
+                # 同じ質問の古いエントリ（取り直す前の応答）は置き換える
+                previous_id, similarity = index.best(vector)
+                if previous_id is not None and similarity >= self.threshold:
+                    self._remove(previous_id)
+                    index = self._scopes.get(key)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(
+                scope=key, text=text, vector=vector, response=response,
+                stored_at=time.monotonic(),
+            )
+            if index is None:
+                index = self._scopes[key] = _ScopeIndex(self.vectorizer.dim, self._np)
+            index.add(entry_id, vector)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self.stats['stores'] += 1
+            metrics.SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+
+    def should_sample(self) -> bool:
+        """ヒットを上流の応答と照合するかどうか"""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record_sample(self, hit: CacheHit, upstream_response: str) -> bool:
+        """
+        照合の結果を記録する
+
+        Args:
+            hit: キャッシュヒット
+            upstream_response: 同じリクエストに対する上流の応答
+
+        Returns:
+            誤ヒットだった場合は True
+        """
+        cached = self.vectorizer.transform(hit.response)
+        fresh = self.vectorizer.transform(upstream_response)
+        similarity = sum(value * fresh.get(index, 0.0) for index, value in cached.items())
+        mismatch = similarity < self.MISMATCH_THRESHOLD
+        with self._lock:
+            self.stats['samples'] += 1
+            if mismatch:
+                self.stats['mismatches'] += 1
+        metrics.SEMANTIC_CACHE_SAMPLES.labels('mismatch' if mismatch else 'match').inc()
+        return mismatch
+
+    def _state(self, age: float) -> Optional[str]:
+        """格納からの経過秒数に応じたエントリの状態（None は期限切れ）"""
+        if age < self.ttl:
+            return 'fresh'
+        if age < self.ttl + self.stale_while_revalidate:
+            return 'revalidate'
+        if age < self.ttl + max(self.stale_while_revalidate, self.stale_if_error):
+            return 'stale'
+        return None
+
+    def _remove(self, entry_id: int) -> None:
+        """エントリを削除する（ロック内で呼ぶ）"""
+        entry = self._entries.pop(entry_id)
+        index = self._scopes[entry.scope]
+        index.remove(entry_id)
+        if not len(index):
+            del self._scopes[entry.scope]
+        metrics.SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+
+    @property
+    def backend(self) -> str:
+        """類似度計算の実装（'numpy' / 'python'。未格納なら 'unloaded'）"""
+        if not self._np_loaded:
+            return 'unloaded'
+        return 'numpy' if self._np is not None else 'python'
+
+    def clear(self) -> None:
+        """キャッシュと統計をクリアする"""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'stores': 0, 'samples': 0, 'mismatches': 0}
+        metrics.SEMANTIC_CACHE_ENTRIES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# グローバルインスタンス
+semantic_cache = SemanticCache()
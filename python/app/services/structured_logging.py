@@ -0,0 +1,242 @@
+"""
+Structured Logging
+
+ログ出力の非同期化と構造化
+
+- 呼び出し元（リクエストのスレッド）はレコードをキューに入れるだけで、メッセージの
+  書式化と出力はバックグラウンドのスレッド（QueueListener）が行う。標準エラー出力が
+  遅い・パイプが詰まっていても、リクエストはログのI/Oを待たない
+- キューが一杯のときはレコードを捨て、papi_log_records_dropped_total に数える
+- 各レコードにリクエストID（X-Request-ID）とリクエスト開始からの経過時間を付ける。
+  LOG_FORMAT=json では1行1レコードのJSONで、extra={'fields': {...}} の項目も含める
+- リクエストごとの定型ログは extra={'sampled': True} を付け、LOG_SAMPLE_RATE の割合だけ出力する
+  （WARNING 以上は常に出力する）
+
+    logger.info("Chat request processed: %d chars", len(message),
+                extra={'sampled': True, 'fields': {'chars': len(message)}})
+
+メッセージは %-形式の引数で渡す（f-string だとレベルが無効でも書式化される）。
+"""
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+from app.services import metrics
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DEFAULT_QUEUE_SIZE = 10000
+
+# クライアントから受け取るリクエストIDの形式（ログに任意の文字列を入れない）
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+_handler: Optional['NonBlockingQueueHandler'] = None
+_listener: Optional[QueueListener] = None
+_hooks_registered = False
+
+
+class SamplingFilter(logging.Filter):
+    """sampled のレコードを sample_rate の割合だけ通す（WARNING 以上は常に通す）"""
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        return not getattr(record, 'sampled', False) or random.random() < self.sample_rate
+
+
+def _make_record_factory(factory: Callable[..., logging.LogRecord]) -> Callable[..., logging.LogRecord]:
+    """
+    リクエストIDと経過時間を付けるレコードファクトリー
+
+    リクエストコンテキストは書き出し用のスレッドからは参照できないため、
+    レコードの作成時（呼び出し元のスレッド）に取り出しておく。
+    """
+    def create(*args, **kwargs) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        record.request_id = None
+        record.elapsed_ms = None
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            timer = g.get('request_timer')
+            if timer is not None:
+                record.elapsed_ms = round((time.perf_counter() - timer.started) * 1000, 2)
+        return record
+
+    return create
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    書式化せずにキューへ入れ、一杯なら捨てる QueueHandler
+
+    標準の QueueHandler は prepare() で呼び出し元のスレッドで書式化するため、
+    レコードをそのまま渡して書き出し用のスレッドで書式化する。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+class TextFormatter(logging.Formatter):
+    """従来のテキスト形式（リクエストIDと fields を末尾に付ける）"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, 'request_id', None)
+        fields = getattr(record, 'fields', None)
+        if request_id:
+            text += f" [request_id={request_id}]"
+        if fields:
+            text += ' ' + json.dumps(fields, ensure_ascii=False, default=str)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            data['request_id'] = request_id
+        elapsed_ms = getattr(record, 'elapsed_ms', None)
+        if elapsed_ms is not None:
+            data['elapsed_ms'] = elapsed_ms
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def configure(level: str = 'INFO', log_format: str = 'text', sample_rate: float = 1.0,
+              queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+    """
+    ルートロガーにキュー経由のハンドラーを設定する（呼び直すと置き換える）
+
+    Args:
+        level: ログレベル
+        log_format: text または json
+        sample_rate: sampled のレコードを出力する割合（0〜1）
+        queue_size: キューに溜められるレコード数（超えた分は捨てる）
+
+    Raises:
+        ValueError: 不明な形式の場合
+    """
+    global _handler, _listener
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"LOG_FORMAT must be one of {', '.join(LOG_FORMATS)}: {log_format!r}")
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level.upper()))
+    shutdown()
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+    records = queue.Queue(queue_size)
+    _handler = NonBlockingQueueHandler(records)
+    _handler.addFilter(SamplingFilter(sample_rate))
+    _listener = QueueListener(records, output)
+    _listener.start()
+    root.addHandler(_handler)
+    _register_hooks()
+
+
+def shutdown() -> None:
+    """キューに残ったレコードを書き出してハンドラーを外す"""
+    global _handler, _listener
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    # 書き出し用のスレッドは fork 後の子プロセスに引き継がれず、キューのロックも
+    # fork 時点の状態のままなので、新しいキューでスレッドを作り直す
+    if _handler is None or _listener is None:
+        return
+    records = queue.Queue(_handler.queue.maxsize)
+    _handler.queue = records
+    _listener.queue = records
+    _listener._thread = None
+    _listener.start()
+
+
+def _register_hooks() -> None:
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    logging.setLogRecordFactory(_make_record_factory(logging.getLogRecordFactory()))
+    atexit.register(shutdown)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def init_app(app) -> None:
+    """
+    ログの出力を設定し、リクエストIDを付けるフックを登録する
+
+    リクエストIDは X-Request-ID ヘッダー（形式が正しい場合）を引き継ぎ、無ければ生成する。
+    レスポンスにも同じヘッダーで返す。
+
+    Args:
+        app: Flaskアプリケーション
+    """
+    configure(
+        level=app.config['LOG_LEVEL'],
+        log_format=app.config['LOG_FORMAT'],
+        sample_rate=app.config['LOG_SAMPLE_RATE'],
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+    )
+
+    @app.before_request
+    def _assign_request_id():
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = request_id if _REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+    @app.after_request
+    def _emit_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
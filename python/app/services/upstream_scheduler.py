@@ -0,0 +1,347 @@
+"""
+Upstream Scheduler
+
+上流（Qwen MCPサーバー）への同時リクエスト数の制御とリクエストクラスごとの優先度付け
+
+ゲートのキオスク（interactive）はバーの前で運転者が待っているため、バックオフィスの
+一括処理（bulk）に上流の処理枠を奪われないようにする。
+
+- リクエストクラスは X-Request-Class ヘッダー、または API キーとの対応表で決める
+- 同時実行数の上限（max_concurrency）のうち、クラスごとに予約枠（reservations）を確保し、
+  残りを共有枠とする。クラスごとの上限（limits）も設定できる
+- 枠が空いたら、待機中のクラスから重み（weights）に応じて選ぶ
+  （重み付き公平キュー。同じクラス内は到着順）
+
+    with upstream_scheduler.slot(current_request_class()):
+        response = http.post(...)
+
+待ち時間はクラス別に papi_upstream_queue_wait_seconds に記録し、
+Server-Timing には queue フェーズとして出力する。
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Mapping, Optional
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+from app.services import metrics, request_timing
+
+REQUEST_CLASSES = ('interactive', 'standard', 'bulk')
+DEFAULT_CLASS = 'standard'
+
+CLASS_HEADER = 'X-Request-Class'
+API_KEY_HEADER = 'X-API-Key'
+
+
+class SchedulerTimeout(Exception):
+    """待機時間内に上流の処理枠を確保できなかった"""
+
+    def __init__(self, request_class: str, waited: float):
+        self.request_class = request_class
+        self.waited = waited
+        super().__init__(f"no upstream slot for {request_class} within {waited:.1f}s")
+
+
+class _Ticket:
+    """待機中のリクエスト"""
+
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class UpstreamScheduler:
+    """
+    リクエストクラス別の重み付き優先度キュー
+
+    max_concurrency が0以下の場合は制御しない（待ち時間も記録しない）。
+    """
+
+    DEFAULT_MAX_CONCURRENCY = 16
+    DEFAULT_QUEUE_TIMEOUT = 10.0  # seconds
+    DEFAULT_WEIGHTS = {'interactive': 8, 'standard': 4, 'bulk': 1}
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        reservations: Optional[Mapping[str, int]] = None,
+        limits: Optional[Mapping[str, int]] = None,
+        weights: Optional[Mapping[str, float]] = None,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ):
+        self._lock = threading.Lock()
+        self._waiting: Dict[str, Deque[_Ticket]] = {c: deque() for c in REQUEST_CLASSES}
+        self._active: Dict[str, int] = dict.fromkeys(REQUEST_CLASSES, 0)
+        # クラスごとの仮想時間（許可するたびに 1/重み 進む。小さいクラスから選ぶ）
+        self._virtual: Dict[str, float] = dict.fromkeys(REQUEST_CLASSES, 0.0)
+        self.configure(max_concurrency, reservations, limits, weights, queue_timeout)
+
+    def configure(
+        self,
+        max_concurrency: int,
+        reservations: Optional[Mapping[str, int]] = None,
+        limits: Optional[Mapping[str, int]] = None,
+        weights: Optional[Mapping[str, float]] = None,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ) -> None:
+        """
+        設定を変更する
+
+        Args:
+            max_concurrency: 上流への同時リクエスト数の上限（0以下で無制限）
+            reservations: クラス → 予約枠の数
+            limits: クラス → 同時実行数の上限
+            weights: クラス → 重み（省略したクラスは DEFAULT_WEIGHTS）
+            queue_timeout: 処理枠を待つ最大秒数
+
+        Raises:
+            ValueError: 不明なクラスや、予約枠の合計が上限を超える場合
+        """
+        reservations = dict(reservations or {})
+        limits = dict(limits or {})
+        weights = {**self.DEFAULT_WEIGHTS, **(weights or {})}
+        for mapping in (reservations, limits, weights):
+            unknown = set(mapping) - set(REQUEST_CLASSES)
+            if unknown:
+                raise ValueError(f"unknown request class: {', '.join(sorted(unknown))}")
+        if any(value <= 0 for value in weights.values()):
+            raise ValueError('weights must be positive')
+        if max_concurrency > 0 and sum(reservations.values()) > max_concurrency:
+            raise ValueError('reservations exceed max_concurrency')
+
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self.reservations = {c: reservations.get(c, 0) for c in REQUEST_CLASSES}
+            self.limits = limits
+            self.weights = weights
+            self.queue_timeout = queue_timeout
+            self._shared = max(0, max_concurrency - sum(self.reservations.values()))
+            self._dispatch()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    @contextmanager
+    def slot(self, request_class: str):
+        """
+        上流の処理枠を確保する（acquire / release のコンテキストマネージャー版）
+
+        Raises:
+            SchedulerTimeout: queue_timeout 秒以内に確保できなかった場合
+        """
+        self.acquire(request_class)
+        try:
+            yield
+        finally:
+            self.release(request_class)
+
+    def acquire(self, request_class: str) -> None:
+        """
+        上流の処理枠を確保する（確保できるまで待つ）
+
+        Args:
+            request_class: リクエストクラス（不明な値は standard として扱う）
+
+        Raises:
+            SchedulerTimeout: queue_timeout 秒以内に確保できなかった場合
+        """
+        if not self.enabled:
+            return
+        request_class = _resolve(request_class)
+        started = time.perf_counter()
+        try:
+            with request_timing.phase('queue'):
+                self._acquire(request_class)
+        finally:
+            metrics.UPSTREAM_QUEUE_WAIT.labels(request_class).observe(time.perf_counter() - started)
+
+    def release(self, request_class: str) -> None:
+        """acquire で確保した処理枠を返す"""
+        if not self.enabled:
+            return
+        self._release(_resolve(request_class))
+
+    def _acquire(self, request_class: str) -> None:
+        with self._lock:
+            queue = self._waiting[request_class]
+            if not queue and self._admissible(request_class):
+                # 待機中のリクエストは _dispatch で常に許可済みなので、追い越しにはならない
+                self._grant(request_class)
+                return
+            if not queue:
+                # 空いていたクラスが過去の余りの仮想時間で独占しないよう、現在の最小値に揃える
+                backlog = [self._virtual[c] for c in REQUEST_CLASSES if self._waiting[c]]
+                if backlog:
+                    self._virtual[request_class] = max(self._virtual[request_class], min(backlog))
+            ticket = _Ticket()
+            queue.append(ticket)
+            metrics.UPSTREAM_QUEUE_DEPTH.labels(request_class).inc()
+
+        if ticket.event.wait(self.queue_timeout):
+            return
+        with self._lock:
+            if ticket.granted:
+                return
+            queue.remove(ticket)
+            metrics.UPSTREAM_QUEUE_DEPTH.labels(request_class).dec()
+        raise SchedulerTimeout(request_class, self.queue_timeout)
+
+    def _release(self, request_class: str) -> None:
+        with self._lock:
+            # 処理中に無効化→再有効化された場合でも負にしない
+            if self._active[request_class] > 0:
+                self._active[request_class] -= 1
+                metrics.UPSTREAM_IN_FLIGHT.labels(request_class).dec()
+            self._dispatch()
+
+    def _admissible(self, request_class: str) -> bool:
+        """クラスが今すぐ処理枠を使えるか（ロック内で呼ぶ）"""
+        if not self.enabled:
+            return True  # 無効化された時点で待機中のリクエストはすべて通す
+        active = self._active[request_class]
+        limit = self.limits.get(request_class)
+        if limit is not None and active >= limit:
+            return False
+        if active < self.reservations[request_class]:
+            return True
+        shared_used = sum(max(0, self._active[c] - self.reservations[c]) for c in REQUEST_CLASSES)
+        return shared_used < self._shared
+
+    def _grant(self, request_class: str) -> None:
+        self._active[request_class] += 1
+        self._virtual[request_class] += 1.0 / self.weights[request_class]
+        metrics.UPSTREAM_IN_FLIGHT.labels(request_class).inc()
+
+    def _dispatch(self) -> None:
+        """空いている処理枠を待機中のリクエストに割り当てる（ロック内で呼ぶ）"""
+        while True:
+            candidates = [c for c in REQUEST_CLASSES if self._waiting[c] and self._admissible(c)]
+            if not candidates:
+                return
+            request_class = min(candidates, key=self._virtual.__getitem__)
+            ticket = self._waiting[request_class].popleft()
+            ticket.granted = True
+            metrics.UPSTREAM_QUEUE_DEPTH.labels(request_class).dec()
+            self._grant(request_class)
+            ticket.event.set()
+
+    def snapshot(self) -> Dict:
+        """クラスごとの処理中・待機中の数"""
+        with self._lock:
+            return {
+                c: {
+                    'active': self._active[c],
+                    'waiting': len(self._waiting[c]),
+                    'reserved': self.reservations[c],
+                    'limit': self.limits.get(c),
+                    'weight': self.weights[c],
+                }
+                for c in REQUEST_CLASSES
+            }
+
+
+def _resolve(request_class: str) -> str:
+    return request_class if request_class in REQUEST_CLASSES else DEFAULT_CLASS
+
+
+def parse_class_map(value: str, cast: Callable = str) -> Dict:
+    """
+    「interactive:4,bulk:1」形式の設定を辞書にする
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    result = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, raw = item.rpartition(':')
+        if not sep or not key.strip():
+            raise ValueError(f"invalid entry: {item!r}")
+        result[key.strip()] = cast(raw.strip())
+    return result
+
+
+def classify(headers: Mapping[str, str], api_key_classes: Mapping[str, str]) -> str:
+    """
+    リクエストクラスを決める
+
+    API キーに対応表があればそれを優先し、無ければ X-Request-Class ヘッダーを使う。
+
+    Args:
+        headers: リクエストヘッダー
+        api_key_classes: API キー → クラス
+
+    Returns:
+        リクエストクラス
+    """
+    api_key = headers.get(API_KEY_HEADER)
+    if api_key and api_key in api_key_classes:
+        return api_key_classes[api_key]
+    value = (headers.get(CLASS_HEADER) or '').strip().lower()
+    return value if value in REQUEST_CLASSES else DEFAULT_CLASS
+
+
+_background = threading.local()
+
+
+def current_request_class() -> str:
+    """現在のリクエストのクラス（リクエストコンテキスト外では background_class の指定、無ければ standard）"""
+    if not has_request_context():
+        return getattr(_background, 'request_class', DEFAULT_CLASS)
+    return g.get('request_class', DEFAULT_CLASS)
+
+
+@contextmanager
+def background_class(request_class: str):
+    """
+    リクエストコンテキスト外（バックグラウンドのスレッド）での上流呼び出しのクラスを指定する
+
+        with background_class('bulk'):
+            client.chat(messages)
+    """
+    previous = getattr(_background, 'request_class', None)
+    _background.request_class = request_class
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _background.request_class
+        else:
+            _background.request_class = previous
+
+
+def init_app(app) -> None:
+    """
+    設定を反映し、リクエストクラスを判定するフックを登録する
+
+    Args:
+        app: Flaskアプリケーション
+    """
+    api_key_classes = parse_class_map(app.config['REQUEST_CLASS_API_KEYS'])
+    unknown = set(api_key_classes.values()) - set(REQUEST_CLASSES)
+    if unknown:
+        raise ValueError(f"unknown request class: {', '.join(sorted(unknown))}")
+
+    upstream_scheduler.configure(
+        max_concurrency=app.config['UPSTREAM_MAX_CONCURRENCY'],
+        reservations=parse_class_map(app.config['UPSTREAM_CLASS_RESERVATIONS'], int),
+        limits=parse_class_map(app.config['UPSTREAM_CLASS_LIMITS'], int),
+        weights=parse_class_map(app.config['UPSTREAM_CLASS_WEIGHTS'], float),
+        queue_timeout=app.config['UPSTREAM_QUEUE_TIMEOUT'],
+    )
+
+    @app.before_request
+    def _classify_request():
+        g.request_class = classify(request.headers, api_key_classes)
+
+
+# グローバルインスタンス
+upstream_scheduler = UpstreamScheduler()
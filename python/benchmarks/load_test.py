@@ -0,0 +1,341 @@
+"""
+Load Test
+
+/papi/chat の負荷試験ハーネス
+
+モックQwen MCPサーバーを起動し、指定したサーバー構成でFlaskアプリを起動して、
+固定の同時実行数ごとに RPS と p50/p95/p99 レイテンシを計測する。
+
+    python -m benchmarks.load_test --servers dev,gunicorn-gthread --concurrency 1,8,32 \\
+        --duration 10 --out results.json --baseline baseline.json
+
+--baseline を指定すると、同じサーバー構成・同時実行数の結果と比較し、
+許容範囲（--tolerance）を超えて劣化していれば終了コード1を返す。
+
+--replay を指定すると、モックの代わりに記録した上流とのやり取り（MCP_CAPTURE_PATH）を
+元のレイテンシで再生する（benchmarks.replay_mcp_server）。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import replay_mcp_server
+from benchmarks.mock_mcp_server import MockConfig, start_in_thread
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+SERVERS = ('dev', 'production', 'gunicorn-sync', 'gunicorn-gthread', 'asgi')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(server: str, port: int, workers: int, threads: int) -> Optional[List[str]]:
+    """
+    サーバー構成ごとの起動コマンドを返す
+
+    Returns:
+        コマンド（必要なパッケージが無い場合は None）
+    """
+    bind = f"127.0.0.1:{port}"
+    if server == 'dev':
+        return [sys.executable, 'run.py']
+    if server == 'production':
+        # run.py の本番ランチャー（server.py）。設定は start_app で環境変数として渡す
+        if importlib.util.find_spec('gunicorn') is None:
+            return None
+        return [sys.executable, 'run.py']
+    if server in ('gunicorn-sync', 'gunicorn-gthread'):
+        if importlib.util.find_spec('gunicorn') is None:
+            return None
+        cmd = [sys.executable, '-m', 'gunicorn', '-b', bind, '-w', str(workers)]
+        if server == 'gunicorn-gthread':
+            cmd += ['-k', 'gthread', '--threads', str(threads)]
+        else:
+            cmd += ['-k', 'sync']
+        return cmd + ['run:app']
+    if server == 'asgi':
+        if importlib.util.find_spec('uvicorn') is None:
+            return None
+        return [sys.executable, '-m', 'uvicorn', 'run:app', '--interface', 'wsgi',
+                '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+                '--log-level', 'warning']
+    raise ValueError(f"unknown server: {server}")
+
+
+def start_app(cmd: List[str], port: int, mcp_url: str, timeout: float = 20.0,
+              extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """
+    アプリを起動し、/papi/health が応答するまで待つ
+
+    サーバーのログ（標準エラー出力）は一時ファイルに書かせる。パイプにすると計測中に
+    読まないため、64KiB で一杯になってサーバーのログ出力が止まる。
+    """
+    env = dict(os.environ)
+    env.update(extra_env or {})
+    env.update({
+        'QWEN_MCP_URL': mcp_url,
+        'QWEN_API_KEY': 'load-test',
+        'FLASK_HOST': '127.0.0.1',
+        'FLASK_PORT': str(port),
+        'FLASK_DEBUG': 'false',
+        'LOG_LEVEL': 'WARNING',
+    })
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    proc.log = log
+
+    deadline = time.monotonic() + timeout
+    url = f"http://127.0.0.1:{port}/papi/health"
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            output = server_log(proc)
+            log.close()
+            raise RuntimeError(f"server exited: {output}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+
+    output = server_log(proc)
+    stop_app(proc)
+    raise RuntimeError(f"server did not become ready within {timeout}s: {output}")
+
+
+def server_log(proc: subprocess.Popen, limit: int = 4000) -> str:
+    """start_app で起動したサーバーのログの末尾"""
+    proc.log.seek(0)
+    return proc.log.read().decode(errors='replace')[-limit:]
+
+
+def stop_app(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    proc.log.close()
+
+
+def build_payload(message: str, history: int, with_plate: bool) -> Dict:
+    context = {}
+    if history:
+        context['conversation_history'] = [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'履歴メッセージ{i}'}
+            for i in range(history)
+        ]
+    if with_plate:
+        context['license_plate'] = {
+            'region': '品川', 'classification_number': '330', 'hiragana': 'あ',
+            'serial_number': '1234', 'full_text': '品川330あ1234', 'confidence': 95.5,
+        }
+    payload = {'message': message}
+    if context:
+        payload['context'] = context
+    return payload
+
+
+def run_level(url: str, payload: Dict, concurrency: int, duration: float, warmup: float,
+              request_class: Optional[str] = None) -> Dict:
+    """
+    同時実行数を固定して一定時間リクエストを送り続ける
+
+    Returns:
+        集計結果
+    """
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if request_class:
+        headers['X-Request-Class'] = request_class
+
+    def worker():
+        samples = []
+        with httpx.Client(timeout=60.0) as client:
+            while True:
+                t0 = time.perf_counter()
+                if t0 >= deadline:
+                    break
+                try:
+                    status = client.post(url, content=body, headers=headers).status_code
+                except httpx.HTTPError:
+                    status = 0
+                t1 = time.perf_counter()
+                if t0 >= measure_from:
+                    samples.append((t1 - t0, status))
+        return samples
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker) for _ in range(concurrency)]
+        samples = [s for f in futures for s in f.result()]
+
+    return summarize(samples, duration, concurrency)
+
+
+def summarize(samples: List, duration: float, concurrency: int) -> Dict:
+    """レイテンシのサンプルから RPS とパーセンタイルを計算する"""
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, status in samples if status != 200)
+    result = {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / duration, 2) if duration else 0.0,
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None,
+    }
+    if len(latencies) >= 2:
+        q = statistics.quantiles(latencies, n=100, method='inclusive')
+        result.update(p50_ms=round(q[49] * 1000, 2), p95_ms=round(q[94] * 1000, 2),
+                      p99_ms=round(q[98] * 1000, 2))
+    elif latencies:
+        value = round(latencies[0] * 1000, 2)
+        result.update(p50_ms=value, p95_ms=value, p99_ms=value)
+    return result
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    ベースラインと比較して劣化を検出する
+
+    Returns:
+        劣化の説明のリスト（空なら問題なし）
+    """
+    index = {(r['server'], r['concurrency']): r for r in baseline}
+    regressions = []
+    for r in results:
+        base = index.get((r['server'], r['concurrency']))
+        if not base:
+            continue
+        key = f"{r['server']} c={r['concurrency']}"
+        if base['rps'] and r['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{key}: rps {r['rps']} < baseline {base['rps']}")
+        for p in ('p95_ms', 'p99_ms'):
+            if base.get(p) and r.get(p) and r[p] > base[p] * (1 + tolerance):
+                regressions.append(f"{key}: {p} {r[p]} > baseline {base[p]}")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--servers', default='dev', help=f"comma separated: {', '.join(SERVERS)}")
+    p.add_argument('--concurrency', default='1,8,32')
+    p.add_argument('--duration', type=float, default=10.0, help='seconds measured per level')
+    p.add_argument('--warmup', type=float, default=2.0)
+    p.add_argument('--workers', type=int, default=2)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--message', default='この車の車検について教えてください')
+    p.add_argument('--history', type=int, default=4, help='conversation_history entries per request')
+    p.add_argument('--no-plate', action='store_true')
+    p.add_argument('--request-class', default=None, help='X-Request-Class header (interactive / standard / bulk)')
+    p.add_argument('--latency-ms', type=float, default=200.0)
+    p.add_argument('--jitter-ms', type=float, default=50.0)
+    p.add_argument('--error-rate', type=float, default=0.0)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--replay', action='append', default=None,
+                   help='replay a captured MCP traffic file (MCP_CAPTURE_PATH) instead of the mock')
+    p.add_argument('--replay-speed', type=float, default=1.0)
+    p.add_argument('--out', default=None, help='write results JSON here')
+    p.add_argument('--baseline', default=None, help='compare against a previous results JSON')
+    p.add_argument('--tolerance', type=float, default=0.10)
+    args = p.parse_args()
+
+    if args.replay:
+        records = replay_mcp_server.load_records(args.replay)
+        print(f"[replay] {replay_mcp_server.describe(records)}", flush=True)
+        mock = replay_mcp_server.start_in_thread(
+            records, replay_mcp_server.ReplayConfig(speed=args.replay_speed)
+        )
+    else:
+        mock_config = MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                 error_rate=args.error_rate, seed=args.seed)
+        mock = start_in_thread(mock_config)
+    payload = build_payload(args.message, args.history, not args.no_plate)
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    results = []
+    try:
+        for server in [s.strip() for s in args.servers.split(',') if s.strip()]:
+            port = _free_port()
+            cmd = server_command(server, port, args.workers, args.threads)
+            if cmd is None:
+                print(f"[skip] {server}: required package is not installed")
+                continue
+
+            extra_env = None
+            if server == 'production':
+                extra_env = {'SERVER_MODE': 'production', 'WEB_CONCURRENCY': str(args.workers),
+                             'GUNICORN_THREADS': str(args.threads)}
+
+            print(f"[{server}] starting: {' '.join(cmd)}", flush=True)
+            proc = start_app(cmd, port, mock.url, extra_env=extra_env)
+            try:
+                for level in levels:
+                    r = run_level(f"http://127.0.0.1:{port}/papi/chat", payload,
+                                  level, args.duration, args.warmup, args.request_class)
+                    r['server'] = server
+                    results.append(r)
+                    print(f"[{server}] c={level:<4} rps={r['rps']:<8} p50={r['p50_ms']}ms "
+                          f"p95={r['p95_ms']}ms p99={r['p99_ms']}ms errors={r['errors']}", flush=True)
+            finally:
+                stop_app(proc)
+    finally:
+        mock.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'duration': args.duration,
+            'workers': args.workers,
+            'threads': args.threads,
+            'history': args.history,
+            'request_class': args.request_class,
+            'mock': {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+                     'error_rate': args.error_rate},
+            'replay': {'files': args.replay, 'speed': args.replay_speed} if args.replay else None,
+        },
+        'results': results,
+    }
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"Saved: {args.out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for line in regressions:
+            print(f"[regression] {line}")
+        if regressions:
+            sys.exit(1)
+        print('No regressions against baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Micro Benchmarks
+
+ContextManager とメッセージ構築のホットパスのマイクロベンチマーク
+
+    python -m benchmarks.micro --save-baseline
+    python -m benchmarks.micro                      # ベースラインと比較（劣化で終了コード1）
+    python -m benchmarks.micro --baseline path.json # 指定したベースラインが無ければ終了コード2
+    python -m benchmarks.micro --sessions 1000,1000000 --history 1,1000
+
+各ケースについて1操作あたりの時間（ns/op）と tracemalloc のピークメモリを計測する。
+ベースラインはマシン依存のため、同じマシンで保存したものと比較すること（リポジトリには含めない）。
+"""
+
+from pathlib import Path
+from typing import Callable, Dict, List
+from unittest.mock import patch
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from app import create_app
+from app.models.chat import ChatContext, ChatRequest
+from app.routes.chat import _build_messages
+from app.services.context_manager import ContextManager, ConversationContext
+from app.services.qwen_mcp_client import ChatCompletionResponse, QwenMCPClient
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'results' / 'micro_baseline.json'
+
+PLATE = {
+    'region': '品川', 'classification_number': '330', 'hiragana': 'あ',
+    'serial_number': '1234', 'full_text': '品川330あ1234', 'confidence': 95.5,
+}
+
+
+def time_per_op(fn: Callable[[], None], min_time: float = 0.2, repeat: int = 3,
+                max_ops: int = 1_000_000) -> float:
+    """
+    fn を min_time 秒以上繰り返し実行し、1回あたりの時間（ナノ秒）を返す
+
+    ノイズを抑えるため repeat 回計測した最小値を使う。
+    """
+    fn()  # ウォームアップ
+    best = float('inf')
+    for _ in range(repeat):
+        ops = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        batch = 1
+        while elapsed < min_time / repeat and ops < max_ops:
+            for _ in range(batch):
+                fn()
+            ops += batch
+            elapsed = time.perf_counter() - started
+            batch = min(batch * 2, max_ops - ops) or 1
+        best = min(best, elapsed / ops * 1e9)
+    return best
+
+
+def peak_memory(fn: Callable[[], object]) -> int:
+    """fn 実行中の tracemalloc ピーク（バイト）"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def plate_for(i: int, sessions: int) -> Dict:
+    """1台あたり約10セッションになるよう車両を割り当てる（リクエストごとの別dict）"""
+    serial = f"{i % max(1, sessions // 10):04d}"
+    return dict(PLATE, serial_number=serial, full_text=f"品川330あ{serial}")
+
+
+def populate(manager: ContextManager, sessions: int) -> None:
+    """期限切れにならないセッションを一括登録する（get_or_create の期限切れ走査を避ける）"""
+    now = time.time()
+    manager.add_all(
+        ConversationContext(
+            session_id=f"session-{i}", license_plate=plate_for(i, sessions),
+            created_at=now, updated_at=now,
+        )
+        for i in range(sessions)
+    )
+
+
+def history(length: int) -> List[Dict]:
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'メッセージ{i}' * 4}
+        for i in range(length)
+    ]
+
+
+def _encode_upstream(endpoint, payload, headers):
+    # 上流への送信はせず、httpx と同じシリアライズだけ行う
+    json.dumps(payload, ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+    return ChatCompletionResponse(content='応答', finish_reason='stop')
+
+
+def bench_chat_endpoint(length: int, min_time: float) -> List[Dict]:
+    """
+    /papi/chat 1リクエスト分（本文の読み込み〜上流向けシリアライズ）の時間とピークメモリ
+
+    1件1000文字の履歴を length 件持つ大きなリクエストを使う。
+    """
+    app = create_app({'TESTING': True, 'LOG_LEVEL': 'WARNING', 'METRICS_ENABLED': False,
+                      'SERVER_TIMING_ENABLED': False})
+    client = app.test_client()
+    body = json.dumps({
+        'message': 'この車の登録地はどこですか？',
+        'context': {
+            'license_plate': PLATE,
+            'conversation_history': [
+                {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'{i:04d}' + '履歴' * 498}
+                for i in range(length)
+            ],
+        },
+    }, ensure_ascii=False).encode('utf-8')
+
+    def post():
+        response = client.post('/papi/chat', data=body, content_type='application/json')
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    with patch.object(QwenMCPClient, '_make_request', side_effect=_encode_upstream):
+        return [{
+            'case': f'chat_endpoint[history={length},body={len(body)}]',
+            'ns_per_op': time_per_op(post, min_time),
+            'peak_bytes': peak_memory(post),
+        }]
+
+
+def bench_sessions(sessions: int, min_time: float) -> List[Dict]:
+    results = []
+
+    def build():
+        manager = ContextManager()
+        populate(manager, sessions)
+        return manager
+
+    results.append({
+        'case': f'populate[sessions={sessions}]',
+        'ns_per_op': None,
+        'peak_bytes': peak_memory(build),
+    })
+
+    manager = build()
+    hit_key = f"session-{sessions // 2}"
+    results.append({
+        'case': f'get_or_create.hit[sessions={sessions}]',
+        'ns_per_op': time_per_op(lambda: manager.get_or_create(hit_key), min_time),
+        'peak_bytes': peak_memory(lambda: manager.get_or_create(hit_key)),
+    })
+    lookup = plate_for(sessions // 2, sessions)['full_text']
+    results.append({
+        'case': f'find_by_plate[sessions={sessions}]',
+        'ns_per_op': time_per_op(lambda: manager.find_by_plate(lookup), min_time),
+        'peak_bytes': peak_memory(lambda: manager.find_by_plate(lookup)),
+    })
+    results.append({
+        'case': f'get.miss[sessions={sessions}]',
+        'ns_per_op': time_per_op(lambda: manager.get('missing'), min_time),
+        'peak_bytes': peak_memory(lambda: manager.get('missing')),
+    })
+    return results
+
+
+def bench_history(length: int, min_time: float) -> List[Dict]:
+    results = []
+
+    # 上限ちょうどの履歴に1件追加して、毎回トリミングが走る状態を計測する
+    context = ConversationContext(session_id='bench')
+    context.MAX_HISTORY_LENGTH = length
+    for msg in history(length):
+        context.add_message(msg['role'], msg['content'])
+    results.append({
+        'case': f'add_message.trim[history={length}]',
+        'ns_per_op': time_per_op(lambda: context.add_message('user', '追加メッセージ'), min_time),
+        'peak_bytes': peak_memory(lambda: context.add_message('user', '追加メッセージ')),
+    })
+
+    chat_request = ChatRequest(
+        message='この車の登録地はどこですか？',
+        context=ChatContext(license_plate=PLATE, conversation_history=history(length)),
+    )
+    results.append({
+        'case': f'build_messages[history={length}]',
+        'ns_per_op': time_per_op(lambda: _build_messages(chat_request), min_time),
+        'peak_bytes': peak_memory(lambda: _build_messages(chat_request)),
+    })
+
+    payload = {
+        'message': 'この車の登録地はどこですか？',
+        'context': {'license_plate': PLATE, 'conversation_history': history(length)},
+    }
+    results.append({
+        'case': f'chat_request.from_dict[history={length}]',
+        'ns_per_op': time_per_op(lambda: ChatRequest.from_dict(payload), min_time),
+        'peak_bytes': peak_memory(lambda: ChatRequest.from_dict(payload)),
+    })
+    return results
+
+
+def run(sessions: List[int], histories: List[int], min_time: float,
+        payloads: List[int] = ()) -> List[Dict]:
+    results = []
+    for n in sessions:
+        results.extend(bench_sessions(n, min_time))
+    for h in histories:
+        results.extend(bench_history(h, min_time))
+    for h in payloads:
+        results.extend(bench_chat_endpoint(h, min_time))
+    for r in results:
+        if r['ns_per_op'] is not None:
+            r['ns_per_op'] = round(r['ns_per_op'], 1)
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict], time_tolerance: float,
+            memory_tolerance: float) -> List[str]:
+    """
+    ベースラインと比較して劣化を検出する
+
+    Returns:
+        劣化の説明のリスト（空なら問題なし）
+    """
+    index = {b['case']: b for b in baseline}
+    regressions = []
+    for r in results:
+        base = index.get(r['case'])
+        if not base:
+            continue
+        if base['ns_per_op'] and r['ns_per_op'] and r['ns_per_op'] > base['ns_per_op'] * (1 + time_tolerance):
+            regressions.append(f"{r['case']}: {r['ns_per_op']} ns/op > baseline {base['ns_per_op']}")
+        if base['peak_bytes'] and r['peak_bytes'] > base['peak_bytes'] * (1 + memory_tolerance):
+            regressions.append(f"{r['case']}: {r['peak_bytes']} B peak > baseline {base['peak_bytes']}")
+    return regressions
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--sessions', type=_int_list, default=[1_000, 10_000, 100_000],
+                   help='comma separated session counts (up to 1000000)')
+    p.add_argument('--history', type=_int_list, default=[1, 10, 100, 1000],
+                   help='comma separated history lengths')
+    p.add_argument('--payload-history', type=_int_list, default=[10, 100],
+                   help='history lengths (1000 chars each) for the /papi/chat request case')
+    p.add_argument('--min-time', type=float, default=0.2, help='seconds per timing case')
+    p.add_argument('--baseline', type=Path, default=None,
+                   help=f'baseline to compare with or save to (default: {DEFAULT_BASELINE})')
+    p.add_argument('--save-baseline', action='store_true')
+    p.add_argument('--time-tolerance', type=float, default=0.25)
+    p.add_argument('--memory-tolerance', type=float, default=0.10)
+    p.add_argument('--out', type=Path, default=None)
+    args = p.parse_args()
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.baseline and not args.save_baseline and not args.baseline.exists():
+        p.error(f"baseline not found: {args.baseline}")
+
+    results = run(args.sessions, args.history, args.min_time, args.payload_history)
+
+    for r in results:
+        ns = f"{r['ns_per_op']:>14,.1f} ns/op" if r['ns_per_op'] is not None else ' ' * 20
+        print(f"{r['case']:<45} {ns} {r['peak_bytes']:>14,} B peak")
+
+    report = {'python': sys.version.split()[0], 'results': results}
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"Saved baseline: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; comparison skipped (save one with --save-baseline).",
+              file=sys.stderr)
+        return
+
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    regressions = compare(results, baseline['results'], args.time_tolerance, args.memory_tolerance)
+    for line in regressions:
+        print(f"[regression] {line}")
+    if regressions:
+        sys.exit(1)
+    print('No regressions against baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Mock Qwen MCP Server
+
+負荷試験用のOpenAI互換モックサーバー（/v1/chat/completions）
+
+    python -m benchmarks.mock_mcp_server --port 8090 --latency-ms 300 --jitter-ms 100 --error-rate 0.01
+
+レイテンシ・ジッター・エラー率・ストリーミング（SSE）を設定できる。
+"""
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import argparse
+import json
+import random
+import threading
+import time
+
+
+@dataclass
+class MockConfig:
+    """モックサーバーの動作設定"""
+    latency_ms: float = 200.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    content: str = 'こちらはモック応答です。ナンバープレート情報を確認しました。'
+    stream_chunks: int = 8
+    chunk_delay_ms: float = 20.0
+    seed: Optional[int] = None
+
+
+class MockMCPHandler(BaseHTTPRequestHandler):
+    """/v1/chat/completions のハンドラ"""
+
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に送るため、Nagle + 遅延ACKで約40ms上乗せされるのを防ぐ
+    disable_nagle_algorithm = True
+    server: 'MockMCPServer'
+
+    def log_message(self, format, *args):
+        # 負荷試験中のアクセスログは不要
+        pass
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid json'}})
+            return
+
+        config = self.server.config
+        time.sleep(self.server.sample_latency())
+
+        if self.server.should_fail():
+            self._send_json(config.error_status, {'error': {'message': 'injected error'}})
+            return
+
+        if payload.get('stream'):
+            self._send_stream(payload)
+        else:
+            self._send_json(200, _completion(payload, config.content))
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, payload: dict):
+        config = self.server.config
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        content = config.content
+        step = max(1, -(-len(content) // max(1, config.stream_chunks)))
+        for i in range(0, len(content), step):
+            chunk = {
+                'object': 'chat.completion.chunk',
+                'model': payload.get('model', 'qwen-plus'),
+                'choices': [{'index': 0, 'delta': {'content': content[i:i + step]}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(config.chunk_delay_ms / 1000)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def _completion(payload: dict, content: str) -> dict:
+    prompt_chars = sum(len(str(m.get('content', ''))) for m in payload.get('messages', []))
+    prompt_tokens = max(1, prompt_chars // 2)
+    completion_tokens = max(1, len(content) // 2)
+    return {
+        'id': 'chatcmpl-mock',
+        'object': 'chat.completion',
+        'model': payload.get('model', 'qwen-plus'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class MockMCPServer(ThreadingHTTPServer):
+    """設定付きのスレッドHTTPサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockMCPHandler)
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._random_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sample_latency(self) -> float:
+        with self._random_lock:
+            jitter = self._random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        return max(0.0, self.config.latency_ms + jitter) / 1000
+
+    def should_fail(self) -> bool:
+        if self.config.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.config.error_rate
+
+
+def start_in_thread(config: MockConfig, host: str = '127.0.0.1', port: int = 0) -> MockMCPServer:
+    """
+    モックサーバーをバックグラウンドスレッドで起動する
+
+    Args:
+        config: モックサーバーの設定
+        host: バインドするホスト
+        port: ポート（0なら空きポート）
+
+    Returns:
+        起動済みのサーバー（停止は shutdown()）
+    """
+    server = MockMCPServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name='mock-mcp-server', daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8090)
+    p.add_argument('--latency-ms', type=float, default=MockConfig.latency_ms)
+    p.add_argument('--jitter-ms', type=float, default=MockConfig.jitter_ms)
+    p.add_argument('--error-rate', type=float, default=MockConfig.error_rate)
+    p.add_argument('--error-status', type=int, default=MockConfig.error_status)
+    p.add_argument('--stream-chunks', type=int, default=MockConfig.stream_chunks)
+    p.add_argument('--chunk-delay-ms', type=float, default=MockConfig.chunk_delay_ms)
+    p.add_argument('--seed', type=int, default=None)
+    args = p.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_chunks=args.stream_chunks,
+        chunk_delay_ms=args.chunk_delay_ms,
+        seed=args.seed,
+    )
+    server = MockMCPServer((args.host, args.port), config)
+    print(f"Mock Qwen MCP server listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Replay MCP Server
+
+記録した上流とのやり取り（MCP_CAPTURE_PATH、app.services.mcp_capture）を
+元のレイテンシで再生するOpenAI互換サーバー
+
+    python -m benchmarks.replay_mcp_server --capture mcp.capture --port 8090 --speed 1.0
+
+最初の応答までの時間・本文のチャンクの到着時刻・ステータスコード・接続エラーを
+記録どおりに再現する。タイムアウトの記録は、クライアントが自分のタイムアウトで
+諦めるまで応答せずに接続を保つ（切断すると接続エラーとして扱われるため）。
+リクエストには記録を順に割り当てる（同じモデルの記録があればそのモデルの記録から。
+最後まで使ったら先頭に戻る）。本文は匿名化された内容を返す。
+"""
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from app.services.mcp_capture import read_records
+
+
+@dataclass
+class ReplayConfig:
+    """再生の設定"""
+    speed: float = 1.0          # 2.0 なら記録の半分の時間で返す
+    match_model: bool = True    # リクエストと同じモデルの記録を使う
+    timeout_hold: float = 300.0  # タイムアウトの記録で接続を保つ最大秒数
+
+
+def load_records(paths: List[str]) -> List[Dict]:
+    """
+    記録ファイルを読み込む
+
+    Raises:
+        ValueError: 再生できる記録が無い場合
+    """
+    records = [record for path in paths for record in read_records(path)]
+    if not records:
+        raise ValueError(f"no captured exchanges in {', '.join(paths)}")
+    return records
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """記録したレスポンスを元のタイミングで返すハンドラ"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'ReplayMCPServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        started = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+
+        record = self.server.next_record(payload.get('model'))
+        scale = 1.0 / self.server.config.speed
+
+        def wait_until(ms: float):
+            delay = started + ms * scale / 1000 - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if record['status'] == 0:
+            if record.get('error') == 'timeout':
+                # タイムアウト: クライアントが切断するまで応答しない
+                self._hold_open(self.server.config.timeout_hold)
+            else:
+                # 接続エラー: 記録した時間で応答せずに切断する
+                wait_until(record.get('total_ms', 0))
+            self.close_connection = True
+            return
+
+        body = record.get('response', '').encode('utf-8')
+        content_type = record.get('content_type') or 'application/json'
+        streaming = 'text/event-stream' in content_type
+
+        wait_until(record.get('ttfb_ms', 0))
+        self.send_response(record['status'])
+        self.send_header('Content-Type', content_type)
+        if streaming:
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.flush()
+
+        # 匿名化で本文の長さが変わることがあるので、チャンクの境界は比率で合わせる
+        chunks = record.get('chunks') or [[record.get('total_ms', 0), len(body)]]
+        recorded_total = sum(size for _, size in chunks) or 1
+        sent = received = 0
+        for i, (at_ms, size) in enumerate(chunks):
+            received += size
+            end = len(body) if i == len(chunks) - 1 else round(received * len(body) / recorded_total)
+            wait_until(at_ms)
+            self.wfile.write(body[sent:end])
+            self.wfile.flush()
+            sent = end
+
+        if streaming:
+            self.close_connection = True
+
+    def _hold_open(self, limit: float) -> None:
+        """クライアントが切断するまで（最大 limit 秒）接続を保つ"""
+        self.connection.settimeout(limit)
+        try:
+            while self.connection.recv(4096):
+                pass
+        except OSError:
+            pass
+
+
+class ReplayMCPServer(ThreadingHTTPServer):
+    """記録を再生するスレッドHTTPサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, records: List[Dict], config: Optional[ReplayConfig] = None):
+        super().__init__(address, ReplayHandler)
+        self.config = config or ReplayConfig()
+        self.records = records
+        self._by_model: Dict[str, List[Dict]] = {}
+        for record in records:
+            self._by_model.setdefault(record.get('model', ''), []).append(record)
+        self._positions: Dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_record(self, model: Optional[str]) -> Dict:
+        """次に再生する記録（同じモデルの記録が無ければ全体から）"""
+        key = model if self.config.match_model and model in self._by_model else None
+        pool = self._by_model[key] if key is not None else self.records
+        with self._lock:
+            position = self._positions.get(key, 0)
+            self._positions[key] = (position + 1) % len(pool)
+        return pool[position]
+
+
+def describe(records: List[Dict]) -> str:
+    """記録の概要（件数・ステータスの内訳・最初の応答までの時間）"""
+    statuses: Dict[str, int] = {}
+    for record in records:
+        status = str(record['status']) if record['status'] else record.get('error', 'error')
+        statuses[status] = statuses.get(status, 0) + 1
+    ttfb = sorted(record['ttfb_ms'] for record in records if 'ttfb_ms' in record)
+    summary = f"{len(records)} exchanges, status {statuses}"
+    if len(ttfb) >= 2:
+        q = statistics.quantiles(ttfb, n=100, method='inclusive')
+        summary += f", ttfb p50={q[49]:.0f}ms p95={q[94]:.0f}ms p99={q[98]:.0f}ms"
+    return summary
+
+
+def start_in_thread(records: List[Dict], config: Optional[ReplayConfig] = None,
+                    host: str = '127.0.0.1', port: int = 0) -> ReplayMCPServer:
+    """
+    再生サーバーをバックグラウンドスレッドで起動する
+
+    Args:
+        records: 再生する記録
+        config: 再生の設定
+        host: バインドするホスト
+        port: ポート（0なら空きポート）
+
+    Returns:
+        起動済みのサーバー（停止は shutdown()）
+    """
+    server = ReplayMCPServer((host, port), records, config)
+    thread = threading.Thread(target=server.serve_forever, name='replay-mcp-server', daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--capture', required=True, action='append', help='MCP_CAPTURE_PATH で記録したファイル')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8090)
+    p.add_argument('--speed', type=float, default=ReplayConfig.speed)
+    p.add_argument('--any-model', action='store_true', help='モデルに関係なく記録を順に使う')
+    p.add_argument('--timeout-hold', type=float, default=ReplayConfig.timeout_hold,
+                   help='タイムアウトの記録で接続を保つ最大秒数')
+    args = p.parse_args()
+
+    records = load_records(args.capture)
+    config = ReplayConfig(speed=args.speed, match_model=not args.any_model, timeout_hold=args.timeout_hold)
+    server = ReplayMCPServer((args.host, args.port), records, config)
+    print(f"Replaying {describe(records)}", flush=True)
+    print(f"Replay Qwen MCP server listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
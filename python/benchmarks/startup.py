@@ -0,0 +1,214 @@
+"""
+Startup Benchmark
+
+コールドスタート（プロセス起動〜/papi/health 応答）の計測
+
+    python -m benchmarks.startup --save-baseline
+    python -m benchmarks.startup                    # ベースラインと比較（劣化で終了コード1）
+    python -m benchmarks.startup --runs 10 --top 15
+
+新しいインタープリタを `-X importtime` 付きで起動し、フェーズごと
+（import app → create_app → 最初の /papi/health → 最初の /papi/ready）の時間と、
+各フェーズで読み込まれたモジュールの import 時間の内訳を出力する。
+/papi/health までに重い依存（HEAVY_MODULES）が読み込まれていないことも確認する。
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'results' / 'startup_baseline.json'
+
+# 初回使用時まで読み込みを遅らせるべきモジュール
+HEAVY_MODULES = ('httpx', 'numpy', 'torch', 'transformers')
+
+PHASES = ('import', 'create_app', 'health', 'ready')
+
+PHASE_MARKER = '# phase: '
+
+PROBE = f"""
+import json, sys, time
+heavy = {HEAVY_MODULES!r}
+marks = {{}}
+started = time.perf_counter()
+from app import create_app
+marks['import'] = time.perf_counter()
+sys.stderr.write({PHASE_MARKER!r} + 'import\\n')
+app = create_app()
+marks['create_app'] = time.perf_counter()
+sys.stderr.write({PHASE_MARKER!r} + 'create_app\\n')
+client = app.test_client()
+assert client.get('/papi/health').status_code == 200
+marks['health'] = time.perf_counter()
+sys.stderr.write({PHASE_MARKER!r} + 'health\\n')
+heavy_at_health = [m for m in heavy if m in sys.modules]
+ready_status = client.get('/papi/ready').status_code
+marks['ready'] = time.perf_counter()
+sys.stderr.write({PHASE_MARKER!r} + 'ready\\n')
+print(json.dumps({{
+    'phases_ms': {{k: (v - started) * 1000 for k, v in marks.items()}},
+    'heavy_at_health': heavy_at_health,
+    'heavy_at_ready': [m for m in heavy if m in sys.modules],
+    'ready_status': ready_status,
+}}))
+"""
+
+
+def parse_importtime(stderr: str) -> Dict[str, List[Dict]]:
+    """
+    `-X importtime` の出力をフェーズごとに分割して解析する
+
+    Returns:
+        フェーズ名 → [{'module', 'self_us', 'cumulative_us', 'depth'}]
+    """
+    phases: Dict[str, List[Dict]] = {}
+    current: List[Dict] = []
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            phases[line[len(PHASE_MARKER):].strip()] = current
+            current = []
+            continue
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # ヘッダー行
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        current.append({
+            'module': stripped,
+            'self_us': int(parts[0]),
+            'cumulative_us': int(parts[1]),
+            # importtime は入れ子を2文字ずつのインデントで表す
+            'depth': (len(name) - len(stripped) - 1) // 2,
+        })
+    return phases
+
+
+def run_once(env: Optional[Dict[str, str]] = None) -> Dict:
+    """新しいプロセスで1回計測する"""
+    proc_env = dict(os.environ)
+    proc_env.update({'QWEN_MCP_URL': 'http://127.0.0.1:9', 'LOG_LEVEL': 'WARNING'})
+    proc_env.update(env or {})
+
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=APP_DIR, env=proc_env, capture_output=True, text=True, check=False,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"startup probe failed:\n{proc.stderr[-4000:]}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['wall_ms'] = wall_ms
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def measure(runs: int = 5, env: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    runs 回計測して中央値を取る
+
+    Returns:
+        {'phases_ms', 'wall_ms', 'heavy_at_health', 'heavy_at_ready', 'ready_status', 'imports'}
+        （imports は最後の1回分）
+    """
+    samples = [run_once(env) for _ in range(max(1, runs))]
+    last = samples[-1]
+    return {
+        'phases_ms': {
+            phase: round(statistics.median(s['phases_ms'][phase] for s in samples), 2)
+            for phase in PHASES
+        },
+        'wall_ms': round(statistics.median(s['wall_ms'] for s in samples), 2),
+        'heavy_at_health': last['heavy_at_health'],
+        'heavy_at_ready': last['heavy_at_ready'],
+        'ready_status': last['ready_status'],
+        'imports': last['imports'],
+    }
+
+
+def top_imports(entries: List[Dict], n: int, max_depth: int = 0) -> List[Dict]:
+    """直接 import されたモジュール（depth <= max_depth）を累積時間の降順で返す"""
+    selected = [e for e in entries if e['depth'] <= max_depth]
+    return sorted(selected, key=lambda e: e['cumulative_us'], reverse=True)[:n]
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    ベースラインと比較して劣化を検出する
+
+    Returns:
+        劣化の説明のリスト（空なら問題なし）
+    """
+    regressions = []
+    for key in ('health', 'ready'):
+        base = baseline['phases_ms'].get(key)
+        value = result['phases_ms'].get(key)
+        if base and value and value > base * (1 + tolerance):
+            regressions.append(f"{key}: {value} ms > baseline {base} ms")
+    added = sorted(set(result['heavy_at_health']) - set(baseline.get('heavy_at_health', [])))
+    if added:
+        regressions.append(f"heavy modules loaded before /papi/health: {', '.join(added)}")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--top', type=int, default=10, help='modules listed per phase')
+    p.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    p.add_argument('--save-baseline', action='store_true')
+    p.add_argument('--tolerance', type=float, default=0.20)
+    p.add_argument('--out', type=Path, default=None)
+    args = p.parse_args()
+
+    result = measure(args.runs)
+
+    print(f"process wall time: {result['wall_ms']:.1f} ms (median of {args.runs})")
+    previous = 0.0
+    for phase in PHASES:
+        value = result['phases_ms'][phase]
+        print(f"  {phase:<12} +{value - previous:8.1f} ms  (at {value:.1f} ms)")
+        previous = value
+    print(f"heavy modules at /papi/health: {', '.join(result['heavy_at_health']) or '-'}")
+    print(f"heavy modules at /papi/ready:  {', '.join(result['heavy_at_ready']) or '-'}")
+
+    for phase in PHASES:
+        entries = top_imports(result['imports'].get(phase, []), args.top)
+        if not entries:
+            continue
+        print(f"\n[{phase}] top imports (cumulative)")
+        for e in entries:
+            print(f"  {e['cumulative_us'] / 1000:8.1f} ms  {e['module']}")
+
+    report = {'python': sys.version.split()[0], **{k: v for k, v in result.items() if k != 'imports'}}
+    if args.out:
+        args.out.write_text(json.dumps({**report, 'imports': result['imports']}, indent=2), encoding='utf-8')
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"\nSaved baseline: {args.baseline}")
+        return
+
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"[regression] {line}")
+        if regressions:
+            sys.exit(1)
+        print('\nNo regressions against baseline.')
+
+
+if __name__ == '__main__':
+    main()
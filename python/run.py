@@ -2,6 +2,8 @@
 Flask Application Entry Point
 
 会話AI連携API サーバー起動スクリプト
+
+SERVER_MODE=production で gunicorn（server.py）、それ以外は開発サーバーで起動する。
 """
 
 import os
@@ -15,8 +17,12 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
-    host = os.getenv('FLASK_HOST', '0.0.0.0')
-    port = int(os.getenv('FLASK_PORT', 5000))
-    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    if os.getenv('SERVER_MODE', 'development').lower() == 'production':
+        from server import serve
+        serve(app)
+    else:
+        host = os.getenv('FLASK_HOST', '0.0.0.0')
+        port = int(os.getenv('FLASK_PORT', 5000))
+        debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
 
-    app.run(host=host, port=port, debug=debug)
+        app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,186 @@
+"""
+Production Server
+
+本番用のサーバー起動（gunicorn）
+
+run.py から SERVER_MODE=production のときに呼ばれる。設定は環境変数で指定する:
+
+    SERVER_WORKER_CLASS  gthread（既定） / gevent / uvicorn / sync
+    WEB_CONCURRENCY      ワーカー数（省略時はCPUコア数から算出）
+    GUNICORN_THREADS     gthread のスレッド数（既定 8）
+    GUNICORN_TIMEOUT     ワーカーのタイムアウト秒（既定 150、上流のリトライ上限より長く）
+    GUNICORN_GRACEFUL_TIMEOUT  再起動時に処理中リクエストを待つ秒数（既定 30）
+    GUNICORN_MAX_REQUESTS      この件数ごとにワーカーを入れ替える（既定 2000、0で無効）
+    GUNICORN_KEEPALIVE         keep-alive 秒数（既定 5）
+
+LLMのプロキシは上流待ちがほとんどのI/Oバウンド処理なので、既定はスレッドワーカー（gthread）。
+アプリはマスターで一度だけ作成してからforkし（preload）、gc.freeze() で
+コピーオンライト後のページ複製を抑える。SIGHUP で全ワーカーを順に入れ替える。
+バックグラウンドのスレッド（ログの出力・遅いリクエストの監視・スナップショットの
+定期書き込み）は fork 後の各ワーカーで開始し直す。
+CONTEXT_SNAPSHOT_PATH を設定すると、ワーカーの終了時に会話コンテキストを書き出す。
+"""
+
+from typing import Dict, Mapping, Optional
+import gc
+import os
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+DEFAULT_THREADS = 8
+DEFAULT_TIMEOUT = 150
+DEFAULT_GRACEFUL_TIMEOUT = 30
+DEFAULT_MAX_REQUESTS = 2000
+DEFAULT_KEEPALIVE = 5
+
+
+def _int_env(env: Mapping[str, str], name: str, default: int, minimum: int = 0) -> int:
+    value = env.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} は整数である必要があります: {value!r}")
+    if number < minimum:
+        raise ValueError(f"{name} は {minimum} 以上である必要があります: {number}")
+    return number
+
+
+def default_workers(worker_class: str, cpu_count: int) -> int:
+    """
+    CPUコア数からワーカー数を算出する
+
+    Args:
+        worker_class: ワーカークラス名
+        cpu_count: CPUコア数
+
+    Returns:
+        ワーカー数
+    """
+    if worker_class == 'sync':
+        # 1ワーカー1リクエストなので、待ち時間を埋めるために多めに取る
+        return cpu_count * 2 + 1
+    # スレッド/非同期ワーカーは1プロセスで多数の上流待ちをさばけるので、コア数で十分
+    return max(2, cpu_count)
+
+
+def build_options(env: Optional[Mapping[str, str]] = None, cpu_count: Optional[int] = None) -> Dict:
+    """
+    環境変数から gunicorn の設定を組み立てて検証する
+
+    Args:
+        env: 環境変数（省略時は os.environ）
+        cpu_count: CPUコア数（省略時は os.cpu_count()）
+
+    Returns:
+        gunicorn の設定
+
+    Raises:
+        ValueError: 設定値が不正な場合
+    """
+    env = os.environ if env is None else env
+    cpu_count = cpu_count or os.cpu_count() or 1
+
+    worker_class = env.get('SERVER_WORKER_CLASS', 'gthread')
+    if worker_class not in WORKER_CLASSES:
+        raise ValueError(
+            f"SERVER_WORKER_CLASS は {', '.join(WORKER_CLASSES)} のいずれかである必要があります: {worker_class!r}"
+        )
+
+    host = env.get('FLASK_HOST', '0.0.0.0')
+    port = _int_env(env, 'FLASK_PORT', 5000, minimum=1)
+    max_requests = _int_env(env, 'GUNICORN_MAX_REQUESTS', DEFAULT_MAX_REQUESTS)
+
+    options = {
+        'bind': f"{host}:{port}",
+        'worker_class': WORKER_CLASSES[worker_class],
+        'workers': _int_env(env, 'WEB_CONCURRENCY', default_workers(worker_class, cpu_count), minimum=1),
+        'timeout': _int_env(env, 'GUNICORN_TIMEOUT', DEFAULT_TIMEOUT, minimum=1),
+        'graceful_timeout': _int_env(env, 'GUNICORN_GRACEFUL_TIMEOUT', DEFAULT_GRACEFUL_TIMEOUT, minimum=1),
+        'keepalive': _int_env(env, 'GUNICORN_KEEPALIVE', DEFAULT_KEEPALIVE),
+        'max_requests': max_requests,
+        # 全ワーカーが同時に入れ替わらないようにずらす
+        'max_requests_jitter': max_requests // 10,
+        'preload_app': True,
+        'accesslog': None,
+        'errorlog': '-',
+        'loglevel': env.get('LOG_LEVEL', 'INFO').lower(),
+    }
+
+    if worker_class == 'gthread':
+        options['threads'] = _int_env(env, 'GUNICORN_THREADS', DEFAULT_THREADS, minimum=1)
+    elif worker_class == 'gevent':
+        options['worker_connections'] = _int_env(env, 'GUNICORN_WORKER_CONNECTIONS', 100, minimum=1)
+
+    return options
+
+
+def when_ready(server):
+    # アプリ側で初回使用まで遅らせている上流クライアントの依存をマスターで読み込んでおき、
+    # 入れ替わったワーカーが毎回 import しないようにする（接続はワーカーごとに作る）
+    import httpx  # noqa: F401
+
+    # preload したアプリのオブジェクトを永続世代へ移し、ワーカーでのGCが
+    # 参照カウントを書き換えて共有ページを複製しないようにする
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # preload したアプリのバックグラウンドスレッドは fork 後のワーカーに引き継がれないので、
+    # 最初のリクエストを待たずにワーカーごとに開始する
+    # （ログの出力スレッドは structured_logging が fork 時に作り直す）
+    from app.services.context_snapshot import snapshot_writer
+    from app.services.request_timing import slow_request_watchdog
+    snapshot_writer.ensure_started()
+    slow_request_watchdog.ensure_started()
+
+
+def child_exit(server, worker):
+    # マルチプロセスのメトリクスから終了したワーカーの値を取り除く
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # 終了・入れ替え前に会話コンテキストを書き出し、次のワーカーで復元できるようにする
+    # （gunicorn のワーカーは SIGTERM を自前で処理するので、アプリ側のハンドラーは呼ばれない）
+    from app.services.context_snapshot import snapshot_writer
+    snapshot_writer.write()
+
+
+def serve(app, options: Optional[Dict] = None) -> None:
+    """
+    gunicorn でアプリを起動する
+
+    Args:
+        app: Flaskアプリケーション（マスターで作成済み = preload）
+        options: gunicorn の設定（省略時は環境変数から組み立てる）
+    """
+    from gunicorn.app.base import BaseApplication
+
+    options = options or build_options()
+
+    if options['worker_class'] == WORKER_CLASSES['uvicorn']:
+        from asgiref.wsgi import WsgiToAsgi
+        app = WsgiToAsgi(app)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+            self.cfg.set('when_ready', when_ready)
+            self.cfg.set('post_fork', post_fork)
+            self.cfg.set('child_exit', child_exit)
+            self.cfg.set('worker_exit', worker_exit)
+
+        def load(self):
+            return app
+
+    Application().run()
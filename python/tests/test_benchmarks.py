@@ -0,0 +1,204 @@
+"""
+Benchmark Harness Tests
+"""
+
+import time
+
+import httpx
+import pytest
+from app.services.mcp_capture import MCPCapture, read_records
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError
+from benchmarks import micro, replay_mcp_server
+from benchmarks.load_test import compare, summarize
+from benchmarks.mock_mcp_server import MockConfig, start_in_thread
+
+
+@pytest.fixture
+def mock_server():
+    """エラー注入なしのモックMCPサーバー"""
+    server = start_in_thread(MockConfig(latency_ms=0))
+    yield server
+    server.shutdown()
+
+
+class TestMockMCPServer:
+    """モックMCPサーバーのテスト"""
+
+    def test_client_against_mock(self, mock_server):
+        """QwenMCPClient がモックサーバーと通信できるテスト"""
+        client = QwenMCPClient(base_url=mock_server.url)
+
+        result = client.chat([{'role': 'user', 'content': 'テスト'}])
+
+        assert result.content == MockConfig.content
+        assert result.usage['total_tokens'] > 0
+
+    def test_error_injection(self):
+        """エラー率1.0で必ずエラーを返すテスト"""
+        server = start_in_thread(MockConfig(latency_ms=0, error_rate=1.0, error_status=503))
+        try:
+            client = QwenMCPClient(base_url=server.url, max_retries=0)
+            with pytest.raises(QwenMCPError) as exc_info:
+                client.chat([{'role': 'user', 'content': 'テスト'}])
+            assert exc_info.value.code == 'CONNECTION_FAILED'
+        finally:
+            server.shutdown()
+
+    def test_streaming(self, mock_server):
+        """SSEで分割して返すテスト"""
+        with httpx.stream('POST', f"{mock_server.url}/v1/chat/completions",
+                          json={'messages': [], 'stream': True}) as response:
+            lines = [line for line in response.iter_lines() if line.startswith('data: ')]
+
+        assert lines[-1] == 'data: [DONE]'
+        assert len(lines) > 2
+
+
+def captured(path, config, calls=1, stream=False):
+    """モックサーバーとのやり取りを記録する"""
+    server = start_in_thread(config)
+    recorder = MCPCapture()
+    recorder.configure(str(path))
+    try:
+        with httpx.Client() as http:
+            for _ in range(calls):
+                recorder.post(http, f"{server.url}/v1/chat/completions",
+                              {'model': 'qwen-plus', 'messages': [], 'stream': stream}, {})
+    finally:
+        server.shutdown()
+        recorder.configure('')
+    return list(read_records(str(path)))
+
+
+class TestReplayMCPServer:
+    """記録の再生サーバーのテスト"""
+
+    def test_replay_latency(self, tmp_path):
+        """記録したレイテンシで応答し、speed で短縮できるテスト"""
+        records = captured(tmp_path / 'mcp.capture', MockConfig(latency_ms=150))
+        server = replay_mcp_server.start_in_thread(records)
+        fast = replay_mcp_server.start_in_thread(records, replay_mcp_server.ReplayConfig(speed=3.0))
+        try:
+            timings = []
+            for url in (server.url, fast.url):
+                client = QwenMCPClient(base_url=url)
+                started = time.perf_counter()
+                result = client.chat([{'role': 'user', 'content': 'テスト'}])
+                timings.append(time.perf_counter() - started)
+        finally:
+            server.shutdown()
+            fast.shutdown()
+
+        assert result.finish_reason == 'stop'
+        assert len(result.content) == len(MockConfig.content)
+        assert timings[0] >= 0.14
+        assert timings[1] < timings[0] - 0.05
+
+    def test_replay_status_and_errors(self, tmp_path):
+        """記録したステータスコードを返すテスト"""
+        records = captured(tmp_path / 'mcp.capture', MockConfig(latency_ms=0, error_rate=1.0, error_status=503))
+        server = replay_mcp_server.start_in_thread(records)
+        try:
+            with pytest.raises(QwenMCPError) as exc_info:
+                QwenMCPClient(base_url=server.url, max_retries=0).chat([{'role': 'user', 'content': 'x'}])
+        finally:
+            server.shutdown()
+
+        assert exc_info.value.details['status_code'] == 503
+        assert '503' in replay_mcp_server.describe(records)
+
+    def test_replay_timeout_and_connect_error(self):
+        """タイムアウトの記録はクライアントのタイムアウト、接続エラーの記録は切断として再現するテスト"""
+        timeout = [{'v': 1, 'model': 'qwen-plus', 'status': 0, 'error': 'timeout', 'total_ms': 30000}]
+        connect = [{'v': 1, 'model': 'qwen-plus', 'status': 0, 'error': 'connect', 'total_ms': 5}]
+        servers = [replay_mcp_server.start_in_thread(records) for records in (timeout, connect)]
+        try:
+            codes = []
+            for server in servers:
+                client = QwenMCPClient(base_url=server.url, timeout=0.3, max_retries=0)
+                with pytest.raises(QwenMCPError) as exc_info:
+                    client.chat([{'role': 'user', 'content': 'x'}])
+                codes.append(exc_info.value.code)
+        finally:
+            for server in servers:
+                server.shutdown()
+
+        assert codes == ['TIMEOUT', 'CONNECTION_FAILED']
+
+    def test_replay_stream_chunks(self, tmp_path):
+        """SSEをチャンクの間隔どおりに返すテスト"""
+        records = captured(tmp_path / 'mcp.capture', MockConfig(latency_ms=0), stream=True)
+        server = replay_mcp_server.start_in_thread(records)
+        try:
+            arrivals = []
+            with httpx.stream('POST', f"{server.url}/v1/chat/completions", json={'model': 'qwen-plus'}) as response:
+                started = time.perf_counter()
+                for line in response.iter_lines():
+                    if line.startswith('data: '):
+                        arrivals.append(time.perf_counter() - started)
+        finally:
+            server.shutdown()
+
+        assert len(arrivals) == MockConfig.stream_chunks + 1
+        assert arrivals[-1] - arrivals[0] >= 0.1
+
+    def test_records_cycled_by_model(self, tmp_path):
+        """同じモデルの記録を順に使い、無ければ全体から使うテスト"""
+        records = [{'model': 'qwen-plus', 'n': 0}, {'model': 'qwen-vl-plus', 'n': 1}, {'model': 'qwen-plus', 'n': 2}]
+        server = replay_mcp_server.ReplayMCPServer(('127.0.0.1', 0), records)
+        try:
+            picked = [server.next_record('qwen-plus')['n'] for _ in range(3)]
+            other = [server.next_record('qwen-max')['n'] for _ in range(2)]
+        finally:
+            server.server_close()
+
+        assert picked == [0, 2, 0]
+        assert other == [0, 1]
+
+
+class TestLoadTestReport:
+    """負荷試験結果の集計のテスト"""
+
+    def test_summarize(self):
+        """RPSとパーセンタイルの計算テスト"""
+        samples = [(i / 1000, 200) for i in range(1, 101)] + [(0.5, 503)]
+
+        result = summarize(samples, duration=10.0, concurrency=4)
+
+        assert result['requests'] == 101
+        assert result['errors'] == 1
+        assert result['rps'] == 10.1
+        assert 49 <= result['p50_ms'] <= 52
+        assert result['p99_ms'] >= result['p95_ms'] >= result['p50_ms']
+
+    def test_compare_detects_regression(self):
+        """ベースラインとの比較テスト"""
+        baseline = [{'server': 'dev', 'concurrency': 8, 'rps': 100.0, 'p95_ms': 50.0, 'p99_ms': 80.0}]
+        ok = [{'server': 'dev', 'concurrency': 8, 'rps': 95.0, 'p95_ms': 54.0, 'p99_ms': 85.0}]
+        slow = [{'server': 'dev', 'concurrency': 8, 'rps': 70.0, 'p95_ms': 90.0, 'p99_ms': 85.0}]
+
+        assert compare(ok, baseline, tolerance=0.1) == []
+        regressions = compare(slow, baseline, tolerance=0.1)
+        assert len(regressions) == 2
+
+
+class TestMicroBenchmarks:
+    """マイクロベンチマークのテスト"""
+
+    def test_run_small(self):
+        """小さいサイズで全ケースが実行できるテスト"""
+        results = micro.run(sessions=[10], histories=[1, 5], min_time=0.001)
+
+        cases = {r['case'] for r in results}
+        assert 'get_or_create.hit[sessions=10]' in cases
+        assert 'build_messages[history=5]' in cases
+        assert all(r['peak_bytes'] >= 0 for r in results)
+
+    def test_compare_detects_regression(self):
+        """時間・メモリの劣化検出テスト"""
+        baseline = [{'case': 'a', 'ns_per_op': 100.0, 'peak_bytes': 1000}]
+        ok = [{'case': 'a', 'ns_per_op': 110.0, 'peak_bytes': 1050}]
+        slow = [{'case': 'a', 'ns_per_op': 200.0, 'peak_bytes': 2000}]
+
+        assert micro.compare(ok, baseline, time_tolerance=0.25, memory_tolerance=0.1) == []
+        assert len(micro.compare(slow, baseline, time_tolerance=0.25, memory_tolerance=0.1)) == 2
@@ -0,0 +1,194 @@
+"""
+Context Snapshot Tests
+
+会話コンテキストのスナップショットと遅延復元のテスト
+"""
+
+import os
+import time
+
+import pytest
+
+from app import create_app
+from app.services import context_snapshot
+from app.services.context_manager import ContextManager
+from app.services.context_snapshot import SnapshotError, SnapshotReader
+
+PLATE = {
+    'region': '品川',
+    'classification_number': '330',
+    'hiragana': 'あ',
+    'serial_number': '1234',
+    'full_text': '品川330あ1234',
+    'confidence': 95.5,
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'contexts.snap')
+
+
+def make_manager(sessions=('session-1',)) -> ContextManager:
+    manager = ContextManager()
+    for session_id in sessions:
+        context = manager.get_or_create(session_id)
+        context.set_license_plate(PLATE)
+        context.add_message('user', f'{session_id} の車検はいつ？')
+        context.add_message('assistant', '車検証をご確認ください。')
+    return manager
+
+
+def restored(path) -> ContextManager:
+    manager = ContextManager()
+    manager.restore_from(path)
+    return manager
+
+
+class TestSnapshotFormat:
+    """ファイル形式のテスト"""
+
+    def test_round_trip(self, path):
+        """書き込んだセッションが同じ内容で復元されるテスト"""
+        manager = make_manager()
+        manager.write_snapshot(path)
+
+        context = restored(path).get('session-1')
+
+        assert context.to_dict() == manager.get('session-1').to_dict()
+        assert context.plate_confidence == 95.5
+        assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+    def test_version_mismatch(self, path):
+        """未対応のバージョンは読まないテスト"""
+        make_manager().write_snapshot(path)
+        with open(path, 'r+b') as f:
+            f.seek(4)
+            f.write(b'\x09\x00')
+
+        with pytest.raises(SnapshotError, match='version'):
+            SnapshotReader(path)
+
+    def test_truncated(self, path):
+        """途中で切れたファイルは読まないテスト"""
+        make_manager().write_snapshot(path)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        with pytest.raises(SnapshotError):
+            SnapshotReader(path)
+
+    def test_record_checksum(self, path):
+        """壊れたレコードはデコード時に検出して捨てるテスト"""
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+        entry = SnapshotReader(path).entries['session-1']
+        with open(path, 'r+b') as f:
+            f.seek(entry.offset)
+            f.write(b'\x00')
+
+        manager = restored(path)
+
+        assert manager.get('session-1') is None
+        assert manager.get('session-2') is not None
+
+
+class TestLazyRestore:
+    """遅延復元のテスト"""
+
+    def test_restore_from_does_not_read(self, path):
+        """restore_from はファイルを読まず、最初のアクセスで索引だけを読むテスト"""
+        manager = restored(path)
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+
+        assert manager.ensure_restored() == 2
+        assert manager._contexts == {}
+        assert manager.get('session-1').session_id == 'session-1'
+        assert list(manager._contexts) == ['session-1']
+
+    def test_find_by_plate_decodes_on_demand(self, path):
+        """未デコードのセッションもナンバープレートで引けるテスト"""
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+
+        found = restored(path).find_by_plate('品川330あ1234')
+
+        assert sorted(c.session_id for c in found) == ['session-1', 'session-2']
+
+    def test_expired_sessions_dropped(self, path):
+        """期限切れのセッションはデコードせずに捨てるテスト"""
+        manager = make_manager()
+        manager.get('session-1').updated_at = time.time() - ContextManager.SESSION_TIMEOUT - 1
+        manager.write_snapshot(path)
+
+        assert restored(path).ensure_restored() == 0
+
+    def test_missing_or_corrupt_file(self, path):
+        """ファイルが無い・壊れている場合は空の状態で始めるテスト"""
+        assert restored(path).get('session-1') is None
+
+        with open(path, 'wb') as f:
+            f.write(b'not a snapshot' * 4)
+        manager = restored(path)
+
+        assert manager.get_or_create('session-1').messages == []
+
+    def test_rewrite_keeps_pending_sessions(self, path):
+        """デコードしていないセッションも次の書き込みに残るテスト"""
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+        manager = restored(path)
+        manager.get('session-1').add_message('user', '追加の質問')
+
+        os.unlink(path)
+        manager.write_snapshot(path)
+        again = restored(path)
+
+        assert again.get('session-1').messages[-1]['content'] == '追加の質問'
+        assert len(again.get('session-2').messages) == 2
+
+
+class TestMerge:
+    """複数ワーカーでの書き込みのテスト"""
+
+    def test_workers_merged(self, path):
+        """他のワーカーのセッションを残し、新しい方を使うテスト"""
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+        worker = make_manager(['session-2', 'session-3'])
+        worker.get('session-2').add_message('user', '新しい質問')
+        worker.write_snapshot(path)
+
+        manager = restored(path)
+
+        assert manager.ensure_restored() == 3
+        assert manager.get('session-2').messages[-1]['content'] == '新しい質問'
+
+    def test_deleted_not_resurrected(self, path):
+        """削除したセッションは他のワーカーの分と合わせても復活しないテスト"""
+        make_manager(['session-1', 'session-2']).write_snapshot(path)
+        manager = restored(path)
+        assert manager.delete('session-1') is True
+
+        manager.write_snapshot(path)
+
+        assert set(SnapshotReader(path).entries) == {'session-2'}
+
+
+class TestSnapshotApp:
+    """アプリへの組み込みのテスト"""
+
+    def test_ready_loads_index(self, path):
+        """/papi/ready でスナップショットの索引を読み込むテスト"""
+        from app.services.context_manager import context_manager
+
+        make_manager(['snapshot-gate']).write_snapshot(path)
+        app = create_app({'TESTING': True, 'CONTEXT_SNAPSHOT_PATH': path, 'CONTEXT_SNAPSHOT_INTERVAL': 0})
+        try:
+            assert context_manager._restore_pending is True
+            response = app.test_client().get('/papi/ready')
+
+            assert response.get_json()['checks']['context_snapshot'] == 'ok'
+            assert 'snapshot-gate' in context_manager._pending
+            assert context_snapshot.snapshot_writer.write() >= 1
+        finally:
+            create_app({'TESTING': True})
+
+        assert context_manager._pending == {}
+        assert context_snapshot.snapshot_writer.write() is None
@@ -0,0 +1,190 @@
+"""
+History Codec Tests
+
+アイドル中のセッションの会話履歴の圧縮のテスト
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.services import history_codec, metrics
+from app.services.context_manager import ContextManager, ConversationContext
+from app.services.history_codec import HistoryCodec, train_dictionary
+
+QUESTIONS = ['この車の車検はいつまでですか？', '登録地はどこですか？', 'レンタカーですか？']
+ANSWER = '車検証に記載されている有効期間の満了日をご確認ください。'
+
+
+def history(n: int = 6):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': QUESTIONS[i // 2 % 3] if i % 2 == 0 else ANSWER,
+         'timestamp': 1700000000.0 + i}
+        for i in range(n)
+    ]
+
+
+def _gauge(name):
+    return metrics.REGISTRY.get_sample_value(name) or 0.0
+
+
+def idle_manager(codec=None) -> ContextManager:
+    manager = ContextManager(compact_after=60, history_codec=codec)
+    context = manager.get_or_create('session-1')
+    for message in history():
+        context.add_message(message['role'], message['content'])
+    context.updated_at = time.time() - 120
+    return manager
+
+
+class TestHistoryCodec:
+    """コーデックのテスト"""
+
+    @pytest.mark.parametrize('dictionary', [b'', ANSWER.encode('utf-8')])
+    def test_round_trip(self, dictionary):
+        """圧縮して展開すると元に戻るテスト"""
+        codec = HistoryCodec('zlib', dictionary)
+
+        assert codec.unpack(codec.pack(history())) == history()
+
+    def test_dictionary_improves_ratio(self):
+        """共有辞書で短い履歴の圧縮率が上がるテスト"""
+        dictionary = train_dictionary([history()] * 10)
+        sample = history(2)
+
+        assert ANSWER.encode('utf-8') in dictionary
+        assert len(HistoryCodec('zlib', dictionary).pack(sample)) < len(HistoryCodec('zlib').pack(sample))
+
+    def test_zstd_fallback(self, monkeypatch):
+        """zstandard が無ければ zlib を使うテスト"""
+        monkeypatch.setattr(history_codec, 'zstandard', None)
+
+        assert HistoryCodec('zstd').backend == 'zlib'
+        with pytest.raises(ValueError):
+            HistoryCodec('lz4')
+
+
+class TestIdleCompaction:
+    """ContextManager の圧縮と展開のテスト"""
+
+    def test_idle_session_packed_and_restored(self):
+        """アイドル中のセッションを圧縮し、messages へのアクセスで展開するテスト"""
+        manager = idle_manager()
+        context = manager._contexts['session-1']
+        expected = [dict(m) for m in context.messages]
+        packed_before = _gauge('papi_context_history_packed_sessions')
+
+        manager.get('session-2')
+
+        assert context.history_packed is True
+        assert _gauge('papi_context_history_packed_sessions') == packed_before + 1
+        assert context.peek_messages() == expected
+        assert context.history_packed is True
+
+        assert manager.get('session-1').messages == expected
+        assert context.history_packed is False
+        assert _gauge('papi_context_history_packed_sessions') == packed_before
+
+    def test_add_message_after_packing(self):
+        """圧縮中のセッションに追記できるテスト"""
+        manager = idle_manager()
+        manager.get('session-2')
+        context = manager._contexts['session-1']
+
+        context.add_message('user', '追加の質問')
+
+        assert len(context.messages) == 7
+        assert context.get_messages_for_api()[-1] == {'role': 'user', 'content': '追加の質問'}
+
+    def test_add_message_races_with_packing(self, monkeypatch):
+        """圧縮と同時に追記してもメッセージが失われないテスト"""
+        monkeypatch.setattr(ConversationContext, 'MAX_HISTORY_LENGTH', 10000)
+        context = ConversationContext(session_id='race', messages=history())
+        codec = HistoryCodec()
+        done = threading.Event()
+
+        def pack():
+            while not done.is_set():
+                context.pack_history(codec)
+
+        packer = threading.Thread(target=pack)
+        packer.start()
+        try:
+            for i in range(2000):
+                context.add_message('user', f'質問{i}')
+        finally:
+            done.set()
+            packer.join()
+
+        assert len(context.messages) == 6 + 2000
+
+    def test_packing_does_not_block_other_sessions(self):
+        """あるセッションの圧縮中も他のセッションの会話履歴を読み書きできるテスト"""
+        packing = ConversationContext(session_id='packing', messages=history())
+        other = ConversationContext(session_id='other', messages=history())
+        finished = threading.Event()
+
+        def access():
+            other.add_message('user', '追加の質問')
+            other.messages
+            finished.set()
+
+        with packing._history_lock:
+            threading.Thread(target=access).start()
+            assert finished.wait(5)
+
+    def test_packing_skips_session_updated_after_selection(self):
+        """アイドルとして選んだ後に更新されたセッションは圧縮しないテスト"""
+        context = ConversationContext(session_id='s', messages=history())
+        selected_at = context.updated_at - 1
+
+        assert context.pack_history(HistoryCodec(), idle_before=selected_at) == 0
+        assert context.history_packed is False
+
+    def test_default_messages(self):
+        """messages を省略したセッションはそれぞれ空の履歴を持つテスト"""
+        a, b = ConversationContext(session_id='a'), ConversationContext(session_id='b')
+        a.add_message('user', 'q')
+
+        assert a.messages[0]['content'] == 'q'
+        assert b.messages == []
+
+    def test_active_session_not_packed(self):
+        """アイドル時間に満たないセッション・無効時は圧縮しないテスト"""
+        manager = idle_manager()
+        manager._contexts['session-1'].updated_at = time.time()
+        manager.get('session-2')
+        assert manager._contexts['session-1'].history_packed is False
+
+        disabled = idle_manager()
+        disabled.configure_history(0)
+        disabled.get('session-2')
+        assert disabled._contexts['session-1'].history_packed is False
+
+    def test_delete_releases_stats(self):
+        """圧縮中のセッションを削除したら集計から外すテスト"""
+        manager = idle_manager()
+        saved_before = _gauge('papi_context_history_saved_bytes')
+        manager.get('session-2')
+        assert _gauge('papi_context_history_saved_bytes') > saved_before
+
+        context = manager._contexts['session-1']
+        manager.delete('session-1')
+        context.messages
+
+        assert _gauge('papi_context_history_saved_bytes') == saved_before
+
+    def test_snapshot_does_not_unpack(self, tmp_path):
+        """スナップショットの書き込みで展開しないテスト"""
+        manager = idle_manager()
+        manager.get('session-2')
+        path = str(tmp_path / 'contexts.snap')
+
+        manager.write_snapshot(path)
+
+        assert manager._contexts['session-1'].history_packed is True
+        restored = ContextManager()
+        restored.restore_from(path)
+        assert [m['content'] for m in restored.get('session-1').messages][:2] == [QUESTIONS[0], ANSWER]
@@ -0,0 +1,293 @@
+"""
+Idempotency Tests
+
+Idempotency-Key による /papi/chat の重複実行の防止のテスト
+"""
+
+from unittest.mock import patch
+
+import json
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from app.services.idempotency import (
+    IdempotencyStore, MemoryIdempotencyStore, StoredResponse, create_store, idempotency, register_store, storable,
+    STORES
+)
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError, ChatCompletionResponse
+
+
+def answer(content='東京都品川区です'):
+    return ChatCompletionResponse(content=content, finish_reason='stop')
+
+
+def stored(body=b'{}', fingerprint='f'):
+    return StoredResponse(fingerprint=fingerprint, status=200, body=body, headers=())
+
+
+@pytest.fixture(autouse=True)
+def clear_store():
+    idempotency.store.clear()
+    yield
+    idempotency.store.clear()
+
+
+class TestChatIdempotency:
+    """/papi/chat の Idempotency-Key のテスト"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_retry_is_replayed(self, mock_chat, client):
+        """同じキーの再送は上流を呼ばずに同じ応答を返すテスト"""
+        mock_chat.return_value = answer()
+        headers = {'Idempotency-Key': 'retry-1'}
+
+        first = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+        second = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+
+        assert first.status_code == second.status_code == 200
+        assert second.get_json() == first.get_json()
+        assert 'Idempotent-Replayed' not in first.headers
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert mock_chat.call_count == 1
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_without_key_is_executed(self, mock_chat, client):
+        """キーが無ければ毎回実行するテスト"""
+        mock_chat.return_value = answer()
+
+        client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert mock_chat.call_count == 2
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_concurrent_duplicates_are_coalesced(self, mock_chat, app):
+        """実行中の同じキーのリクエストは完了を待って同じ応答を返すテスト"""
+        started = threading.Event()
+
+        def slow_chat(*args, **kwargs):
+            started.set()
+            time.sleep(0.2)
+            return answer()
+
+        mock_chat.side_effect = slow_chat
+        results = []
+
+        def post():
+            response = app.test_client().post(
+                '/papi/chat', json={'message': '登録地はどこ？'}, headers={'Idempotency-Key': 'dup'}
+            )
+            results.append(response)
+
+        leader = threading.Thread(target=post)
+        leader.start()
+        assert started.wait(5)
+        followers = [threading.Thread(target=post) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        assert mock_chat.call_count == 1
+        assert len(results) == 4
+        assert all(r.status_code == 200 for r in results)
+        assert len({r.get_data() for r in results}) == 1
+        assert sum(r.headers.get('Idempotent-Replayed') == 'true' for r in results) == 3
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_different_body_is_rejected(self, mock_chat, client):
+        """同じキーで本文が異なれば 422 を返すテスト"""
+        mock_chat.return_value = answer()
+        headers = {'Idempotency-Key': 'reused'}
+
+        client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+        response = client.post('/papi/chat', json={'message': '車検はいつ？'}, headers=headers)
+
+        assert response.status_code == 422
+        assert response.get_json()['error']['code'] == 'IDEMPOTENCY_KEY_MISMATCH'
+        assert mock_chat.call_count == 1
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_server_error_is_not_stored(self, mock_chat, client):
+        """5xx の応答は保存せず、再送で実行し直すテスト"""
+        mock_chat.side_effect = [QwenMCPError.connection_failed('down'), answer()]
+        headers = {'Idempotency-Key': 'flaky'}
+
+        first = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+        second = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+
+        assert first.status_code >= 500
+        assert second.status_code == 200
+        assert 'Idempotent-Replayed' not in second.headers
+        assert mock_chat.call_count == 2
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_upstream_unauthorized_is_not_stored(self, mock_chat, client):
+        """上流の 401（APIキーの設定誤り）は保存せず、再送で実行し直すテスト"""
+        mock_chat.side_effect = [QwenMCPError.unauthorized(), answer()]
+        headers = {'Idempotency-Key': 'bad-api-key'}
+
+        first = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+        second = client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers=headers)
+
+        assert first.status_code == 401
+        assert second.status_code == 200
+        assert 'Idempotent-Replayed' not in second.headers
+        assert mock_chat.call_count == 2
+
+    def test_storable(self):
+        """2xx とリクエスト自体の誤りだけ保存するテスト"""
+        def stored(status, code=None):
+            body = json.dumps({'success': False, 'error': {'code': code}}).encode() if code else b'{}'
+            return storable(StoredResponse(fingerprint='f', status=status, body=body, headers=()))
+
+        assert stored(200)
+        assert stored(422, 'VALIDATION_ERROR')
+        assert stored(413, 'PAYLOAD_TOO_LARGE')
+        assert not stored(401, 'UNAUTHORIZED')
+        assert not stored(429, 'RATE_LIMITED')
+        assert not stored(503, 'CONNECTION_FAILED')
+        assert not stored(404)
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_waiting_duplicate_retries_after_server_error(self, mock_chat, app):
+        """実行中のリクエストが 5xx なら、待っていたリクエストは実行し直すテスト"""
+        started = threading.Event()
+        calls = []
+
+        def chat(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                started.set()
+                time.sleep(0.2)
+                raise QwenMCPError.connection_failed('down')
+            return answer()
+
+        mock_chat.side_effect = chat
+        results = {}
+
+        def post(name):
+            results[name] = app.test_client().post(
+                '/papi/chat', json={'message': '登録地はどこ？'}, headers={'Idempotency-Key': 'flaky'}
+            )
+
+        leader = threading.Thread(target=post, args=('leader',))
+        leader.start()
+        assert started.wait(5)
+        follower = threading.Thread(target=post, args=('follower',))
+        follower.start()
+        leader.join(5)
+        follower.join(5)
+
+        assert results['leader'].status_code >= 500
+        assert results['follower'].status_code == 200
+        assert 'Idempotent-Replayed' not in results['follower'].headers
+        assert len(calls) == 2
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_keys_are_scoped_by_api_key(self, mock_chat, client):
+        """X-API-Key が異なれば同じキーでも別のリクエストとして扱うテスト"""
+        mock_chat.return_value = answer()
+
+        for api_key in ('kiosk-a', 'kiosk-b'):
+            response = client.post('/papi/chat', json={'message': '登録地はどこ？'},
+                                   headers={'Idempotency-Key': 'same', 'X-API-Key': api_key})
+            assert 'Idempotent-Replayed' not in response.headers
+
+        assert mock_chat.call_count == 2
+
+    def test_invalid_key(self, client):
+        """形式が不正なキーは 400 を返すテスト"""
+        response = client.post('/papi/chat', json={'message': '登録地はどこ？'},
+                               headers={'Idempotency-Key': 'x' * 256})
+
+        assert response.status_code == 400
+        assert response.get_json()['error']['code'] == 'INVALID_REQUEST'
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_disabled(self, mock_chat):
+        """IDEMPOTENCY_ENABLED=false ではキーを無視するテスト"""
+        app = create_app({'TESTING': True, 'IDEMPOTENCY_ENABLED': False})
+        mock_chat.return_value = answer()
+        client = app.test_client()
+
+        for _ in range(2):
+            client.post('/papi/chat', json={'message': '登録地はどこ？'}, headers={'Idempotency-Key': 'k'})
+
+        assert mock_chat.call_count == 2
+
+
+class TestMemoryIdempotencyStore:
+    """プロセス内の保存先のテスト"""
+
+    def test_max_entries(self):
+        """件数の上限を超えたら古いものから捨てるテスト"""
+        store = MemoryIdempotencyStore(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            store.put(key, stored(), ttl=60)
+
+        assert store.get('a') is None
+        assert store.get('b') is not None and store.get('c') is not None
+        assert len(store) == 2
+
+    def test_max_bytes(self):
+        """バイト数の上限を超えたら古いものから捨て、上限より大きい応答は保存しないテスト"""
+        size = stored(b'x' * 100).size
+        store = MemoryIdempotencyStore(max_bytes=size * 2)
+        for key in ('a', 'b', 'c'):
+            store.put(key, stored(b'x' * 100), ttl=60)
+        store.put('huge', stored(b'x' * size * 3), ttl=60)
+
+        assert store.get('a') is None
+        assert store.get('huge') is None
+        assert len(store) == 2
+
+    def test_ttl(self):
+        """期限が切れた応答は返さないテスト"""
+        store = MemoryIdempotencyStore()
+        with patch('app.services.idempotency.time.monotonic', return_value=1000.0):
+            store.put('a', stored(), ttl=60)
+        with patch('app.services.idempotency.time.monotonic', return_value=1059.0):
+            assert store.get('a') is not None
+        with patch('app.services.idempotency.time.monotonic', return_value=1060.0):
+            assert store.get('a') is None
+        assert len(store) == 0
+
+
+class TestStoreRegistry:
+    """保存先の選択のテスト"""
+
+    def test_unknown_store(self):
+        """登録されていない保存先は ValueError になるテスト"""
+        with pytest.raises(ValueError):
+            create_app({'TESTING': True, 'IDEMPOTENCY_STORE': 'redis'})
+
+    def test_incomplete_store_rejected(self):
+        """メソッドが足りない保存先は作成時に失敗するテスト"""
+        class IncompleteStore(IdempotencyStore):
+            def __init__(self, max_entries, max_bytes):
+                pass
+
+            def get(self, key):
+                return None
+
+        register_store('incomplete', IncompleteStore)
+        try:
+            with pytest.raises(TypeError):
+                create_store('incomplete', max_entries=10, max_bytes=1024)
+        finally:
+            del STORES['incomplete']
+
+    def test_register_store(self):
+        """register_store で登録した保存先を選べるテスト"""
+        class CustomStore(MemoryIdempotencyStore):
+            pass
+
+        register_store('custom', CustomStore)
+        try:
+            assert isinstance(create_store('custom', max_entries=10, max_bytes=1024), CustomStore)
+        finally:
+            del STORES['custom']
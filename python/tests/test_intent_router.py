@@ -0,0 +1,152 @@
+"""
+Intent Router Tests
+
+ナンバープレートの項目からのローカル応答のテスト
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from app.services.intent_router import IntentRouter
+from app.services.qwen_mcp_client import QwenMCPClient, ChatCompletionResponse
+
+PLATE = {
+    'region': '品川',
+    'classification_number': '330',
+    'hiragana': 'あ',
+    'serial_number': '1234',
+    'full_text': '品川330あ1234',
+    'confidence': 95.5,
+}
+
+RENTAL_PLATE = {
+    'region': '袖ヶ浦',
+    'classification_number': '500',
+    'hiragana': 'わ',
+    'serial_number': '12',
+    'full_text': '袖ヶ浦500わ12',
+}
+
+
+class TestIntentRouter:
+    """意図判定と応答のテスト"""
+
+    @pytest.fixture
+    def router(self):
+        return IntentRouter()
+
+    def test_region(self, router):
+        """地名から都道府県を答えるテスト"""
+        answer = router.route('この車の登録地はどこ？', PLATE)
+
+        assert answer.intents == ('region',)
+        assert '東京都' in answer.response
+
+    def test_region_normalized(self, router):
+        """表記揺れのある地名も対応表で引けるテスト"""
+        answer = router.route('どこナンバー？', RENTAL_PLATE)
+
+        assert '千葉県' in answer.response
+
+    def test_vehicle_type(self, router):
+        """分類番号から車種を答えるテスト"""
+        answer = router.route('車種は？', PLATE)
+
+        assert answer.intents == ('vehicle_type',)
+        assert '普通乗用自動車' in answer.response
+
+    def test_rental(self, router):
+        """ひらがなからレンタカーかどうかを答えるテスト"""
+        assert 'レンタカー' in router.route('これってレンタカー？', RENTAL_PLATE).response
+        assert '自家用' in router.route('レンタカーですか', {**PLATE, 'hiragana': 'さ'}).response
+
+    def test_multiple_intents(self, router):
+        """複数の意図の回答をまとめるテスト"""
+        answer = router.route('登録地と車種を教えて', PLATE)
+
+        assert answer.intents == ('region', 'vehicle_type')
+        assert '東京都' in answer.response
+        assert '普通乗用自動車' in answer.response
+
+    def test_falls_through(self, router):
+        """答えられない質問は None を返すテスト"""
+        assert router.route('こんにちは', PLATE) is None
+        assert router.route('登録地はどこ？', None) is None
+        assert router.route('レンタカーを借りる方法は？', PLATE) is None
+        assert router.route('登録地' + 'あ' * 100, PLATE) is None
+
+    @pytest.mark.parametrize('message', [
+        'レンタカーの返却場所はどこ？',
+        '事業用の車は入場できますか？',
+        '自家用車でもこのゲートを通れる？',
+        'この地域の駐車場は空いてる？',
+        '乗用車の最大サイズは？',
+        'どこ？',
+    ])
+    def test_keyword_in_other_question_falls_through(self, router, message):
+        """項目の語を含むだけの別の質問は LLM に任せるテスト"""
+        assert router.route(message, {**PLATE, 'hiragana': 'わ'}) is None
+
+    def test_question_forms(self, router):
+        """主語・文末表現の付いた定型の質問に答えるテスト"""
+        assert router.route('この車はレンタカーですか？', RENTAL_PLATE).intents == ('usage',)
+        assert router.route('分類番号は何ですか', PLATE).intents == ('vehicle_type',)
+        assert router.route('何県の車？', PLATE).intents == ('region',)
+        assert router.route('このナンバーの用途を教えてください', PLATE).intents == ('usage',)
+
+    def test_unknown_field_falls_through(self, router):
+        """対応表に無い値や欠けた項目は LLM に任せるテスト"""
+        assert router.route('登録地はどこ？', {**PLATE, 'region': 'テスト'}) is None
+        assert router.route('登録地と車種は？', {'full_text': '練馬500さ9876'}) is None
+
+
+class TestChatFastPath:
+    """/papi/chat のローカル応答のテスト"""
+
+    @pytest.fixture
+    def client(self, app):
+        app.config['INTENT_ROUTER_ENABLED'] = True
+        return app.test_client()
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_answered_locally(self, mock_chat, client):
+        """上流を呼ばずに fast_path で応答するテスト"""
+        response = client.post('/papi/chat', json={
+            'message': '登録地はどこ？',
+            'context': {'license_plate': PLATE},
+        })
+
+        assert response.status_code == 200
+        data = response.get_json()['data']
+        assert data['fast_path'] is True
+        assert data['context_used'] is True
+        assert '東京都' in data['response']
+        mock_chat.assert_not_called()
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_unmatched_goes_upstream(self, mock_chat, client):
+        """該当しない質問は上流に問い合わせるテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='応答', finish_reason='stop')
+
+        response = client.post('/papi/chat', json={
+            'message': '車検はいつ？',
+            'context': {'license_plate': PLATE},
+        })
+
+        assert response.get_json()['data']['fast_path'] is False
+        mock_chat.assert_called_once()
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_disabled(self, mock_chat, app):
+        """INTENT_ROUTER_ENABLED=false では上流に問い合わせるテスト"""
+        app.config['INTENT_ROUTER_ENABLED'] = False
+        mock_chat.return_value = ChatCompletionResponse(content='応答', finish_reason='stop')
+
+        response = app.test_client().post('/papi/chat', json={
+            'message': '登録地はどこ？',
+            'context': {'license_plate': PLATE},
+        })
+
+        assert response.get_json()['data']['fast_path'] is False
+        mock_chat.assert_called_once()
@@ -0,0 +1,141 @@
+"""
+MCP Capture Tests
+
+上流とのやり取りの記録のテスト
+"""
+
+import json
+
+import httpx
+import pytest
+
+from app.services import qwen_mcp_client
+from app.services.mcp_capture import MCPCapture, anonymize, encode_record, mask_text, read_records
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError
+from benchmarks.mock_mcp_server import MockConfig, start_in_thread
+
+MESSAGE = '品川330あ1234の車検はいつまで？'
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    """記録を有効にした MCPCapture（QwenMCPClient から使われる）"""
+    recorder = MCPCapture()
+    recorder.configure(str(tmp_path / 'mcp.capture'))
+    monkeypatch.setattr(qwen_mcp_client, 'mcp_capture', recorder)
+    yield recorder
+    recorder.configure('')
+
+
+@pytest.fixture
+def mock_server():
+    server = start_in_thread(MockConfig(latency_ms=30))
+    yield server
+    server.shutdown()
+
+
+class TestAnonymize:
+    """匿名化のテスト"""
+
+    def test_mask_keeps_shape(self):
+        """文字種ごとに同じバイト長で置き換え、句読点と空白は残すテスト"""
+        masked = mask_text(MESSAGE + ' OK。')
+
+        assert masked == '〇〇000〇0000〇〇〇〇〇〇〇〇？ xx。'
+        assert len(masked.encode('utf-8')) == len((MESSAGE + ' OK。').encode('utf-8'))
+
+    def test_structure_kept(self):
+        """role・model・数値は残し、画像は長さだけにするテスト"""
+        payload = {
+            'model': 'qwen-vl-plus',
+            'max_tokens': 256,
+            'messages': [{'role': 'user', 'content': [
+                {'type': 'image_url', 'image_url': {'url': 'data:image/jpeg;base64,' + 'A' * 100}},
+                {'type': 'text', 'text': MESSAGE},
+            ]}],
+        }
+
+        result = anonymize(payload)
+
+        assert result['model'] == 'qwen-vl-plus' and result['max_tokens'] == 256
+        content = result['messages'][0]['content']
+        assert result['messages'][0]['role'] == 'user'
+        assert content[0]['image_url']['url'] == 'data:image/jpeg;base64,<100 chars>'
+        assert '品川' not in content[1]['text']
+
+
+class TestCapture:
+    """記録のテスト"""
+
+    def test_exchange_recorded(self, capture, mock_server):
+        """レスポンスとタイミングを匿名化して記録するテスト"""
+        client = QwenMCPClient(base_url=mock_server.url, api_key='secret-key')
+
+        result = client.chat([{'role': 'user', 'content': MESSAGE}])
+
+        assert result.content == MockConfig.content
+        [record] = read_records(capture.path)
+        assert record['status'] == 200 and record['model'] == 'qwen-plus'
+        assert record['path'] == '/v1/chat/completions'
+        assert record['ttfb_ms'] >= 25 and record['total_ms'] >= record['ttfb_ms']
+        assert record['chunks'] and record['chunks'][-1][0] <= record['total_ms']
+        response = json.loads(record['response'])
+        assert response['usage'] == result.usage
+        assert response['choices'][0]['message']['role'] == 'assistant'
+
+        raw = open(capture.path, 'rb').read()
+        for secret in ('secret-key', MESSAGE, MockConfig.content):
+            assert all(secret.encode('utf-8') not in r for r in (raw, json.dumps(record).encode('utf-8')))
+
+    def test_errors_recorded(self, capture):
+        """ステータスコードと接続エラーも記録するテスト"""
+        server = start_in_thread(MockConfig(latency_ms=0, error_rate=1.0, error_status=503))
+        try:
+            with pytest.raises(QwenMCPError):
+                QwenMCPClient(base_url=server.url, max_retries=0).chat([{'role': 'user', 'content': 'x'}])
+        finally:
+            server.shutdown()
+        with pytest.raises(QwenMCPError) as exc_info:
+            QwenMCPClient(base_url='http://127.0.0.1:1', max_retries=0).chat([{'role': 'user', 'content': 'x'}])
+
+        assert exc_info.value.code == 'CONNECTION_FAILED'
+        records = list(read_records(capture.path))
+        assert [r['status'] for r in records] == [503, 0]
+        assert records[1]['error'] == 'connect'
+
+    def test_streaming_chunks(self, capture, mock_server):
+        """SSEのチャンクごとの到着時刻を記録するテスト"""
+        with httpx.Client() as http:
+            response = capture.post(http, f"{mock_server.url}/v1/chat/completions",
+                                    {'model': 'qwen-plus', 'messages': [], 'stream': True}, {})
+
+        assert response.content.endswith(b'data: [DONE]\n\n')
+        [record] = read_records(capture.path)
+        assert 'text/event-stream' in record['content_type']
+        assert len(record['chunks']) > 2
+        assert record['chunks'][-1][0] - record['chunks'][0][0] >= 100
+        assert record['response'].count('data: ') == response.content.count(b'data: ')
+
+    def test_disabled_uses_plain_post(self, monkeypatch, mock_server):
+        """記録が無効なら何も書かないテスト"""
+        recorder = MCPCapture()
+        monkeypatch.setattr(qwen_mcp_client, 'mcp_capture', recorder)
+
+        QwenMCPClient(base_url=mock_server.url).chat([{'role': 'user', 'content': 'x'}])
+
+        assert recorder.should_capture() is False
+        assert recorder._fd is None
+
+
+class TestCaptureFile:
+    """記録ファイルのテスト"""
+
+    def test_corrupt_and_truncated_skipped(self, tmp_path):
+        """壊れたレコードと切れた末尾を読み飛ばすテスト"""
+        path = tmp_path / 'mcp.capture'
+        records = [encode_record({'v': 1, 'status': 200, 'n': i}) for i in range(3)]
+        broken = bytearray(records[1])
+        broken[-1] ^= 0xFF
+        path.write_bytes(records[0] + bytes(broken) + records[2] + records[0][:10])
+
+        assert [r['n'] for r in read_records(str(path))] == [0, 2]
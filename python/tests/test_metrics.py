@@ -0,0 +1,97 @@
+"""
+Metrics Tests
+"""
+
+from unittest.mock import patch, MagicMock
+from prometheus_client import REGISTRY
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError, ChatCompletionResponse
+
+
+def _sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _mock_httpx(mock_client_class, responses):
+    mock_client = MagicMock()
+    mock_client.post.side_effect = responses
+    mock_client.__enter__ = MagicMock(return_value=mock_client)
+    mock_client.__exit__ = MagicMock(return_value=False)
+    mock_client_class.return_value = mock_client
+
+
+def _response(status_code, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body or {}
+    return response
+
+
+class TestMetricsEndpoint:
+    """メトリクスエンドポイントのテスト"""
+
+    def test_metrics_endpoint(self, client):
+        """Prometheus形式で返すテスト"""
+        response = client.get('/papi/metrics')
+
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        body = response.get_data(as_text=True)
+        assert 'papi_http_requests_total' in body
+        assert 'papi_context_sessions' in body
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_request_counted_per_route(self, mock_chat, client):
+        """ルート・ステータス別にリクエストを数えるテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='応答', finish_reason='stop')
+        labels = {'route': '/papi/chat', 'method': 'POST', 'status': '200'}
+        before = _sample('papi_http_requests_total', labels)
+
+        client.post('/papi/chat', json={'message': 'テスト'})
+
+        assert _sample('papi_http_requests_total', labels) == before + 1
+        assert _sample('papi_http_request_duration_seconds_count', labels) >= 1
+
+    def test_metrics_disabled(self):
+        """METRICS_ENABLED=false の場合は登録しないテスト"""
+        from app import create_app
+
+        app = create_app({'TESTING': True, 'METRICS_ENABLED': False})
+
+        assert app.test_client().get('/papi/metrics').status_code == 404
+
+
+class TestUpstreamMetrics:
+    """上流呼び出しのメトリクスのテスト"""
+
+    @patch('httpx.Client')
+    def test_usage_tokens_recorded(self, mock_client_class):
+        """usage のトークン数を記録するテスト"""
+        _mock_httpx(mock_client_class, [_response(200, {
+            'choices': [{'message': {'content': '応答'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 30, 'completion_tokens': 12, 'total_tokens': 42},
+        })])
+        labels = {'model': 'qwen-plus', 'type': 'total_tokens'}
+        before = _sample('papi_llm_tokens_total', labels)
+
+        QwenMCPClient(base_url='http://localhost:8080').chat([{'role': 'user', 'content': 'テスト'}])
+
+        assert _sample('papi_llm_tokens_total', labels) == before + 42
+
+    @patch('time.sleep')
+    @patch('httpx.Client')
+    def test_retries_and_error_codes_recorded(self, mock_client_class, _sleep):
+        """リトライ回数とエラーコードを記録するテスト"""
+        _mock_httpx(mock_client_class, [_response(503), _response(503), _response(503)])
+        error_labels = {'model': 'qwen-plus', 'code': 'CONNECTION_FAILED'}
+        retry_labels = {'model': 'qwen-plus'}
+        errors_before = _sample('papi_upstream_errors_total', error_labels)
+        retries_before = _sample('papi_upstream_retries_total', retry_labels)
+
+        client = QwenMCPClient(base_url='http://localhost:8080', max_retries=2)
+        try:
+            client.chat([{'role': 'user', 'content': 'テスト'}])
+        except QwenMCPError:
+            pass
+
+        assert _sample('papi_upstream_errors_total', error_labels) == errors_before + 3
+        assert _sample('papi_upstream_retries_total', retry_labels) == retries_before + 2
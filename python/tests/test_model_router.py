@@ -0,0 +1,146 @@
+"""
+Model Router Tests
+
+チャットのモデルルーティングのテスト
+"""
+
+from unittest.mock import patch
+import json
+
+import pytest
+
+from app import create_app
+from app.services import metrics
+from app.services.model_router import FIXED_ROUTE, ModelRouter, extract_features, load_policy
+from app.services.qwen_mcp_client import QwenMCPClient, ChatCompletionResponse
+
+HISTORY = [{'role': 'user', 'content': '質問'}, {'role': 'assistant', 'content': '応答'}]
+
+
+def _sample(name, labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestFeatures:
+    """特徴抽出のテスト"""
+
+    def test_extract_features(self):
+        """メッセージ長・履歴の深さ・意図のテスト"""
+        features = extract_features('登録地の違いを詳しく教えて', HISTORY)
+
+        assert features.message_length == 13
+        assert features.history_depth == 2
+        assert features.intents == {'region', 'detail'}
+
+    def test_no_history(self):
+        assert extract_features('こんにちは').history_depth == 0
+
+
+class TestModelRouter:
+    """ルートの選択のテスト"""
+
+    def test_default_policy(self):
+        """既定のポリシーのテスト"""
+        router = ModelRouter()
+
+        assert router.select('レンタカー？').name == 'brief'
+        assert router.select('手続きの方法を教えて').name == 'detail'
+        # 上流で使えることが確認されているモデルだけを使い、既定の上限は従来のまま
+        assert {rule.route.model for rule in router.rules} == {'qwen-plus'}
+        assert router.select('あ' * 41).max_tokens == 2048
+        assert router.select('手続きの方法を教えて').name == 'detail'
+        assert router.select('あ' * 41).name == 'default'
+        assert router.select('それは？', HISTORY * 3).name == 'default'
+
+    def test_custom_policy(self):
+        """ポリシー表を差し替えるテスト"""
+        router = ModelRouter([
+            {'name': 'plate', 'intents': ['region', 'usage'], 'exclude_intents': ['detail'],
+             'model': 'qwen-turbo', 'max_tokens': 128},
+            {'name': 'other', 'model': 'qwen-max', 'max_tokens': 4096, 'temperature': 0.2},
+        ])
+
+        route = router.select('レンタカーですか')
+        assert (route.name, route.model, route.max_tokens, route.temperature) == ('plate', 'qwen-turbo', 128, 0.7)
+        assert router.select('レンタカーの理由は？').name == 'other'
+        assert router.select('こんにちは').temperature == 0.2
+
+    def test_disabled(self):
+        """無効時は従来の固定値を使うテスト"""
+        router = ModelRouter(enabled=False)
+
+        assert router.select('レンタカー？') == FIXED_ROUTE
+        assert (FIXED_ROUTE.model, FIXED_ROUTE.max_tokens) == ('qwen-plus', 2048)
+
+    @pytest.mark.parametrize('policy', [
+        [{'name': 'a', 'max_message_length': 10, 'model': 'm', 'max_tokens': 1}],
+        [{'name': 'a', 'model': 'm'}],
+        [{'name': 'a', 'intents': ['weather'], 'model': 'm', 'max_tokens': 1},
+         {'name': 'b', 'model': 'm', 'max_tokens': 1}],
+        [{'name': 'a', 'model': 'm', 'max_tokens': 0}],
+        [{'name': 'a', 'model': 'm', 'max_tokens': 1}, {'name': 'a', 'model': 'm', 'max_tokens': 1}],
+    ])
+    def test_invalid_policy(self, policy):
+        """不正なポリシーを拒否するテスト"""
+        with pytest.raises(ValueError):
+            ModelRouter(policy)
+
+    def test_load_policy(self, tmp_path):
+        """JSON文字列とファイルから読み込むテスト"""
+        policy = [{'name': 'only', 'model': 'qwen-turbo', 'max_tokens': 64}]
+        path = tmp_path / 'policy.json'
+        path.write_text(json.dumps(policy), encoding='utf-8')
+
+        assert load_policy('') is None
+        assert load_policy(json.dumps(policy)) == policy
+        assert load_policy(str(path)) == policy
+
+
+class TestChatModelRouting:
+    """/papi/chat のモデルルーティングのテスト"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_route_passed_to_upstream(self, mock_chat, client):
+        """選んだモデルと上限で上流を呼ぶテスト"""
+        mock_chat.return_value = ChatCompletionResponse(
+            content='はい', finish_reason='length',
+            usage={'prompt_tokens': 50, 'completion_tokens': 256, 'total_tokens': 306}
+        )
+        truncated = {'route': 'brief', 'model': 'qwen-plus', 'finish_reason': 'length'}
+        before = _sample('papi_model_route_requests_total', truncated)
+        tokens_before = _sample('papi_model_route_tokens_total', {'route': 'brief', 'type': 'completion_tokens'})
+
+        client.post('/papi/chat', json={'message': '車検は切れてる？'})
+
+        assert mock_chat.call_args.kwargs == {'model': 'qwen-plus', 'max_tokens': 256, 'temperature': 0.3}
+        assert _sample('papi_model_route_requests_total', truncated) == before + 1
+        assert _sample('papi_model_route_tokens_total',
+                       {'route': 'brief', 'type': 'completion_tokens'}) == tokens_before + 256
+        assert _sample('papi_model_route_duration_seconds_count', {'route': 'brief', 'model': 'qwen-plus'}) >= 1
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_routing_disabled(self, mock_chat):
+        """MODEL_ROUTING_ENABLED=false では従来の固定値を使うテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='はい', finish_reason='stop')
+        app = create_app({'TESTING': True, 'MODEL_ROUTING_ENABLED': False})
+
+        app.test_client().post('/papi/chat', json={'message': '車検は切れてる？'})
+        create_app({'TESTING': True})
+
+        assert mock_chat.call_args.kwargs == {'model': 'qwen-plus', 'max_tokens': 2048, 'temperature': 0.7}
+
+    @patch('httpx.Client')
+    def test_client_payload(self, mock_client_class):
+        """クライアントがモデルと上限をペイロードに含めるテスト"""
+        http = mock_client_class.return_value
+        http.post.return_value.status_code = 200
+        http.post.return_value.json.return_value = {
+            'choices': [{'message': {'content': '応答'}, 'finish_reason': 'stop'}],
+        }
+
+        QwenMCPClient(base_url='http://localhost:8080').chat(
+            [{'role': 'user', 'content': 'テスト'}], model='qwen-turbo', max_tokens=64, temperature=0.1
+        )
+
+        payload = http.post.call_args.kwargs['json']
+        assert (payload['model'], payload['max_tokens'], payload['temperature']) == ('qwen-turbo', 64, 0.1)
@@ -0,0 +1,79 @@
+"""
+Plate Index Tests
+
+ContextManager のナンバープレート索引のテスト
+"""
+
+import time
+
+import pytest
+
+from app.services.context_manager import ContextManager
+
+PLATE = {
+    'region': '品川',
+    'classification_number': '330',
+    'hiragana': 'あ',
+    'serial_number': '1234',
+    'full_text': '品川330あ1234',
+    'confidence': 95.5,
+}
+
+
+@pytest.fixture
+def manager():
+    return ContextManager()
+
+
+class TestPlateIndex:
+    """ContextManager のナンバープレート索引のテスト"""
+
+    def test_find_by_plate(self, manager):
+        """同じ車両のセッションを新しい順に返すテスト"""
+        first = manager.get_or_create('session-1')
+        first.set_license_plate(PLATE)
+        second = manager.get_or_create('session-2')
+        second.set_license_plate({'full_text': '品川３３０あ１２３４'})
+        manager.get_or_create('session-3').set_license_plate({'full_text': '横浜500さ5678'})
+
+        found = manager.find_by_plate('品川330あ1234')
+
+        assert [c.session_id for c in found] == ['session-2', 'session-1']
+
+    def test_plate_change_moves_session(self, manager):
+        """set_license_plate で別の車両に変わると索引も移るテスト"""
+        context = manager.get_or_create('session-1')
+        context.set_license_plate(PLATE)
+        context.set_license_plate({'full_text': '横浜500さ5678'})
+
+        assert manager.find_by_plate(PLATE) == []
+        assert [c.session_id for c in manager.find_by_plate('横浜500さ5678')] == ['session-1']
+        assert '品川330あ1234' not in manager._plate_index
+
+    def test_delete_removes_from_index(self, manager):
+        """削除したセッションが索引から外れるテスト"""
+        context = manager.get_or_create('session-1')
+        context.set_license_plate(PLATE)
+
+        assert manager.delete('session-1') is True
+        assert manager.find_by_plate(PLATE) == []
+        assert manager._plate_index == {}
+
+        # 削除後の古い参照から設定しても索引に戻らない
+        context.set_license_plate(PLATE)
+        assert manager.find_by_plate(PLATE) == []
+
+    def test_expired_sessions_removed(self, manager):
+        """期限切れのセッションが検索結果と索引から外れるテスト"""
+        manager.get_or_create('old').set_license_plate(PLATE)
+        manager.get_or_create('new').set_license_plate(PLATE)
+        manager._contexts['old'].updated_at = time.time() - ContextManager.SESSION_TIMEOUT - 1
+
+        assert [c.session_id for c in manager.find_by_plate(PLATE)] == ['new']
+        assert 'old' not in manager._contexts
+        assert manager._plate_index['品川330あ1234'] == {'new'}
+
+        manager._contexts['new'].updated_at = time.time() - ContextManager.SESSION_TIMEOUT - 1
+        manager._cleanup_expired()
+        assert manager._plate_index == {}
+
@@ -0,0 +1,136 @@
+"""
+Plate Registry Tests
+
+ナンバープレートの正規化と共有のテスト
+"""
+
+import dataclasses
+
+import pytest
+
+from app.models.chat import LicensePlateContext
+from app.services.context_manager import ConversationContext
+from app.services.plate_registry import PlateRegistry, canonical_key, normalize_plate
+
+PLATE = {
+    'region': '品川',
+    'classification_number': '330',
+    'hiragana': 'あ',
+    'serial_number': '1234',
+    'full_text': '品川330あ1234',
+    'confidence': 95.5,
+}
+
+
+class TestNormalizePlate:
+    """正規化のテスト"""
+
+    def test_fields(self):
+        """全角数字・半角カナ・区切り文字を正規化し、full_text を組み立てるテスト"""
+        plate = normalize_plate({
+            'region': '品川', 'classification_number': '３３０', 'hiragana': 'ｱ',
+            'serial_number': '12-34', 'full_text': '品川330ア12-34', 'confidence': 90.0,
+        })
+
+        assert plate == LicensePlateContext(
+            region='品川', classification_number='330', hiragana='あ',
+            serial_number='1234', full_text='品川330あ1234',
+        )
+
+    def test_full_text_only(self):
+        """フィールドが揃っていなければ full_text を正規化するテスト"""
+        assert canonical_key('品川 330 ア ・・12') == '品川330あ12'
+        assert canonical_key({'full_text': '品川３３０あ１２３４'}) == '品川330あ1234'
+        assert canonical_key({'region': '品川', 'full_text': '品川330あ1234'}) == '品川330あ1234'
+        assert canonical_key(PLATE) == '品川330あ1234'
+
+    def test_classification_letters(self):
+        """分類番号の英字を大文字にそろえるテスト"""
+        assert canonical_key({**PLATE, 'classification_number': '３０ａ'}) == '品川30Aあ1234'
+
+    def test_unknown_plate(self):
+        """特定できないナンバープレートのテスト"""
+        assert canonical_key(None) is None
+        assert canonical_key({'region': '品川'}) is None
+        assert canonical_key('  ') is None
+
+
+class TestPlateRegistry:
+    """共有レジストリのテスト"""
+
+    def test_same_vehicle_shared(self):
+        """表記揺れがあっても同じインスタンスを返すテスト"""
+        registry = PlateRegistry()
+
+        a = registry.intern(PLATE)
+        b = registry.intern({**PLATE, 'classification_number': '３３０', 'confidence': 50.0})
+
+        assert a is b
+        assert a.confidence is None
+        assert len(registry) == 1
+
+    def test_strings_interned_across_vehicles(self):
+        """地名などの文字列が異なる車両の間で共有されるテスト"""
+        registry = PlateRegistry()
+
+        a = registry.intern(PLATE)
+        b = registry.intern({**PLATE, 'serial_number': '5678', 'full_text': ''})
+
+        assert a is not b
+        assert a.region is b.region
+        assert a.hiragana is b.hiragana
+
+    def test_immutable(self):
+        """共有インスタンスが変更できないテスト"""
+        plate = PlateRegistry().intern(PLATE)
+
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            plate.region = '横浜'
+
+    def test_upgrade_to_complete_fields(self):
+        """full_text だけで登録された車両をフィールドの揃ったもので置き換えるテスト"""
+        registry = PlateRegistry()
+
+        partial = registry.intern('品川330あ1234')
+        complete = registry.intern(PLATE)
+
+        assert partial.region is None
+        assert complete.region == '品川'
+        assert registry.intern('品川３３０あ１２３４') is complete
+
+    def test_max_entries(self):
+        """上限を超えたら最も古い車両だけ外すテスト（既存の参照は有効）"""
+        registry = PlateRegistry(max_entries=2)
+
+        first = registry.intern('品川330あ0001')
+        second = registry.intern('品川330あ0002')
+        registry.intern('品川330あ0003')
+
+        assert len(registry) == 2
+        assert registry.get('品川330あ0001') is None
+        assert registry.get('品川330あ0002') is second
+        assert registry.intern('品川330あ0002') is second
+        assert first.full_text == '品川330あ0001'
+
+
+class TestSessionPlates:
+    """セッションからの参照のテスト"""
+
+    def test_sessions_share_plate(self):
+        """セッションが共有インスタンスを参照し、信頼度はセッションごとに持つテスト"""
+        a = ConversationContext(session_id='a')
+        b = ConversationContext(session_id='b')
+        a.set_license_plate(PLATE)
+        b.set_license_plate({**PLATE, 'hiragana': 'ア', 'confidence': 80.0})
+
+        assert a.license_plate is b.license_plate
+        assert a.plate_to_dict()['confidence'] == 95.5
+        assert b.plate_to_dict()['confidence'] == 80.0
+        assert b.to_dict()['license_plate']['hiragana'] == 'あ'
+
+    def test_constructor_accepts_dict(self):
+        """コンストラクタに辞書を渡しても共有インスタンスになるテスト"""
+        context = ConversationContext(session_id='a', license_plate=PLATE)
+
+        assert isinstance(context.license_plate, LicensePlateContext)
+        assert context.plate_confidence == 95.5
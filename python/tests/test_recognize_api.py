@@ -0,0 +1,186 @@
+"""
+Recognize API Tests
+"""
+
+import io
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError, ChatCompletionResponse
+from app.services.plate_recognizer import PlateRecognizer, parse_recognition, plate_recognizer
+
+PLATE_JSON = (
+    '{"detected": true, "region": "品川", "classification_number": "330", '
+    '"hiragana": "あ", "serial_number": "1234", "confidence": 95.5}'
+)
+IMAGE = b'\xff\xd8\xff\xe0' + b'\x00' * 128
+
+
+@pytest.fixture(autouse=True)
+def clear_recognizer():
+    """テスト間で認識キャッシュを共有しない"""
+    plate_recognizer.clear()
+    yield
+    plate_recognizer.clear()
+
+
+class TestRecognizeEndpoint:
+    """Recognize API エンドポイントのテスト"""
+
+    @patch.object(QwenMCPClient, 'recognize_license_plate')
+    def test_recognize_raw_body(self, mock_recognize, client):
+        """画像バイナリ本文での認識テスト"""
+        mock_recognize.return_value = ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['success'] is True
+        assert data['data']['detected'] is True
+        assert data['data']['license_plate']['full_text'] == '品川330あ1234'
+        assert data['data']['source'] == 'upstream'
+
+        args = mock_recognize.call_args[0]
+        assert bytes(args[0]) == IMAGE
+        assert args[1] == 'image/jpeg'
+
+    @patch.object(QwenMCPClient, 'recognize_license_plate')
+    def test_recognize_multipart(self, mock_recognize, client):
+        """multipart/form-data での認識テスト"""
+        mock_recognize.return_value = ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+
+        response = client.post('/papi/recognize', data={
+            'image': (io.BytesIO(IMAGE), 'plate.png', 'image/png'),
+        }, content_type='multipart/form-data')
+
+        assert response.status_code == 200
+        assert response.get_json()['data']['detected'] is True
+        assert mock_recognize.call_args[0][1] == 'image/png'
+
+    @patch.object(QwenMCPClient, 'recognize_license_plate')
+    def test_recognize_cached(self, mock_recognize, client):
+        """同一画像はキャッシュから返されるテスト"""
+        mock_recognize.return_value = ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+
+        client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+
+        assert response.get_json()['data']['source'] == 'cache'
+        assert mock_recognize.call_count == 1
+
+    @patch.object(QwenMCPClient, 'recognize_license_plate')
+    def test_recognize_not_detected(self, mock_recognize, client):
+        """ナンバープレートが検出されない場合のテスト"""
+        mock_recognize.return_value = ChatCompletionResponse(
+            content='{"detected": false}', finish_reason='stop'
+        )
+
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['data']['detected'] is False
+        assert data['data']['license_plate'] is None
+
+    def test_recognize_unsupported_media_type(self, client):
+        """未対応のContent-Typeのテスト"""
+        response = client.post('/papi/recognize', data='text', content_type='text/plain')
+
+        assert response.status_code == 415
+        assert response.get_json()['error']['code'] == 'UNSUPPORTED_MEDIA_TYPE'
+
+    def test_recognize_empty_body(self, client):
+        """空の画像のテスト"""
+        response = client.post('/papi/recognize', data=b'', content_type='image/jpeg')
+
+        assert response.status_code == 400
+        assert response.get_json()['error']['code'] == 'INVALID_REQUEST'
+
+    def test_recognize_too_large(self, app, client):
+        """画像サイズ上限のテスト"""
+        app.config['RECOGNIZE_MAX_IMAGE_BYTES'] = 64
+
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+
+        assert response.status_code == 413
+        assert response.get_json()['error']['code'] == 'PAYLOAD_TOO_LARGE'
+
+    @patch.object(QwenMCPClient, 'recognize_license_plate')
+    def test_recognize_upstream_error(self, mock_recognize, client):
+        """上流エラーのテスト（エラーはキャッシュしない）"""
+        mock_recognize.side_effect = QwenMCPError.timeout('リクエストがタイムアウトしました')
+
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+        assert response.status_code == 504
+
+        mock_recognize.side_effect = None
+        mock_recognize.return_value = ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+        response = client.post('/papi/recognize', data=IMAGE, content_type='image/jpeg')
+        assert response.status_code == 200
+        assert response.get_json()['data']['source'] == 'upstream'
+
+
+class TestPlateRecognizer:
+    """PlateRecognizer のテスト"""
+
+    def test_concurrent_requests_coalesced(self):
+        """同時の同一画像リクエストが1回の上流呼び出しに集約されるテスト"""
+        recognizer = PlateRecognizer()
+        started = threading.Event()
+        calls = []
+
+        class SlowClient:
+            def recognize_license_plate(self, image, mime_type, prompt):
+                calls.append(image)
+                started.set()
+                time.sleep(0.1)
+                return ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+
+        results = []
+
+        def worker():
+            results.append(recognizer.recognize(IMAGE, 'hash', 'image/jpeg', SlowClient()))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        sources = sorted(source for _, source in results)
+        assert sources == ['coalesced'] * 4 + ['upstream']
+        assert all(plate.full_text == '品川330あ1234' for plate, _ in results)
+
+    def test_ttl_expiry(self):
+        """TTL経過後は再度上流を呼ぶテスト"""
+        recognizer = PlateRecognizer(ttl=0)
+
+        class Client:
+            calls = 0
+
+            def recognize_license_plate(self, image, mime_type, prompt):
+                Client.calls += 1
+                return ChatCompletionResponse(content=PLATE_JSON, finish_reason='stop')
+
+        recognizer.recognize(IMAGE, 'hash', 'image/jpeg', Client())
+        recognizer.recognize(IMAGE, 'hash', 'image/jpeg', Client())
+
+        assert Client.calls == 2
+
+    def test_parse_recognition_with_extra_text(self):
+        """JSON前後に余分なテキストがある応答のパーステスト"""
+        plate = parse_recognition(f'結果:\n{PLATE_JSON}\n以上')
+
+        assert plate.region == '品川'
+        assert plate.confidence == 95.5
+
+    def test_parse_recognition_missing_fields(self):
+        """必須フィールドが欠けた応答のパーステスト"""
+        assert parse_recognition('{"detected": true, "region": "品川"}') is None
+        assert parse_recognition('認識できません') is None
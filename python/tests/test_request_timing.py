@@ -0,0 +1,136 @@
+"""
+Request Timing Tests
+"""
+
+import logging
+import threading
+import time
+
+from unittest.mock import patch
+from app import create_app
+from app.services import request_timing
+from app.services.qwen_mcp_client import QwenMCPClient, ChatCompletionResponse
+
+
+class TestServerTiming:
+    """Server-Timing ヘッダーのテスト"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_chat_phases(self, mock_chat, client):
+        """チャットの各フェーズがヘッダーに含まれるテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='応答', finish_reason='stop')
+
+        response = client.post('/papi/chat', json={'message': 'テスト'})
+
+        header = response.headers['Server-Timing']
+        names = [part.split(';')[0].strip() for part in header.split(',')]
+        assert names == ['parse', 'validate', 'build', 'upstream', 'serialize', 'total']
+
+    def test_validation_error_has_partial_phases(self, client):
+        """バリデーションエラーでも計測済みのフェーズを返すテスト"""
+        response = client.post('/papi/chat', json={'message': 12345})
+
+        assert response.status_code == 422
+        assert 'validate;dur=' in response.headers['Server-Timing']
+
+    def test_disabled(self):
+        """SERVER_TIMING_ENABLED=false の場合はヘッダーを付けないテスト"""
+        app = create_app({'TESTING': True, 'SERVER_TIMING_ENABLED': False})
+
+        response = app.test_client().get('/papi/health')
+
+        assert 'Server-Timing' not in response.headers
+
+    def test_phase_outside_request(self):
+        """リクエスト外では何もしないテスト"""
+        with request_timing.phase('noop'):
+            pass
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_json_log(self, mock_chat, caplog):
+        """構造化ログ出力のテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='応答', finish_reason='stop')
+        app = create_app({'TESTING': True, 'TIMING_LOG_JSON': True})
+
+        with caplog.at_level(logging.INFO, logger='app.services.request_timing'):
+            app.test_client().post('/papi/chat', json={'message': 'テスト'})
+
+        records = [r for r in caplog.records if 'request_timing' in r.getMessage()]
+        assert records and 'upstream' in records[0].fields['phases_ms']
+        assert records[0].request_id
+
+
+class TestSlowRequestDiagnostics:
+    """遅いリクエストの診断のテスト"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_slow_request_stack_dump(self, mock_chat, caplog):
+        """閾値を超えたリクエストのスタックを記録するテスト"""
+        def slow_chat(messages, **kwargs):
+            time.sleep(0.2)
+            return ChatCompletionResponse(content='応答', finish_reason='stop')
+
+        mock_chat.side_effect = slow_chat
+        app = create_app({'TESTING': True, 'SLOW_REQUEST_THRESHOLD_MS': 50})
+
+        with caplog.at_level(logging.WARNING, logger='app.services.request_timing'):
+            app.test_client().post('/papi/chat', json={'message': 'テスト'})
+
+        dumps = [r.getMessage() for r in caplog.records if 'Slow request' in r.getMessage()]
+        assert dumps and 'slow_chat' in dumps[0]
+
+    def test_watchdog_threads_do_not_pile_up(self):
+        """アプリを作り直しても監視スレッドは1本だけ動くテスト"""
+        for _ in range(3):
+            app = create_app({'TESTING': True, 'SLOW_REQUEST_THRESHOLD_MS': 50})
+            app.test_client().get('/papi/health')
+        time.sleep(0.1)
+
+        watchdogs = [t for t in threading.enumerate() if t.name == 'slow-request-watchdog']
+        assert len(watchdogs) == 1
+
+        request_timing.slow_request_watchdog.stop()
+        watchdogs[0].join(1)
+        assert not watchdogs[0].is_alive()
+
+    def test_watchdog_restarts_in_forked_process(self):
+        """fork 後のプロセス（pid が変わった）では最初のリクエストで監視スレッドを開始するテスト"""
+        watchdog = request_timing.SlowRequestWatchdog()
+        watchdog.configure(0.05)
+        watchdog.begin('/papi/chat')
+        watchdog.end()
+
+        with patch('app.services.request_timing.os.getpid', return_value=-1), \
+                patch('app.services.request_timing.threading.Thread') as thread:
+            watchdog.begin('/papi/chat')
+
+        thread.return_value.start.assert_called_once()
+        watchdog.stop()
+
+    def test_profile_written_for_slow_request(self, tmp_path):
+        """サンプリングしたリクエストの cProfile を保存するテスト"""
+        app = create_app({
+            'TESTING': True,
+            'PROFILE_SAMPLE_RATE': 1.0,
+            'SLOW_REQUEST_THRESHOLD_MS': 0,
+            'PROFILE_DIR': str(tmp_path),
+        })
+
+        app.test_client().get('/papi/health')
+
+        assert list(tmp_path.glob('*.prof'))
+
+    def test_profile_skipped_when_profiler_active(self, tmp_path):
+        """他のプロファイラが有効なときはプロファイルせずに応答するテスト"""
+        app = create_app({
+            'TESTING': True,
+            'PROFILE_SAMPLE_RATE': 1.0,
+            'SLOW_REQUEST_THRESHOLD_MS': 0,
+            'PROFILE_DIR': str(tmp_path),
+        })
+
+        with patch('cProfile.Profile.enable', side_effect=ValueError('Another profiling tool is already active')):
+            response = app.test_client().get('/papi/health')
+
+        assert response.status_code == 200
+        assert not list(tmp_path.glob('*.prof'))
@@ -0,0 +1,403 @@
+"""
+Semantic Cache Tests
+
+チャット応答の意味的キャッシュのテスト
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+import threading
+
+from app import create_app
+from app.services.qwen_mcp_client import QwenMCPClient, QwenMCPError, ChatCompletionResponse
+from app.services.revalidator import Revalidator, revalidator
+from app.services import semantic_cache as semantic_cache_module
+from app.services.semantic_cache import HashedNgramVectorizer, SemanticCache, extract_entities, semantic_cache
+from app.services.upstream_scheduler import current_request_class
+
+PLATE = {
+    'region': '品川',
+    'classification_number': '330',
+    'hiragana': 'あ',
+    'serial_number': '1234',
+    'full_text': '品川330あ1234',
+    'confidence': 95.5,
+}
+
+
+def similarity(a: str, b: str) -> float:
+    vectorizer = HashedNgramVectorizer()
+    x, y = vectorizer.transform(a), vectorizer.transform(b)
+    return sum(value * y.get(index, 0.0) for index, value in x.items())
+
+
+class TestVectorizer:
+    """埋め込みのテスト"""
+
+    def test_paraphrase_is_similar(self):
+        """表記・文末表現の違いを吸収するテスト"""
+        assert similarity('登録地はどこ？', '登録地はどこですか') == pytest.approx(1.0)
+        assert similarity('ナンバーの地域は？', 'なんばーの地域はどこ') > 0.85
+
+    def test_different_question_is_not_similar(self):
+        """別の質問は閾値を下回るテスト"""
+        assert similarity('登録地はどこ？', '車検はいつ？') < 0.3
+
+    def test_empty(self):
+        """特徴が無いテキストは空ベクトルになるテスト"""
+        assert HashedNgramVectorizer().transform('？！ ') == {}
+
+
+class TestSemanticCache:
+    """キャッシュのテスト"""
+
+    def test_hit_and_miss(self):
+        """言い換えはヒットし、別の質問はミスになるテスト"""
+        cache = SemanticCache()
+        cache.store('品川330あ1234', '登録地はどこ？', '東京都品川区です')
+
+        hit = cache.lookup('品川330あ1234', '登録地はどこですか')
+        assert hit is not None
+        assert hit.response == '東京都品川区です'
+        assert hit.matched_text == '登録地はどこ？'
+        assert cache.lookup('品川330あ1234', '車検はいつ？') is None
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 1
+
+    def test_scoped_by_plate(self):
+        """別のナンバープレートの応答は返さないテスト"""
+        cache = SemanticCache()
+        cache.store('品川330あ1234', '登録地はどこ？', '東京都品川区です')
+
+        assert cache.lookup('横浜300さ5678', '登録地はどこ？') is None
+        assert cache.lookup('', '登録地はどこ？') is None
+
+    def test_best_match(self):
+        """最も類似度の高いエントリを返すテスト"""
+        cache = SemanticCache(threshold=0.5)
+        cache.store('', '登録地はどこ？', '登録地の応答')
+        cache.store('', '車検はいつ？', '車検の応答')
+
+        assert cache.lookup('', '車検はいつですか').response == '車検の応答'
+
+    def test_ttl(self):
+        """有効期限切れのエントリを返さず削除するテスト"""
+        cache = SemanticCache(ttl=60)
+        with patch('app.services.semantic_cache.time.monotonic', return_value=1000.0):
+            cache.store('', '登録地はどこ？', '東京都品川区です')
+        with patch('app.services.semantic_cache.time.monotonic', return_value=1061.0):
+            assert cache.lookup('', '登録地はどこ？') is None
+        assert len(cache) == 0
+
+    def test_stale_states(self):
+        """ttl 後は stale_while_revalidate・stale_if_error の期間だけ残すテスト"""
+        cache = SemanticCache(ttl=60, stale_while_revalidate=30, stale_if_error=300)
+        with patch('app.services.semantic_cache.time.monotonic', return_value=1000.0):
+            cache.store('', '登録地はどこ？', '東京都品川区です')
+
+        states = []
+        for now in (1059.0, 1070.0, 1200.0, 1361.0):
+            with patch('app.services.semantic_cache.time.monotonic', return_value=now):
+                hit = cache.lookup('', '登録地はどこ？')
+            states.append(hit.state if hit else None)
+
+        assert states == ['fresh', 'revalidate', 'stale', None]
+        assert len(cache) == 0
+        assert cache.stats['stale'] == 2
+
+    def test_store_replaces_same_question(self):
+        """同じ質問を格納し直すと古いエントリを置き換えるテスト"""
+        cache = SemanticCache()
+        cache.store('', '登録地はどこ？', '古い応答')
+        cache.store('', '登録地はどこですか', '新しい応答')
+
+        assert len(cache) == 1
+        assert cache.lookup('', '登録地はどこ？').response == '新しい応答'
+
+    def test_lru_eviction(self):
+        """上限を超えたら最も使われていないエントリから削除するテスト"""
+        cache = SemanticCache(max_entries=2)
+        cache.store('', '登録地はどこ？', 'a')
+        cache.store('', '車検はいつ？', 'b')
+        assert cache.lookup('', '登録地はどこ？') is not None
+
+        cache.store('', '所有者は誰？', 'c')
+
+        assert len(cache) == 2
+        assert cache.lookup('', '車検はいつ？') is None
+        assert cache.lookup('', '登録地はどこ？') is not None
+
+    def test_record_sample(self):
+        """上流の応答との照合で誤ヒットを記録するテスト"""
+        cache = SemanticCache()
+        cache.store('', '登録地はどこ？', '東京都品川区です')
+        hit = cache.lookup('', '登録地はどこ？')
+
+        assert cache.record_sample(hit, '東京都品川区です') is False
+        assert cache.record_sample(hit, '車検は来年の3月です') is True
+        assert cache.stats['samples'] == 2
+        assert cache.stats['mismatches'] == 1
+
+    def test_numpy_loaded_lazily(self):
+        """NumPy の有無は最初の格納時に判定するテスト"""
+        cache = SemanticCache()
+        assert cache.backend == 'unloaded'
+
+        cache.store('', '登録地はどこ？', 'a')
+
+        assert cache.backend in ('numpy', 'python')
+
+    def test_entities_must_match(self):
+        """地名・数字が違う質問は、文字 n-gram が似ていてもヒットしないテスト"""
+        cache = SemanticCache()
+        question = '品川ナンバーの車はどこの都道府県で登録されたものか教えてください'
+        cache.store('', question, '東京都です')
+        cache.store('', '品川330あ1234の登録地は？', '東京都品川区です')
+
+        assert similarity(question, question.replace('品川', '練馬')) > cache.threshold
+        assert cache.lookup('', question.replace('品川', '練馬')) is None
+        assert cache.lookup('', '品川330あ1235の登録地は？') is None
+        assert cache.lookup('', '品川330い1234の登録地は？') is None
+        assert cache.lookup('', '品川 330 あ 1234 の登録地はどこ？').response == '東京都品川区です'
+
+    def test_extract_entities(self):
+        assert extract_entities('品川330あ1234の登録地は？') == ('1234', '330', 'あ', '品川')
+        assert extract_entities('練馬と品川のナンバーの違い') == extract_entities('品川と練馬のナンバーの違い')
+        assert extract_entities('登録地はどこ？') == ()
+
+
+class TestBackends:
+    """NumPy と純 Python の類似度計算のテスト"""
+
+    QUESTIONS = ['登録地はどこ？', '車検はいつ？', '分類番号の意味は？', '品川330あ1234の登録地は？']
+    QUERIES = ['登録地はどこですか', '車検はいつですか', '分類番号の意味はなに', '品川330あ1234の登録地はどこ', '天気は？']
+
+    def _run(self, monkeypatch, numpy):
+        monkeypatch.setattr(semantic_cache_module, '_load_numpy', lambda: numpy)
+        cache = SemanticCache()
+        for i, question in enumerate(self.QUESTIONS):
+            cache.store('', question, f'a{i}')
+        cache.store('品川330あ1234', '登録地はどこ？', 'plate')
+        results = []
+        for query in self.QUERIES:
+            hit = cache.lookup('', query)
+            results.append(None if hit is None else (hit.response, round(hit.similarity, 5)))
+        return cache.backend, results
+
+    def test_python_backend(self, monkeypatch):
+        backend, results = self._run(monkeypatch, None)
+
+        assert backend == 'python'
+        assert [r and r[0] for r in results] == ['a0', 'a1', 'a2', 'a3', None]
+
+    def test_numpy_matches_python(self, monkeypatch):
+        """NumPy の行列計算が純 Python と同じ結果を返すテスト"""
+        numpy = pytest.importorskip('numpy')
+
+        python_backend, expected = self._run(monkeypatch, None)
+        numpy_backend, results = self._run(monkeypatch, numpy)
+
+        assert (python_backend, numpy_backend) == ('python', 'numpy')
+        assert [r and r[0] for r in results] == [r and r[0] for r in expected]
+        for result, reference in zip(results, expected):
+            if result is not None:
+                assert result[1] == pytest.approx(reference[1], abs=1e-4)
+
+
+@pytest.fixture
+def cached_client():
+    app = create_app({
+        'TESTING': True,
+        'QWEN_MCP_URL': 'http://localhost:8080',
+        'QWEN_API_KEY': 'test_api_key',
+        'SEMANTIC_CACHE_ENABLED': True,
+        'INTENT_ROUTER_ENABLED': False,
+    })
+    semantic_cache.clear()
+    yield app.test_client()
+    semantic_cache.clear()
+
+
+class TestChatSemanticCache:
+    """/papi/chat の意味的キャッシュのテスト"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_paraphrase_served_from_cache(self, mock_chat, cached_client):
+        """言い換えた質問は上流を呼ばずに返すテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='東京都品川区です', finish_reason='stop')
+
+        first = cached_client.post('/papi/chat', json={
+            'message': '登録地はどこ？', 'context': {'license_plate': PLATE}
+        })
+        second = cached_client.post('/papi/chat', json={
+            'message': '登録地はどこですか', 'context': {'license_plate': PLATE}
+        })
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.get_json()['data']['response'] == '東京都品川区です'
+        assert mock_chat.call_count == 1
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_other_plate_not_served(self, mock_chat, cached_client):
+        """別のナンバープレートでは上流を呼ぶテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='東京都品川区です', finish_reason='stop')
+
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？', 'context': {'license_plate': PLATE}})
+        response = cached_client.post('/papi/chat', json={
+            'message': '登録地はどこ？',
+            'context': {'license_plate': {**PLATE, 'region': '横浜', 'full_text': '横浜330あ1234'}},
+        })
+
+        assert response.headers['X-Cache'] == 'MISS'
+        assert mock_chat.call_count == 2
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_history_bypasses_cache(self, mock_chat, cached_client):
+        """会話履歴のあるリクエストはキャッシュしないテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='はい', finish_reason='stop')
+        payload = {
+            'message': 'それは本当？',
+            'context': {'conversation_history': [{'role': 'user', 'content': '登録地はどこ？'}]},
+        }
+
+        cached_client.post('/papi/chat', json=payload)
+        response = cached_client.post('/papi/chat', json=payload)
+
+        assert 'X-Cache' not in response.headers
+        assert mock_chat.call_count == 2
+        assert len(semantic_cache) == 0
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_truncated_response_not_stored(self, mock_chat, cached_client):
+        """途中で打ち切られた応答はキャッシュしないテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='東京都', finish_reason='length')
+
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert len(semantic_cache) == 0
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_sampled_hit_returns_upstream_response(self, mock_chat, cached_client):
+        """照合対象のヒットは上流の応答を返して比較するテスト"""
+        mock_chat.side_effect = [
+            ChatCompletionResponse(content='東京都品川区です', finish_reason='stop'),
+            ChatCompletionResponse(content='車検は来年の3月です', finish_reason='stop'),
+        ]
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        with patch.object(semantic_cache, 'sample_rate', 1.0):
+            response = cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert response.get_json()['data']['response'] == '車検は来年の3月です'
+        assert semantic_cache.stats['mismatches'] == 1
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_disabled_by_default(self, mock_chat, client):
+        """既定では無効なテスト"""
+        mock_chat.return_value = ChatCompletionResponse(content='東京都品川区です', finish_reason='stop')
+
+        client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        response = client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert 'X-Cache' not in response.headers
+        assert mock_chat.call_count == 2
+
+
+def age_entries(seconds: float) -> None:
+    """キャッシュのエントリを古くする"""
+    for entry in semantic_cache._entries.values():
+        entry.stored_at -= seconds
+
+
+class TestStaleWhileRevalidate:
+    """/papi/chat の古い応答の扱いのテスト（ttl 600秒、取り直し60秒、失敗時1800秒）"""
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_stale_served_while_revalidating(self, mock_chat, cached_client):
+        """古い応答をすぐに返し、裏で取り直すテスト"""
+        mock_chat.side_effect = [
+            ChatCompletionResponse(content='古い応答', finish_reason='stop'),
+            ChatCompletionResponse(content='新しい応答', finish_reason='stop'),
+        ]
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        age_entries(630)
+
+        response = cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        assert revalidator.wait(5)
+        refreshed = cached_client.post('/papi/chat', json={'message': '登録地はどこですか'})
+
+        data = response.get_json()['data']
+        assert (data['response'], data['stale'], response.headers['X-Cache']) == ('古い応答', True, 'STALE')
+        assert mock_chat.call_count == 2
+        data = refreshed.get_json()['data']
+        assert (data['response'], data['stale'], refreshed.headers['X-Cache']) == ('新しい応答', False, 'HIT')
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_stale_served_on_upstream_error(self, mock_chat, cached_client):
+        """上流が失敗したら古い応答を返すテスト（リトライしない）"""
+        mock_chat.side_effect = [
+            ChatCompletionResponse(content='古い応答', finish_reason='stop'),
+            QwenMCPError.timeout('タイムアウト'),
+        ]
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        age_entries(1200)
+
+        response = cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert response.status_code == 200
+        data = response.get_json()['data']
+        assert (data['response'], data['stale']) == ('古い応答', True)
+        assert mock_chat.call_args.kwargs['max_retries'] == 0
+
+    @patch.object(QwenMCPClient, 'chat')
+    def test_staleness_bounded(self, mock_chat, cached_client):
+        """失敗時に返す期間を過ぎた応答は返さないテスト"""
+        mock_chat.side_effect = [
+            ChatCompletionResponse(content='古い応答', finish_reason='stop'),
+            QwenMCPError.timeout('タイムアウト'),
+        ]
+        cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+        age_entries(2500)
+
+        response = cached_client.post('/papi/chat', json={'message': '登録地はどこ？'})
+
+        assert response.status_code == 504
+        assert len(semantic_cache) == 0
+
+
+class TestRevalidator:
+    """取り直しの実行のテスト"""
+
+    def test_concurrency_and_duplicates(self):
+        """同じキーは1件、同時実行数の上限を超えたら取り直さないテスト"""
+        pool = Revalidator(max_concurrency=1)
+        release = threading.Event()
+        classes = []
+
+        def refresh():
+            classes.append(current_request_class())
+            release.wait(5)
+
+        assert pool.submit('a', refresh) is True
+        assert pool.submit('a', refresh) is False
+        assert pool.submit('b', refresh) is False
+        release.set()
+        assert pool.wait(5)
+
+        assert classes == ['bulk']
+        assert pool.submit('b', lambda: None) is True
+        assert pool.wait(5)
+
+    def test_failure_releases_key(self):
+        """失敗しても次の取り直しができるテスト"""
+        pool = Revalidator()
+
+        def fail():
+            raise QwenMCPError.timeout('タイムアウト')
+
+        assert pool.submit('a', fail) is True
+        assert pool.wait(5)
+        assert pool.inflight == 0
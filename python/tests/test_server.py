@@ -0,0 +1,115 @@
+"""
+Production Server Tests
+"""
+
+import json
+import os
+import threading
+
+import pytest
+from server import WORKER_CLASSES, build_options, default_workers, post_fork
+
+
+class TestServerOptions:
+    """本番サーバー設定のテスト"""
+
+    def test_defaults(self):
+        """既定はgthreadでコア数からワーカー数を算出するテスト"""
+        options = build_options({}, cpu_count=4)
+
+        assert options['worker_class'] == 'gthread'
+        assert options['workers'] == 4
+        assert options['threads'] == 8
+        assert options['preload_app'] is True
+        assert options['bind'] == '0.0.0.0:5000'
+        assert options['max_requests_jitter'] == options['max_requests'] // 10
+
+    def test_timeout_covers_upstream_retries(self):
+        """ワーカーのタイムアウトが上流のリトライ上限より長いテスト"""
+        from app.services.qwen_mcp_client import QwenMCPClient
+
+        budget = QwenMCPClient.DEFAULT_TIMEOUT * (QwenMCPClient.MAX_RETRIES + 1)
+
+        assert build_options({}, cpu_count=1)['timeout'] > budget
+
+    def test_sync_workers(self):
+        """syncワーカーは 2 * コア数 + 1 のテスト"""
+        assert default_workers('sync', 4) == 9
+        assert 'threads' not in build_options({'SERVER_WORKER_CLASS': 'sync'}, cpu_count=4)
+
+    def test_single_core_has_two_workers(self):
+        """1コアでも再起動中に受け付けられるよう2ワーカー以上のテスト"""
+        assert default_workers('gthread', 1) == 2
+
+    def test_env_overrides(self):
+        """環境変数での上書きテスト"""
+        options = build_options({
+            'SERVER_WORKER_CLASS': 'uvicorn',
+            'WEB_CONCURRENCY': '3',
+            'FLASK_HOST': '127.0.0.1',
+            'FLASK_PORT': '8000',
+            'GUNICORN_MAX_REQUESTS': '0',
+        }, cpu_count=8)
+
+        assert options['worker_class'] == WORKER_CLASSES['uvicorn']
+        assert options['workers'] == 3
+        assert options['bind'] == '127.0.0.1:8000'
+        assert options['max_requests'] == 0
+
+    def test_invalid_worker_class(self):
+        """不正なワーカークラスのテスト"""
+        with pytest.raises(ValueError) as exc_info:
+            build_options({'SERVER_WORKER_CLASS': 'eventlet'})
+
+        assert 'SERVER_WORKER_CLASS' in str(exc_info.value)
+
+    def test_invalid_number(self):
+        """不正な数値のテスト"""
+        with pytest.raises(ValueError):
+            build_options({'WEB_CONCURRENCY': 'many'})
+        with pytest.raises(ValueError):
+            build_options({'WEB_CONCURRENCY': '0'})
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork が使えない環境')
+class TestPreforkWorker:
+    """preload したアプリを fork したワーカーのテスト"""
+
+    def test_background_threads_run_in_forked_worker(self, tmp_path):
+        """fork 後のワーカーでバックグラウンドのスレッドがすべて動いているテスト"""
+        from app import create_app
+        from app.services import structured_logging
+        from app.services.context_snapshot import snapshot_writer
+        from app.services.request_timing import slow_request_watchdog
+
+        create_app({
+            'TESTING': True,
+            'SLOW_REQUEST_THRESHOLD_MS': 1000,
+            'CONTEXT_SNAPSHOT_PATH': str(tmp_path / 'contexts.snap'),
+            'CONTEXT_SNAPSHOT_INTERVAL': 60,
+        })
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                post_fork(None, None)
+                listener = structured_logging._listener
+                report = {
+                    'threads': sorted(t.name for t in threading.enumerate()),
+                    'log_listener': listener is not None and listener._thread.is_alive(),
+                }
+                os.write(write_fd, json.dumps(report).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            report = json.loads(f.read() or '{}')
+        os.waitpid(pid, 0)
+        try:
+            assert 'slow-request-watchdog' in report['threads']
+            assert 'context-snapshot' in report['threads']
+            assert report['log_listener'] is True
+        finally:
+            slow_request_watchdog.stop()
+            snapshot_writer.configure('', 0)
@@ -0,0 +1,190 @@
+"""
+Structured Logging Tests
+
+キュー経由のログ出力と構造化ログのテスト
+"""
+
+from logging.handlers import QueueListener
+import io
+import json
+import logging
+import queue
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from app.services import metrics
+from app.services.structured_logging import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SamplingFilter,
+    TextFormatter,
+)
+
+
+class SlowStream(io.StringIO):
+    """書き込みのたびに待つ出力先（詰まったパイプの代わり）"""
+
+    def write(self, text):
+        time.sleep(0.05)
+        return super().write(text)
+
+
+@pytest.fixture
+def pipeline():
+    """テスト用のロガーにキュー経由のハンドラーを付ける"""
+    records = queue.Queue(100)
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    listener = QueueListener(records, output)
+    handler = NonBlockingQueueHandler(records)
+
+    logger = logging.getLogger('test.structured_logging')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    listener.start()
+    yield logger, handler, listener, stream
+    logger.removeHandler(handler)
+    if listener._thread is not None:
+        listener.stop()
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestQueueHandler:
+    """キュー経由の出力のテスト"""
+
+    def test_formatted_in_listener_thread(self, pipeline):
+        """メッセージの書式化は呼び出し元ではなく出力用のスレッドで行うテスト"""
+        logger, handler, listener, stream = pipeline
+        formatted_in = []
+        formatter = listener.handlers[0].formatter
+        original = formatter.format
+
+        def format(record):
+            formatted_in.append(threading.current_thread())
+            return original(record)
+
+        formatter.format = format
+        logger.info("value=%s", 'arg', extra={'fields': {'chars': 3}})
+        listener.stop()
+
+        assert formatted_in and threading.current_thread() not in formatted_in
+        record = lines(stream)[0]
+        assert (record['message'], record['chars'], record['level']) == ('value=arg', 3, 'INFO')
+
+    def test_prepare_keeps_args(self):
+        """キューに入れる前にメッセージを組み立てないテスト"""
+        record = logging.LogRecord('x', logging.INFO, __file__, 1, 'value=%s', ('arg',), None)
+
+        prepared = NonBlockingQueueHandler(queue.Queue()).prepare(record)
+
+        assert prepared is record
+        assert prepared.args == ('arg',) and not hasattr(prepared, 'message')
+
+    def test_slow_output_does_not_block(self):
+        """出力先が遅くても呼び出し元は待たないテスト"""
+        records = queue.Queue(100)
+        output = logging.StreamHandler(SlowStream())
+        listener = QueueListener(records, output)
+        logger = logging.getLogger('test.structured_logging.slow')
+        logger.propagate = False
+        handler = NonBlockingQueueHandler(records)
+        logger.addHandler(handler)
+        listener.start()
+        try:
+            started = time.perf_counter()
+            for i in range(10):
+                logger.warning("record %d", i)
+            elapsed = time.perf_counter() - started
+        finally:
+            logger.removeHandler(handler)
+            listener.stop()
+
+        assert elapsed < 0.05
+
+    def test_full_queue_drops(self):
+        """キューが一杯ならレコードを捨てて数えるテスト"""
+        handler = NonBlockingQueueHandler(queue.Queue(1))
+        logger = logging.getLogger('test.structured_logging.full')
+        logger.propagate = False
+        logger.addHandler(handler)
+        before = metrics.REGISTRY.get_sample_value('papi_log_records_dropped_total') or 0.0
+        try:
+            logger.warning("first")
+            logger.warning("second")
+        finally:
+            logger.removeHandler(handler)
+
+        assert metrics.REGISTRY.get_sample_value('papi_log_records_dropped_total') == before + 1
+
+    def test_exception_formatted(self, pipeline):
+        """例外のスタックをJSONに含めるテスト"""
+        logger, _, listener, stream = pipeline
+        try:
+            raise ValueError('boom')
+        except ValueError as e:
+            logger.exception("Unexpected error: %s", e)
+        listener.stop()
+
+        record = lines(stream)[0]
+        assert record['message'] == 'Unexpected error: boom'
+        assert 'ValueError: boom' in record['exc_info']
+
+
+class TestSampling:
+    """定型ログの間引きのテスト"""
+
+    def test_sampled_records(self):
+        """sampled の INFO だけを間引くテスト"""
+        sampling = SamplingFilter(0.0)
+
+        def record(level, sampled):
+            r = logging.LogRecord('x', level, __file__, 1, 'msg', None, None)
+            if sampled:
+                r.sampled = True
+            return r
+
+        assert sampling.filter(record(logging.INFO, True)) is False
+        assert sampling.filter(record(logging.INFO, False)) is True
+        assert sampling.filter(record(logging.WARNING, True)) is True
+        assert SamplingFilter(1.0).filter(record(logging.INFO, True)) is True
+
+
+class TestRequestId:
+    """リクエストIDのテスト"""
+
+    def test_request_id_header(self, client):
+        """X-Request-ID を引き継ぎ、無い・不正なら生成するテスト"""
+        given = client.get('/papi/health', headers={'X-Request-ID': 'gate-7.abc'})
+        generated = client.get('/papi/health')
+        invalid = client.get('/papi/health', headers={'X-Request-ID': 'bad id'})
+
+        assert given.headers['X-Request-ID'] == 'gate-7.abc'
+        assert len(generated.headers['X-Request-ID']) == 32
+        assert invalid.headers['X-Request-ID'] != 'bad id'
+
+    def test_records_carry_request_id(self, app, caplog):
+        """リクエスト中のレコードにリクエストIDと経過時間が付くテスト"""
+        @app.route('/papi/_log_test')
+        def _log_test():
+            logging.getLogger('test.structured_logging.request').warning("inside request")
+            return 'ok'
+
+        with caplog.at_level(logging.WARNING):
+            app.test_client().get('/papi/_log_test', headers={'X-Request-ID': 'req-1'})
+
+        record = next(r for r in caplog.records if r.getMessage() == 'inside request')
+        assert record.request_id == 'req-1'
+        assert record.elapsed_ms is not None
+        assert '[request_id=req-1]' in TextFormatter().format(record)
+
+    def test_invalid_format(self):
+        with pytest.raises(ValueError):
+            create_app({'TESTING': True, 'LOG_FORMAT': 'xml'})
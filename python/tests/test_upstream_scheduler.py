@@ -0,0 +1,229 @@
+"""
+Upstream Scheduler Tests
+
+上流リクエストのクラス別スケジューリングのテスト
+"""
+
+from unittest.mock import patch
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from app.services.qwen_mcp_client import QwenMCPClient, ChatCompletionResponse
+from app.services.upstream_scheduler import (
+    SchedulerTimeout,
+    UpstreamScheduler,
+    classify,
+    current_request_class,
+    parse_class_map,
+    upstream_scheduler,
+)
+
+
+def wait_until(predicate, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'condition not met'
+        time.sleep(0.001)
+
+
+def start_waiter(scheduler: UpstreamScheduler, request_class: str, order: list) -> threading.Thread:
+    """処理枠を待つスレッドを開始し、待ち行列に入るまで待つ"""
+    waiting = scheduler.snapshot()[request_class]['waiting']
+
+    def run():
+        with scheduler.slot(request_class):
+            order.append(request_class)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_until(lambda: scheduler.snapshot()[request_class]['waiting'] > waiting)
+    return thread
+
+
+class TestConfiguration:
+    """設定とクラス判定のテスト"""
+
+    def test_parse_class_map(self):
+        """「クラス:値」形式の設定のテスト"""
+        assert parse_class_map('interactive:4, bulk:1', int) == {'interactive': 4, 'bulk': 1}
+        assert parse_class_map('') == {}
+        assert parse_class_map('key:with:colon:bulk') == {'key:with:colon': 'bulk'}
+        with pytest.raises(ValueError):
+            parse_class_map('interactive')
+
+    def test_invalid_configuration(self):
+        """不明なクラスや予約枠の超過を拒否するテスト"""
+        with pytest.raises(ValueError):
+            UpstreamScheduler(max_concurrency=4, reservations={'urgent': 1})
+        with pytest.raises(ValueError):
+            UpstreamScheduler(max_concurrency=4, reservations={'interactive': 3, 'standard': 2})
+        with pytest.raises(ValueError):
+            UpstreamScheduler(weights={'bulk': 0})
+
+    def test_classify(self):
+        """ヘッダーと API キーからクラスを決めるテスト"""
+        keys = {'backoffice-key': 'bulk'}
+
+        assert classify({'X-Request-Class': 'Interactive'}, keys) == 'interactive'
+        assert classify({'X-Request-Class': 'urgent'}, keys) == 'standard'
+        assert classify({}, keys) == 'standard'
+        # API キーの対応表がヘッダーより優先される
+        assert classify({'X-API-Key': 'backoffice-key', 'X-Request-Class': 'interactive'}, keys) == 'bulk'
+
+
+class TestScheduling:
+    """処理枠の割り当てのテスト"""
+
+    def test_reservation_kept_for_interactive(self):
+        """予約枠は他のクラスに使われないテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=2, reservations={'interactive': 1}, queue_timeout=0.05)
+        scheduler.acquire('bulk')
+
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire('bulk')
+        scheduler.acquire('interactive')
+
+        assert scheduler.snapshot()['interactive']['active'] == 1
+        assert scheduler.snapshot()['bulk'] == {
+            'active': 1, 'waiting': 0, 'reserved': 0, 'limit': None, 'weight': 1,
+        }
+
+    def test_interactive_uses_shared_slots(self):
+        """予約枠を超えた分は共有枠を使うテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=3, reservations={'interactive': 1}, queue_timeout=0.05)
+
+        for _ in range(3):
+            scheduler.acquire('interactive')
+
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire('standard')
+
+    def test_class_limit(self):
+        """クラスごとの上限のテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=4, limits={'bulk': 1}, queue_timeout=0.05)
+        scheduler.acquire('bulk')
+
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire('bulk')
+        scheduler.acquire('standard')
+
+    def test_timeout_leaves_queue(self):
+        """待機がタイムアウトしたら待ち行列から外れるテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=1, queue_timeout=0.05)
+        scheduler.acquire('standard')
+
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire('bulk')
+
+        assert scheduler.snapshot()['bulk']['waiting'] == 0
+        scheduler.release('standard')
+        scheduler.acquire('bulk')
+
+    def test_weighted_order(self):
+        """待機中のクラスから重みに応じて選ぶテスト（同じクラスは到着順）"""
+        scheduler = UpstreamScheduler(max_concurrency=1, weights={'interactive': 8, 'bulk': 1})
+        scheduler.acquire('standard')
+        order = []
+        threads = [start_waiter(scheduler, 'bulk', order) for _ in range(3)]
+        threads += [start_waiter(scheduler, 'interactive', order) for _ in range(3)]
+
+        scheduler.release('standard')
+        for thread in threads:
+            thread.join(timeout=2)
+
+        assert order == ['interactive', 'bulk', 'interactive', 'interactive', 'bulk', 'bulk']
+
+    def test_disabled(self):
+        """max_concurrency=0 では待たないテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=0)
+
+        for _ in range(100):
+            scheduler.acquire('bulk')
+
+        assert scheduler.snapshot()['bulk']['active'] == 0
+
+    def test_disable_releases_waiters(self):
+        """無効化したら待機中のリクエストを通すテスト"""
+        scheduler = UpstreamScheduler(max_concurrency=1)
+        scheduler.acquire('standard')
+        order = []
+        thread = start_waiter(scheduler, 'bulk', order)
+
+        scheduler.configure(max_concurrency=0)
+        thread.join(timeout=2)
+
+        assert order == ['bulk']
+
+
+@pytest.fixture
+def scheduled_app():
+    app = create_app({
+        'TESTING': True,
+        'QWEN_MCP_URL': 'http://localhost:8080',
+        'QWEN_API_KEY': 'test_api_key',
+        'UPSTREAM_MAX_CONCURRENCY': 1,
+        'UPSTREAM_CLASS_RESERVATIONS': '',
+        'UPSTREAM_QUEUE_TIMEOUT': 0.05,
+        'REQUEST_CLASS_API_KEYS': 'kiosk-key:interactive',
+    })
+    yield app
+    create_app({'TESTING': True})
+
+
+class TestChatScheduling:
+    """/papi/chat からの上流呼び出しのテスト"""
+
+    def test_request_class_from_header(self, scheduled_app):
+        """ヘッダーと API キーのクラスで上流を呼ぶテスト"""
+        seen = []
+
+        def fake_request(self, endpoint, payload, headers):
+            seen.append(current_request_class())
+            return ChatCompletionResponse(content='応答', finish_reason='stop')
+
+        client = scheduled_app.test_client()
+        with patch.object(QwenMCPClient, '_make_request', fake_request):
+            client.post('/papi/chat', json={'message': 'テスト'}, headers={'X-Request-Class': 'bulk'})
+            client.post('/papi/chat', json={'message': 'テスト'}, headers={'X-API-Key': 'kiosk-key'})
+            client.post('/papi/chat', json={'message': 'テスト'})
+
+        assert seen == ['bulk', 'interactive', 'standard']
+        assert upstream_scheduler.snapshot()['bulk']['active'] == 0
+
+    def test_server_busy(self, scheduled_app):
+        """処理枠を確保できなければ 503 SERVER_BUSY を返すテスト"""
+        upstream_scheduler.acquire('interactive')
+        try:
+            with patch.object(QwenMCPClient, '_make_request') as mock_request:
+                response = scheduled_app.test_client().post('/papi/chat', json={'message': 'テスト'})
+        finally:
+            upstream_scheduler.release('interactive')
+
+        assert response.status_code == 503
+        assert response.get_json()['error']['code'] == 'SERVER_BUSY'
+        assert 'queue;dur=' in response.headers['Server-Timing']
+        mock_request.assert_not_called()
+
+    def test_slot_released_between_retries(self, scheduled_app):
+        """リトライのバックオフ中は処理枠を保持しないテスト"""
+        from app.services.qwen_mcp_client import QwenMCPError
+
+        active_during_sleep = []
+        request_thread = threading.current_thread()
+
+        def fake_sleep(seconds):
+            # time.sleep はモジュール共通なので、他のスレッド（遅延リクエストの監視など）の呼び出しは除く
+            if threading.current_thread() is request_thread:
+                active_during_sleep.append(upstream_scheduler.snapshot()['standard']['active'])
+
+        with patch.object(QwenMCPClient, '_make_request', side_effect=[
+            QwenMCPError.connection_failed('down'),
+            ChatCompletionResponse(content='応答', finish_reason='stop'),
+        ]), patch('app.services.qwen_mcp_client.time.sleep', fake_sleep):
+            response = scheduled_app.test_client().post('/papi/chat', json={'message': 'テスト'})
+
+        assert response.status_code == 200
+        assert active_during_sleep == [0]